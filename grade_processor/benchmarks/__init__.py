@@ -0,0 +1 @@
+# Offline benchmarks for the OMR pipeline (run with python -m grade_processor.benchmarks.<name>)
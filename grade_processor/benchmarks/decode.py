@@ -0,0 +1,130 @@
+"""
+Decode-stage benchmark: full colour imread versus reduced grayscale decode.
+
+Each mode runs in a fresh process so peak RSS is not polluted by the other.
+
+Usage (from repo root):
+    python -m grade_processor.benchmarks.decode [image ...] [--repeat N] [--json]
+
+Without images, a synthetic 12-megapixel phone-style JPEG is generated.
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from grade_processor.omr_main import SHEET_HEIGHT, SHEET_WIDTH, decode_sheet
+
+
+def _decode_full_colour(path):
+    """The decode stage as process_omr_image used to run it."""
+    img = cv2.imread(str(path))
+    img = cv2.resize(img, (SHEET_WIDTH, SHEET_HEIGHT))
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+MODES = {
+    'full-colour': _decode_full_colour,
+    'reduced-grayscale': decode_sheet,
+}
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MiB, or None if unavailable."""
+    # VmHWM starts fresh after exec; ru_maxrss on Linux inherits the parent's peak
+    status = Path('/proc/self/status')
+    if status.exists():
+        for line in status.read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _run_mode(mode, paths, repeat, queue):
+    decode = MODES[mode]
+    baseline_rss = _peak_rss_mb()
+
+    timings = []
+    for path in paths:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            decode(path)
+            timings.append((time.perf_counter() - start) * 1000)
+
+    peak_rss = _peak_rss_mb()
+    queue.put(
+        {
+            'mode': mode,
+            'sheets': len(paths),
+            'decode_ms_median': round(statistics.median(timings), 2),
+            'decode_ms_p95': round(sorted(timings)[math.ceil(0.95 * len(timings)) - 1], 2),
+            'peak_rss_delta_mb': round(peak_rss - baseline_rss, 1) if peak_rss is not None else None,
+        }
+    )
+
+
+def _synthetic_photo(directory, width=4032, height=3024):
+    """Write a 12 MP landscape JPEG with sheet-like content and return its path."""
+    img = np.full((height, width, 3), 235, dtype=np.uint8)
+    cv2.rectangle(img, (width // 4, height // 8), (3 * width // 4, 7 * height // 8), (20, 20, 20), 12)
+    for row in range(20):
+        for col in range(5):
+            centre = (width // 4 + 200 + col * 380, height // 8 + 120 + row * 110)
+            cv2.circle(img, centre, 40, (20, 20, 20), 6)
+    noise = np.random.default_rng(0).integers(0, 12, img.shape, dtype=np.uint8)
+    path = Path(directory) / 'synthetic_12mp.jpg'
+    cv2.imwrite(str(path), cv2.add(img, noise), [cv2.IMWRITE_JPEG_QUALITY, 92])
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('images', nargs='*', help='Sheet photos to decode (default: synthetic 12 MP JPEG)')
+    parser.add_argument('--repeat', type=int, default=5, help='Decodes per image and mode')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable JSON')
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [str(p) for p in args.images] or [str(_synthetic_photo(tmp))]
+
+        results = []
+        for mode in MODES:
+            queue = context.Queue()
+            process = context.Process(target=_run_mode, args=(mode, paths, args.repeat, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'mode':<20}{'median ms':>12}{'p95 ms':>10}{'peak RSS MiB':>15}")
+    for row in results:
+        print(
+            f"{row['mode']:<20}{row['decode_ms_median']:>12}{row['decode_ms_p95']:>10}"
+            f"{str(row['peak_rss_delta_mb']):>15}"
+        )
+
+
+if __name__ == '__main__':
+    main()
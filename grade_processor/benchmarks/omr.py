@@ -0,0 +1,445 @@
+"""
+OMR benchmark and accuracy suite on synthetic answer sheets.
+
+Sheets are drawn from the same layout the PDF generator prints
+(pdf_generator.layout plus the corner markers), filled with known marks and
+photographed synthetically: perspective warps, blur, JPEG noise and uneven
+lighting, at several resolutions and question counts. Every scenario runs in
+a fresh process so peak RSS belongs to that scenario alone.
+
+Usage (from repo root):
+    python -m grade_processor.benchmarks.omr [--sheets N] [--quick] [--json]
+    python -m grade_processor.benchmarks.omr --update-baseline
+
+The run exits with status 1 when accuracy, latency or memory regress against
+the stored baseline (omr_baseline.json next to this file).
+"""
+import argparse
+import importlib.metadata
+import json
+import math
+import multiprocessing
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import qrcode
+
+from grade_processor.benchmarks.decode import _peak_rss_mb
+from grade_processor.omr_main import process_omr_image
+from pdf_generator.layout import BUBBLE_RADIUS, box_size, bubble_centre, sheet_geometry
+
+SUITE_VERSION = 1
+
+BASELINE_PATH = Path(__file__).with_name('omr_baseline.json')
+
+REQUIREMENTS_PATH = Path(__file__).resolve().parents[2] / 'requirements.txt'
+# Packages whose versions change OMR timings and results; a baseline is only recorded with the pinned ones
+PINNED_PACKAGES = ('numpy', 'opencv-python')
+
+A4_CM = (21.0, 29.7)
+
+# Where generate_test_pdf puts the answer box's top-left corner on the page, in cm
+BOX_ORIGIN_CM = (3.3, 7.8)
+
+# The test id QR code generate_test_pdf draws at (350pt, 650pt), 150pt square
+QR_ORIGIN_CM = (12.35, 1.48)
+QR_SIZE_CM = 5.29
+
+# Printed marker sizes from pdf_generator.draw_fiducials, in cm
+FIDUCIAL_SIZE_CM = 0.7
+FIDUCIAL_HOLE_CM = 0.3
+
+DARKNESS_THRESHOLD = 0.6
+
+DISTORTIONS = ('clean', 'perspective', 'blur', 'jpeg', 'lighting', 'combined')
+RESOLUTIONS_DPI = (100, 150, 220)
+LAYOUTS = ((10, 4), (20, 5))
+
+# Stages process_omr_image traces, in pipeline order (the contour ones only run when the markers are not found)
+STAGES = ('decode', 'resize', 'cvtcolor', 'blur', 'markers', 'warp', 'canny', 'contours', 'contour_select',
+          'threshold', 'detect')
+
+# Allowed drops (absolute) and slowdowns (relative) before a scenario counts as regressed
+ACCURACY_TOLERANCE = 0.005
+LATENCY_TOLERANCE = 1.0
+MEMORY_TOLERANCE = 0.25
+MEMORY_SLACK_MB = 8.0
+
+
+def _cm_to_px(value, dpi):
+    return value * dpi / 2.54
+
+
+def _random_marks(rng, num_questions, num_options):
+    """Mostly single answers, with some blank and some multiple-answer questions."""
+    marks = np.zeros((num_questions, num_options), dtype=bool)
+    for question in range(num_questions):
+        kind = rng.random()
+        if kind < 0.1:
+            continue
+        count = 2 if kind > 0.85 else 1
+        marks[question, rng.choice(num_options, size=count, replace=False)] = True
+    return marks
+
+
+def render_sheet(marks, dpi, rng):
+    """
+    Draw a printed and filled answer sheet as a flat grayscale page.
+
+    Args:
+        marks: (num_questions, num_options) bool array of filled bubbles
+        dpi: Page resolution
+        rng: numpy Generator for the pen jitter
+
+    Returns:
+        Grayscale uint8 ndarray of an A4 page
+    """
+    num_questions, num_options = marks.shape
+    width, height = (round(_cm_to_px(side, dpi)) for side in A4_CM)
+    page = np.full((height, width), 245, dtype=np.uint8)
+    px = lambda value: int(round(_cm_to_px(value, dpi)))  # noqa: E731
+    line = max(1, px(0.03))
+
+    # Title, name lines and QR code the localizer has to ignore
+    cv2.putText(page, 'Benchmark test', (px(2), px(2.3)), cv2.FONT_HERSHEY_SIMPLEX, dpi / 110, 30, line + 1)
+    for y in (3.8, 5.8):
+        cv2.line(page, (px(4), px(y)), (px(10), px(y)), 40, line)
+    qr_image = qrcode.make(str(rng.integers(1, 10000))).convert('L')
+    qr = cv2.resize(np.asarray(qr_image), (px(QR_SIZE_CM), px(QR_SIZE_CM)), interpolation=cv2.INTER_NEAREST)
+    qr_x, qr_y = px(QR_ORIGIN_CM[0]), px(QR_ORIGIN_CM[1])
+    page[qr_y:qr_y + qr.shape[0], qr_x:qr_x + qr.shape[1]] = qr
+
+    box_width, box_height = box_size(num_questions, num_options)
+    left, top = BOX_ORIGIN_CM
+    cv2.rectangle(page, (px(left), px(top)), (px(left + box_width), px(top + box_height)), 20, line)
+
+    size = FIDUCIAL_SIZE_CM
+    for x, y in ((left - size, top - size), (left + box_width, top - size),
+                 (left + box_width, top + box_height), (left - size, top + box_height)):
+        cv2.rectangle(page, (px(x), px(y)), (px(x + size), px(y + size)), 0, -1)
+    hole = (left - size + (size - FIDUCIAL_HOLE_CM) / 2, top - size + (size - FIDUCIAL_HOLE_CM) / 2)
+    cv2.rectangle(page, (px(hole[0]), px(hole[1])), (px(hole[0] + FIDUCIAL_HOLE_CM), px(hole[1] + FIDUCIAL_HOLE_CM)),
+                  245, -1)
+
+    for option in range(num_options):
+        x, _ = bubble_centre(0, option)
+        cv2.putText(page, chr(65 + option), (px(left + x - 0.12), px(top - 0.1)), cv2.FONT_HERSHEY_SIMPLEX,
+                    dpi / 250, 20, line)
+
+    for question in range(num_questions):
+        _, y = bubble_centre(question, 0)
+        cv2.putText(page, f'{question + 1}.', (px(2.5), px(top + y + 0.1)), cv2.FONT_HERSHEY_SIMPLEX, dpi / 250, 20,
+                    line)
+        for option in range(num_options):
+            x, y = bubble_centre(question, option)
+            centre = (px(left + x), px(top + y))
+            cv2.circle(page, centre, px(BUBBLE_RADIUS), 20, line)
+            if marks[question, option]:
+                # A pen fill: slightly off-centre, not perfectly round, not perfectly black
+                jitter = rng.normal(0, 0.03, 2)
+                axes = (px(BUBBLE_RADIUS * rng.uniform(0.85, 1.0)), px(BUBBLE_RADIUS * rng.uniform(0.85, 1.0)))
+                fill_centre = (px(left + x + jitter[0]), px(top + y + jitter[1]))
+                cv2.ellipse(page, fill_centre, axes, rng.uniform(0, 180), 0, 360, int(rng.integers(15, 70)), -1)
+
+    return page
+
+
+def photograph(page, distortion, rng):
+    """
+    Turn a flat page into a photo-like JPEG with the given distortion.
+
+    Returns:
+        Encoded JPEG bytes
+    """
+    dpi_scale = page.shape[1] / _cm_to_px(A4_CM[0], 100)
+    img = page
+    quality = 90
+
+    if distortion in ('perspective', 'combined'):
+        height, width = page.shape
+        pad = int(0.12 * max(width, height))
+        canvas_size = (width + 2 * pad, height + 2 * pad)
+        src = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype='float32')
+        dst = (src + pad + rng.uniform(-0.06, 0.06, (4, 2)) * [width, height]).astype('float32')
+        matrix = cv2.getPerspectiveTransform(src, dst)
+        desk = rng.normal(110, 12, (canvas_size[1], canvas_size[0])).clip(0, 255).astype(np.uint8)
+        img = cv2.warpPerspective(page, matrix, canvas_size, borderMode=cv2.BORDER_TRANSPARENT, dst=desk)
+
+    if distortion in ('blur', 'combined'):
+        img = cv2.GaussianBlur(img, (0, 0), rng.uniform(0.8, 1.6) * dpi_scale)
+
+    if distortion in ('lighting', 'combined'):
+        height, width = img.shape
+        ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+        angle = rng.uniform(0, 2 * np.pi)
+        ramp = (xs / width - 0.5) * np.cos(angle) + (ys / height - 0.5) * np.sin(angle)
+        vignette = ((xs / width - 0.5) ** 2 + (ys / height - 0.5) ** 2) * 0.4
+        gain = np.clip(0.85 + 0.3 * ramp - vignette, 0.5, 1.1)
+        img = np.clip(img * gain, 0, 255).astype(np.uint8)
+
+    if distortion in ('jpeg', 'combined'):
+        noise = rng.normal(0, 6, img.shape)
+        img = np.clip(img + noise, 0, 255).astype(np.uint8)
+        quality = int(rng.integers(30, 55))
+
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError('Could not encode synthetic sheet')
+    return encoded.tobytes()
+
+
+def build_scenario(distortion, dpi, num_questions, num_options, sheets, seed):
+    """Generate sheets for one scenario; returns (list of JPEG bytes, (N, Q, O) ground-truth marks)."""
+    rng = np.random.default_rng([seed, DISTORTIONS.index(distortion), dpi, num_questions, num_options])
+    images, truth = [], []
+    for _ in range(sheets):
+        marks = _random_marks(rng, num_questions, num_options)
+        images.append(photograph(render_sheet(marks, dpi, rng), distortion, rng))
+        truth.append(marks)
+    return images, np.array(truth)
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    pick = lambda q: ordered[max(0, math.ceil(q * len(ordered)) - 1)]  # noqa: E731
+    return {
+        'p50': round(statistics.median(ordered), 3),
+        'p90': round(pick(0.90), 3),
+        'p99': round(pick(0.99), 3),
+        'mean': round(statistics.fmean(ordered), 3),
+    }
+
+
+def _run_scenario(scenario, images, truth, queue):
+    num_questions, num_options = scenario['num_questions'], scenario['num_options']
+    geometry = sheet_geometry(num_questions, num_options)
+
+    # Warm up lazily built lookup tables so the first sheet isn't an outlier
+    process_omr_image(images[0], num_questions, num_options, DARKNESS_THRESHOLD, geometry=geometry)
+    baseline_rss = _peak_rss_mb()
+
+    stage_ms = {stage: [] for stage in STAGES}
+    total_ms = []
+    localized = by_markers = 0
+    bubbles_right = bubbles_total = false_marks = missed_marks = 0
+    sheets_right = 0
+
+    started = time.perf_counter()
+    for image, expected in zip(images, truth):
+        start = time.perf_counter()
+        result = process_omr_image(image, num_questions, num_options, DARKNESS_THRESHOLD, geometry=geometry,
+                                   trace=True)
+        total_ms.append((time.perf_counter() - start) * 1000)
+
+        trace = result['trace']
+        for stage, seconds in trace['stages'].items():
+            stage_ms[stage].append(seconds * 1000)
+        by_markers += trace['details'].get('localization') == 'markers'
+
+        if not result['success']:
+            continue
+        localized += 1
+        detected = np.asarray(result['fill_ratios']) > DARKNESS_THRESHOLD
+        bubbles_right += int((detected == expected).sum())
+        bubbles_total += expected.size
+        false_marks += int((detected & ~expected).sum())
+        missed_marks += int((~detected & expected).sum())
+        sheets_right += bool((detected == expected).all())
+    elapsed = time.perf_counter() - started
+    peak_rss = _peak_rss_mb()
+
+    queue.put({
+        **scenario,
+        'image_bytes_mean': round(statistics.fmean(len(image) for image in images)),
+        'latency_ms': {
+            'total': _percentiles(total_ms),
+            **{stage: _percentiles(values) for stage, values in stage_ms.items() if values},
+        },
+        'throughput_sheets_per_s': round(len(images) / elapsed, 2),
+        'peak_rss_delta_mb': round(peak_rss - baseline_rss, 1) if peak_rss is not None else None,
+        'localized_fraction': round(localized / len(images), 4),
+        'marker_fraction': round(by_markers / len(images), 4),
+        'bubble_accuracy': round(bubbles_right / bubbles_total, 5) if bubbles_total else None,
+        'false_marks': false_marks,
+        'missed_marks': missed_marks,
+        'sheet_accuracy': round(sheets_right / len(images), 4),
+    })
+
+
+def run_suite(sheets, seed=0, distortions=DISTORTIONS, resolutions=RESOLUTIONS_DPI, layouts=LAYOUTS):
+    """
+    Run every scenario, each in its own process.
+
+    Returns:
+        JSON-serializable dict with environment, configuration and per-scenario results
+    """
+    context = multiprocessing.get_context('spawn')
+    scenarios = []
+    for distortion in distortions:
+        for dpi in resolutions:
+            for num_questions, num_options in layouts:
+                scenario = {
+                    'name': f'{distortion}-{dpi}dpi-{num_questions}x{num_options}',
+                    'distortion': distortion,
+                    'dpi': dpi,
+                    'num_questions': num_questions,
+                    'num_options': num_options,
+                    'sheets': sheets,
+                }
+                images, truth = build_scenario(distortion, dpi, num_questions, num_options, sheets, seed)
+
+                queue = context.Queue()
+                process = context.Process(target=_run_scenario, args=(scenario, images, truth, queue))
+                process.start()
+                scenarios.append(queue.get())
+                process.join()
+
+    return {
+        'suite': 'omr',
+        'version': SUITE_VERSION,
+        'seed': seed,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+        },
+        'scenarios': scenarios,
+    }
+
+
+def compare(results, baseline, accuracy_tolerance=ACCURACY_TOLERANCE, latency_tolerance=LATENCY_TOLERANCE,
+            memory_tolerance=MEMORY_TOLERANCE):
+    """
+    Compare a run against a baseline run.
+
+    A latency_tolerance or memory_tolerance of None skips that check, which
+    is useful when the baseline was recorded on different hardware.
+
+    Returns:
+        List of human-readable regression messages (empty when nothing regressed)
+    """
+    previous = {scenario['name']: scenario for scenario in baseline.get('scenarios', [])}
+    regressions = []
+
+    for scenario in results['scenarios']:
+        base = previous.get(scenario['name'])
+        if base is None:
+            continue
+        name = scenario['name']
+
+        for metric in ('localized_fraction', 'marker_fraction', 'bubble_accuracy', 'sheet_accuracy'):
+            if base.get(metric) is None:
+                continue
+            current = scenario.get(metric) or 0.0
+            if current < base[metric] - accuracy_tolerance:
+                regressions.append(f'{name}: {metric} {current} < baseline {base[metric]}')
+
+        if latency_tolerance is not None:
+            current = scenario['latency_ms']['total']['p50']
+            allowed = base['latency_ms']['total']['p50'] * (1 + latency_tolerance)
+            if current > allowed:
+                regressions.append(f'{name}: p50 latency {current} ms > {allowed:.3f} ms allowed')
+
+        if memory_tolerance is not None and None not in (scenario['peak_rss_delta_mb'], base['peak_rss_delta_mb']):
+            allowed = base['peak_rss_delta_mb'] * (1 + memory_tolerance) + MEMORY_SLACK_MB
+            if scenario['peak_rss_delta_mb'] > allowed:
+                regressions.append(
+                    f"{name}: peak RSS delta {scenario['peak_rss_delta_mb']} MiB > {allowed:.1f} MiB allowed"
+                )
+
+    return regressions
+
+
+def unpinned_packages(requirements_path=REQUIREMENTS_PATH, packages=PINNED_PACKAGES):
+    """
+    Compare the installed PINNED_PACKAGES with their pins in requirements.txt.
+
+    Returns:
+        List of 'package installed != pinned' messages (empty when everything matches)
+    """
+    pins = {}
+    for line in requirements_path.read_text().splitlines():
+        name, _, version = line.split('#')[0].strip().partition('==')
+        if version:
+            pins[name.strip().lower()] = version.strip()
+
+    mismatches = []
+    for package in packages:
+        try:
+            installed = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            installed = 'not installed'
+        if installed != pins.get(package):
+            mismatches.append(f'{package} {installed} != pinned {pins.get(package)}')
+    return mismatches
+
+
+def _print_table(results):
+    print(f"{'scenario':<32}{'p50 ms':>9}{'p99 ms':>9}{'sheets/s':>10}{'RSS MiB':>9}{'markers':>9}{'bubble acc':>12}")
+    for row in results['scenarios']:
+        total = row['latency_ms']['total']
+        print(
+            f"{row['name']:<32}{total['p50']:>9}{total['p99']:>9}{row['throughput_sheets_per_s']:>10}"
+            f"{str(row['peak_rss_delta_mb']):>9}{row['marker_fraction']:>9}{str(row['bubble_accuracy']):>12}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sheets', type=int, default=10, help='Sheets per scenario')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for marks and distortions')
+    parser.add_argument('--quick', action='store_true', help='One resolution and layout per distortion')
+    parser.add_argument('--json', action='store_true', help='Print machine-readable JSON')
+    parser.add_argument('--output', type=Path, help='Also write the JSON results to this file')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH, help='Baseline JSON to compare against')
+    parser.add_argument('--update-baseline', action='store_true', help='Write this run as the new baseline')
+    parser.add_argument('--no-timing-check', action='store_true',
+                        help='Only fail on accuracy regressions (baseline recorded on other hardware)')
+    args = parser.parse_args(argv)
+
+    mismatches = unpinned_packages()
+    if args.update_baseline and mismatches:
+        # Checked before the run, so a baseline from other library versions is never written
+        parser.exit(2, f"Not recording a baseline: {'; '.join(mismatches)}. Install requirements.txt first.\n")
+    for message in mismatches:
+        print(f'Warning: {message}; timings may not match the baseline', file=sys.stderr)
+
+    options = {'resolutions': RESOLUTIONS_DPI[1:2], 'layouts': LAYOUTS[-1:]} if args.quick else {}
+    results = run_suite(args.sheets, args.seed, **options)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    regressions = []
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + '\n')
+    elif args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get('version') == SUITE_VERSION and baseline.get('seed') == args.seed:
+            tolerances = {'latency_tolerance': None, 'memory_tolerance': None} if args.no_timing_check else {}
+            regressions = compare(results, baseline, **tolerances)
+        else:
+            print('Baseline was recorded with a different suite version or seed; not comparing', file=sys.stderr)
+
+    if args.json:
+        print(json.dumps({**results, 'regressions': regressions}, indent=2))
+    else:
+        _print_table(results)
+        for message in regressions:
+            print(f'REGRESSION {message}', file=sys.stderr)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
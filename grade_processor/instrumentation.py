@@ -0,0 +1,264 @@
+"""
+Optional timing and counters for the OMR pipeline.
+
+process_omr_image(..., trace=True) records how long each stage took, image
+dimensions, contour counts and the stage a failure happened in, and attaches
+that trace to its result. Traces are aggregated into in-process histograms
+with observe_trace() and exported in the Prometheus text format with
+render_prometheus().
+
+Histograms live in the process that observes them; with several web server
+processes, each one exports its own.
+"""
+import bisect
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Upper bounds of the contour count and decoded image size histogram buckets
+CONTOUR_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+MEGAPIXEL_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 12, 16, 24, 48)
+
+
+class Trace:
+    """Stage durations and details of one run through the pipeline."""
+
+    __slots__ = ('stages', 'details', 'failed_stage')
+
+    def __init__(self):
+        self.stages = {}
+        self.details = {}
+        self.failed_stage = None
+
+    def stage(self, name):
+        """Context manager timing one stage; an exception escaping it marks the stage as failed."""
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        """Add time measured elsewhere to a stage, e.g. this run's share of a batched step."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def note(self, key, value):
+        """Record a detail such as an image dimension or a contour count."""
+        self.details[key] = value
+
+    def fail(self, stage):
+        """Record the stage a failure happened in, unless one is already recorded."""
+        if self.failed_stage is None:
+            self.failed_stage = stage
+
+    def as_dict(self):
+        """Return the trace as a JSON-serializable dict (stage durations in seconds)."""
+        return {
+            'stages': {name: round(seconds, 6) for name, seconds in self.stages.items()},
+            'total': round(sum(self.stages.values()), 6),
+            'details': dict(self.details),
+            'failed_stage': self.failed_stage,
+        }
+
+
+class _Stage:
+    __slots__ = ('trace', 'name', 'start')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        stages = self.trace.stages
+        stages[self.name] = stages.get(self.name, 0.0) + time.perf_counter() - self.start
+        if exc_type is not None:
+            self.trace.fail(self.name)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class _NullTrace:
+    """Stand-in used when tracing is off, so the hot path only pays for no-op calls."""
+
+    __slots__ = ()
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def add(self, name, seconds):
+        pass
+
+    def note(self, key, value):
+        pass
+
+    def fail(self, stage):
+        pass
+
+    def as_dict(self):
+        return None
+
+
+NULL_TRACE = _NullTrace()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._series[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            series = sorted((key, list(counts), total) for key, (counts, total) in self._series.items())
+
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', key + (('le', _format_number(float(bound))),), cumulative))
+            samples.append((f'{self.name}_sum', key, total))
+            samples.append((f'{self.name}_count', key, cumulative))
+        return samples
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f'Metric {metric.name} is already registered as a {existing.kind}')
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name, documentation):
+    """Return the counter registered under name, creating it on first use."""
+    return _register(Counter(name, documentation))
+
+
+def histogram(name, documentation, buckets=SECONDS_BUCKETS):
+    """Return the histogram registered under name, creating it on first use."""
+    return _register(Histogram(name, documentation, buckets))
+
+
+STAGE_SECONDS = histogram('omr_stage_seconds', 'Time spent in each OMR pipeline stage.')
+SHEET_SECONDS = histogram('omr_sheet_seconds', 'Time spent reading one sheet, all stages included.')
+SHEETS = counter('omr_sheets_total', 'Sheets run through the OMR, by outcome and failed stage.')
+CONTOURS = histogram('omr_contours', 'Contours found by the fallback contour search.', CONTOUR_BUCKETS)
+IMAGE_MEGAPIXELS = histogram('omr_decoded_megapixels', 'Size of each photo as decoded.', MEGAPIXEL_BUCKETS)
+
+
+def observe_trace(trace):
+    """Add a process_omr_image trace (as returned in its result) to the histograms."""
+    if not trace:
+        return
+
+    for stage, seconds in trace['stages'].items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    if trace['stages']:
+        SHEET_SECONDS.observe(trace['total'])
+
+    details = trace['details']
+    SHEETS.inc(
+        outcome='failure' if trace['failed_stage'] else 'success',
+        failed_stage=trace['failed_stage'] or '',
+        localization=details.get('localization', ''),
+    )
+    if 'contours' in details:
+        CONTOURS.observe(details['contours'])
+    if 'decoded_width' in details:
+        IMAGE_MEGAPIXELS.observe(details['decoded_width'] * details['decoded_height'] / 1e6)
+
+
+def render_prometheus():
+    """Return every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+
+    lines = []
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {_escape(metric.documentation)}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Clear all recorded values (metrics stay registered)."""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        with metric._lock:
+            if isinstance(metric, Histogram):
+                metric._series.clear()
+            else:
+                metric._values.clear()
@@ -0,0 +1,252 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from .instrumentation import observe_trace
+from .omr_main import process_omr_image
+from .scheduler import BULK, get_scheduler, shutdown_scheduler
+
+# OpenCV threads per worker process. The pool already runs one sheet per core,
+# so letting each worker spawn its own thread pool would oversubscribe the CPU.
+WORKER_CV_THREADS = 1
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def default_worker_count():
+    """Return the number of worker processes to use when none is configured."""
+    return max(1, os.cpu_count() or 1)
+
+
+def _init_worker(cv_threads):
+    """Pool initializer: cap OpenCV's internal threading in each worker."""
+    cv2.setNumThreads(cv_threads)
+
+
+def _warm_up(_):
+    """Run a tiny image through the pipeline so imports and OpenCV kernels are loaded."""
+    process_omr_image(np.zeros((16, 16), dtype=np.uint8), num_questions=1, num_options=1)
+    return os.getpid()
+
+
+def get_pool(max_workers=None):
+    """
+    Return the shared, pre-warmed process pool, creating it on first use.
+
+    The pool is recreated if a different worker count is requested.
+    """
+    global _pool, _pool_workers
+
+    workers = max_workers or default_worker_count()
+    with _pool_lock:
+        if _pool is not None and _pool_workers == workers:
+            return _pool
+
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+
+        # spawn avoids forking a multi-threaded web worker process
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(WORKER_CV_THREADS,),
+        )
+        _pool_workers = workers
+
+        # Submitting one task per worker at once makes the executor start every process now
+        list(_pool.map(_warm_up, range(workers)))
+        return _pool
+
+
+def shutdown_pool(expected=None, wait=True):
+    """
+    Stop the shared pool, if one is running.
+
+    With expected, the pool is only stopped if it is still that executor, so a
+    caller holding a broken pool never stops the healthy one that replaced it.
+    """
+    global _pool, _pool_workers
+
+    with _pool_lock:
+        if expected is not None and _pool is not expected:
+            return
+        pool = _pool
+        _pool = None
+        _pool_workers = 0
+
+    if pool is not None:
+        pool.shutdown(wait=wait, cancel_futures=True)
+
+
+atexit.register(shutdown_pool)
+atexit.register(shutdown_scheduler)
+
+
+def _share_array(image):
+    """Copy an ndarray into a new shared memory block and return (block, descriptor)."""
+    image = np.ascontiguousarray(image)
+    block = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+    view = np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)
+    view[...] = image
+    del view
+    return block, ('shm', block.name, image.shape, image.dtype.str)
+
+
+def _share_bytes(data):
+    """Copy encoded image bytes into a new shared memory block and return (block, descriptor)."""
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    block.buf[:len(data)] = data
+    return block, ('shm-bytes', block.name, len(data))
+
+
+def _to_source(image):
+    """Return (shared memory block or None, picklable source descriptor) for an input image."""
+    if isinstance(image, np.ndarray):
+        return _share_array(image)
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return _share_bytes(image)
+    return None, ('path', str(image))
+
+
+def _process_source(source, options):
+    """Worker entry point: resolve a path or shared memory descriptor and run the OMR."""
+    kind = source[0]
+    if kind == 'path':
+        return process_omr_image(source[1], **options)
+
+    block = shared_memory.SharedMemory(name=source[1])
+    try:
+        if kind == 'shm-bytes':
+            image = block.buf[:source[2]]
+        else:
+            image = np.ndarray(source[2], dtype=np.dtype(source[3]), buffer=block.buf)
+        try:
+            return process_omr_image(image, **options)
+        finally:
+            if isinstance(image, memoryview):
+                image.release()
+            del image
+    finally:
+        block.close()
+
+
+def process_omr_images(images, num_questions=20, num_options=5, darkness_threshold=0.6, max_workers=None,
+                       geometry=None, trace=False, priority=BULK, owner=None, max_bulk_in_flight=None,
+                       derivatives=False):
+    """
+    Process many OMR images in parallel and return results in input order.
+
+    With more than one worker, sheets are queued in the process-wide scheduler
+    (see scheduler.py): INTERACTIVE sheets start before any queued BULK sheet,
+    and BULK sheets are shared out fairly between owners.
+
+    Args:
+        images: Iterable of image paths, encoded image bytes or decoded ndarrays
+        num_questions: Number of questions on the test
+        num_options: Number of options per question
+        darkness_threshold: Fraction of bubble that must be filled
+        max_workers: Worker processes to use (default: one per CPU core)
+        geometry: Sheet geometry the sheets were printed with (default: current layout)
+        trace: Attach a per-stage trace to each result and add it to this process's histograms
+        priority: INTERACTIVE for a sheet someone is waiting on, BULK for uploaded batches
+        owner: Who the sheets are graded for (e.g. the teacher's id); bulk sheets are round-robined by owner
+        max_bulk_in_flight: Bulk sheets allowed in the pool at once (default: all workers but one)
+        derivatives: Return JPEG review images with each successfully read sheet
+
+    Returns:
+        List of process_omr_image result dicts, one per input image
+    """
+    images = list(images)
+    options = {
+        'num_questions': num_questions,
+        'num_options': num_options,
+        'darkness_threshold': darkness_threshold,
+        'geometry': geometry,
+        'trace': trace,
+        'derivatives': derivatives,
+    }
+
+    workers = max_workers or default_worker_count()
+    if workers <= 1 or (len(images) <= 1 and priority == BULK):
+        results = [process_omr_image(image, **options) for image in images]
+    else:
+        results = _process_in_pool(images, options, workers, priority, owner, max_bulk_in_flight)
+
+    # Traces come back from the workers with the results; histograms are kept by the calling process
+    if trace:
+        for result in results:
+            observe_trace(result.get('trace'))
+    return results
+
+
+def _worker_failure(error, trace):
+    """Result for a sheet whose worker failed before process_omr_image could return."""
+    result = {'success': False, 'error': error, 'answers': None}
+    if trace:
+        result['trace'] = {'stages': {}, 'total': 0.0, 'details': {}, 'failed_stage': 'worker'}
+    return result
+
+
+def _mark_broken(exc, pool):
+    """Record on a BrokenProcessPool which executor raised it."""
+    if isinstance(exc, BrokenProcessPool):
+        exc.executor = pool
+
+
+def _submit_to_pool(workers, source, options):
+    pool = get_pool(workers)
+    try:
+        future = pool.submit(_process_source, source, options)
+    except BrokenProcessPool as exc:
+        _mark_broken(exc, pool)
+        raise
+    future.add_done_callback(lambda done: done.cancelled() or _mark_broken(done.exception(), pool))
+    return future
+
+
+def _process_in_pool(images, options, workers, priority, owner, max_bulk_in_flight):
+    """Run process_omr_image over images in the shared pool, passing images through shared memory."""
+    scheduler = get_scheduler(
+        lambda source, source_options: _submit_to_pool(workers, source, source_options),
+        workers,
+        max_bulk_in_flight,
+    )
+    blocks = []
+    futures = []
+    broken = set()
+    try:
+        for image in images:
+            block, source = _to_source(image)
+            if block is not None:
+                blocks.append(block)
+            futures.append(scheduler.submit(source, options, priority, owner))
+
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool as exc:
+                broken.add(getattr(exc, 'executor', None))
+                results.append(_worker_failure('OMR worker process crashed', options['trace']))
+            except Exception as exc:
+                results.append(_worker_failure(f'Error processing image: {exc}', options['trace']))
+
+        # Once per batch, and only if no other caller already replaced the pool; its workers are gone,
+        # so there is nothing to wait for
+        for pool in broken - {None}:
+            shutdown_pool(expected=pool, wait=False)
+        return results
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -1,6 +1,63 @@
+import functools
+import io
+import itertools
+
 import cv2
 import numpy as np
 
+from pdf_generator.layout import sheet_geometry
+
+from .instrumentation import NULL_TRACE, Trace
+from .scoring import grade_submission  # noqa: F401  (re-exported for existing callers)
+
+# Bump whenever a change alters the answers or fill ratios read from the same image,
+# so results cached under the old version are no longer reused
+OMR_ENGINE_VERSION = 3
+
+# Size every photo is normalized to before the answer sheet is located
+SHEET_WIDTH = 550
+SHEET_HEIGHT = 700
+
+# Width of the preview thumbnail returned with derivatives=True (height keeps the sheet's aspect ratio)
+THUMBNAIL_WIDTH = 150
+DERIVATIVE_JPEG_QUALITY = 75
+
+# Reduced-resolution grayscale decode modes, largest reduction first
+_REDUCED_GRAYSCALE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+# Corner fiducial detection limits (areas as fractions of the normalized image)
+FIDUCIAL_MIN_AREA_FRACTION = 0.0001
+FIDUCIAL_MAX_AREA_FRACTION = 0.02
+FIDUCIAL_MIN_HOLE_RATIO = 0.05
+FIDUCIAL_MAX_HOLE_RATIO = 0.35
+FIDUCIAL_MIN_BOX_FRACTION = 0.01
+FIDUCIAL_MIN_EDGE_DARKNESS = 0.6
+FIDUCIAL_MAX_AREA_SPREAD = 1.4
+FIDUCIAL_CANDIDATES_PER_CORNER = 4
+
+# Shape header of packed fill ratio blobs (num_questions, num_options)
+FILL_RATIO_HEADER_DTYPE = '<u2'
+# Ratios are stored as the exact float32 values the answers were thresholded from
+FILL_RATIO_DTYPE = '<f4'
+
+# How far along each corner-to-centre diagonal the contour search looks for a fiducial
+CONTOUR_CORNER_PROBE = 0.025
+
+# Fraction of the printed bubble radius sampled, keeping the printed outline out of the mask
+BUBBLE_MASK_SCALE = 0.6
+# Distinct (layout version, questions, options, sheet size) mask sets kept in memory
+BUBBLE_SAMPLER_CACHE_SIZE = 64
+
+# Answer sheet localization modes accepted by process_omr_image
+LOCALIZATION_MODES = ('auto', 'markers', 'contour')
+
+# JPEG start-of-frame markers (SOF0-SOF15 minus DHT, JPG and DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
 def order_points(pts):
     """Order points clockwise: top-left, top-right, bottom-right, bottom-left"""
     rect = np.zeros((4, 2), dtype="float32")
@@ -16,97 +73,413 @@ def order_points(pts):
     return rect
 
 
+def _touches_fiducial(img, rect):
+    """Return True if any corner of rect sits on a solid fiducial marker rather than inside the box."""
+    centre = rect.mean(axis=0)
+    paper = np.median(img)
+
+    for corner in rect:
+        x, y = np.rint(corner + (centre - corner) * CONTOUR_CORNER_PROBE).astype(int)
+        patch = img[max(y - 1, 0):y + 2, max(x - 1, 0):x + 2]
+        if patch.size and patch.mean() < paper * 0.5:
+            return True
+    return False
+
+
 def find_answer_sheet(contours, img_original):
     """Find the largest rectangular contour (answer sheet)"""
-    largest_area = 0
-    largest_contour = None
-    
+    quads = []
+
     for contour in contours:
         peri = cv2.arcLength(contour, True)
         approx = cv2.approxPolyDP(contour, 0.02 * peri, True)
-        
+
         if len(approx) == 4:
-            area = cv2.contourArea(contour)
-            if area > largest_area:
-                largest_area = area
-                largest_contour = approx
-    
-    if largest_contour is not None:
-        pts = largest_contour.reshape(4, 2)
-        rect = order_points(pts)
-        
-        output_width = 550
-        output_height = 700
-        
-        dst = np.array([
-            [0, 0],
-            [output_width - 1, 0],
-            [output_width - 1, output_height - 1],
-            [0, output_height - 1]
-        ], dtype="float32")
-        
-        M = cv2.getPerspectiveTransform(rect, dst)
-        warped = cv2.warpPerspective(img_original, M, (output_width, output_height))
-        
-        return warped
-    else:
+            quads.append((cv2.contourArea(contour), approx))
+
+    # On sheets with corner fiducials the outer outline runs through the markers;
+    # skip those quads so the box's own edge is used instead
+    for _, approx in sorted(quads, key=lambda quad: quad[0], reverse=True):
+        rect = order_points(approx.reshape(4, 2))
+        if not _touches_fiducial(img_original, rect):
+            return warp_sheet(img_original, rect)
+
+    return None
+
+
+def warp_sheet(img, rect, output_width=550, output_height=700):
+    """Warp the quadrilateral rect (tl, tr, br, bl) of img to an upright output_width x output_height sheet."""
+    dst = np.array([
+        [0, 0],
+        [output_width - 1, 0],
+        [output_width - 1, output_height - 1],
+        [0, output_height - 1]
+    ], dtype="float32")
+
+    M = cv2.getPerspectiveTransform(np.asarray(rect, dtype="float32"), dst)
+    return cv2.warpPerspective(img, M, (output_width, output_height))
+
+
+def _fiducial_candidates(img_binary):
+    """
+    Find square blobs that may be corner fiducials.
+
+    Returns:
+        List of (centre, corners, area, is_hollow) tuples, corners as a (4, 2) float array
+    """
+    # Opening removes the thin box outline so it does not merge with the markers
+    opened = cv2.morphologyEx(img_binary, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    contours, hierarchy = cv2.findContours(opened, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return []
+
+    min_area = FIDUCIAL_MIN_AREA_FRACTION * img_binary.size
+    max_area = FIDUCIAL_MAX_AREA_FRACTION * img_binary.size
+    candidates = []
+
+    for index, contour in enumerate(contours):
+        # Holes are listed as children of their outer contour; only outer contours can be markers
+        if hierarchy[0][index][3] != -1:
+            continue
+
+        area = cv2.contourArea(contour)
+        if not min_area <= area <= max_area:
+            continue
+
+        approx = cv2.approxPolyDP(contour, 0.04 * cv2.arcLength(contour, True), True)
+        if len(approx) != 4 or not cv2.isContourConvex(approx):
+            continue
+
+        hole_area = 0.0
+        child = hierarchy[0][index][2]
+        while child != -1:
+            hole_area += cv2.contourArea(contours[child])
+            child = hierarchy[0][child][0]
+
+        # QR finder patterns and other rings have much larger holes than the orientation marker
+        hole_ratio = hole_area / area
+        if hole_ratio > FIDUCIAL_MAX_HOLE_RATIO:
+            continue
+
+        corners = approx.reshape(4, 2).astype("float32")
+        candidates.append((corners.mean(axis=0), corners, area, hole_ratio >= FIDUCIAL_MIN_HOLE_RATIO))
+
+    return candidates
+
+
+def _edge_darkness(img_lines, start, end):
+    """Fraction of dark (non-zero) pixels sampled along the segment start-end."""
+    samples = max(2, int(np.hypot(*(end - start))))
+    xs = np.clip(np.linspace(start[0], end[0], samples).round().astype(int), 0, img_lines.shape[1] - 1)
+    ys = np.clip(np.linspace(start[1], end[1], samples).round().astype(int), 0, img_lines.shape[0] - 1)
+    return np.count_nonzero(img_lines[ys, xs]) / samples
+
+
+def _match_fiducials(candidates, img_lines, min_box_area):
+    """
+    Pick the four candidates, one per image corner, whose inner corners are joined by the box outline.
+
+    Returns:
+        (combination of candidate indexes in tl, tr, br, bl order, (4, 2) inner corners) or None
+    """
+    height, width = img_lines.shape
+    image_corners = np.array([[0, 0], [width, 0], [width, height], [0, height]], dtype="float32")
+    centres = np.array([centre for centre, _, _, _ in candidates])
+    areas = [area for _, _, area, _ in candidates]
+
+    # Restrict the search to the candidates closest to each image corner
+    nearest = [
+        np.argsort(np.linalg.norm(centres - corner, axis=1))[:FIDUCIAL_CANDIDATES_PER_CORNER].tolist()
+        for corner in image_corners
+    ]
+
+    # The inner corner of a marker is the vertex pointing towards the box interior
+    inward = np.array([[1, 1], [-1, 1], [-1, -1], [1, -1]], dtype="float32")
+    inner_corners = [
+        {index: candidates[index][1][np.argmax(candidates[index][1] @ direction)] for index in slot}
+        for slot, direction in zip(nearest, inward)
+    ]
+
+    best_score = 0.0
+    best = None
+    for combination in itertools.product(*nearest):
+        if len(set(combination)) < 4:
+            continue
+
+        # All four markers are printed at the same size
+        combination_areas = [areas[index] for index in combination]
+        if max(combination_areas) > FIDUCIAL_MAX_AREA_SPREAD * min(combination_areas):
+            continue
+
+        inner = np.array([inner_corners[slot][index] for slot, index in enumerate(combination)])
+        if not cv2.isContourConvex(inner.reshape(-1, 1, 2)) or cv2.contourArea(inner) < min_box_area:
+            continue
+
+        darkness = [_edge_darkness(img_lines, inner[i], inner[(i + 1) % 4]) for i in range(4)]
+        if min(darkness) < FIDUCIAL_MIN_EDGE_DARKNESS:
+            continue
+
+        score = sum(darkness)
+        if score > best_score:
+            best_score = score
+            best = (combination, inner)
+
+    return best
+
+
+def find_fiducials(img_gray, img_blur=None):
+    """
+    Locate the bubble box from its four printed corner fiducials.
+
+    Each fiducial is a solid square printed diagonally outside one corner of
+    the bubble box, touching it at its inner corner; the top-left one has a
+    small hole so upside-down photos can be detected. For every image corner
+    the nearest few square candidates are combined and the combination whose
+    inner corners are joined by the printed box outline wins.
+
+    Args:
+        img_gray: Grayscale image
+        img_blur: Optional blurred copy of img_gray, reused when provided
+
+    Returns:
+        (4, 2) float32 array of box corners (tl, tr, br, bl), or None if not found
+    """
+    if img_blur is None:
+        img_blur = cv2.GaussianBlur(img_gray, (5, 5), 1)
+
+    img_binary = cv2.adaptiveThreshold(
+        img_blur, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 10
+    )
+    candidates = _fiducial_candidates(img_binary)
+    if len(candidates) < 4:
         return None
 
+    # The hollow orientation marker fixes the marker size, which rules out most other squares
+    hollow_areas = [area for _, _, area, is_hollow in candidates if is_hollow]
+    if hollow_areas:
+        sized = [
+            candidate for candidate in candidates
+            if any(abs(np.log(candidate[2] / area)) <= np.log(FIDUCIAL_MAX_AREA_SPREAD) for area in hollow_areas)
+        ]
+        if len(sized) >= 4:
+            candidates = sized
+
+    # Allow the printed outline to be a pixel off the sampled segment
+    img_lines = cv2.dilate(img_binary, np.ones((3, 3), np.uint8))
+    match = _match_fiducials(candidates, img_lines, FIDUCIAL_MIN_BOX_FRACTION * img_gray.size)
+    if match is None:
+        return None
+
+    combination, inner = match
+
+    # Rotate the corner order so the hollow marker is top-left (handles upside-down photos)
+    hollow = [position for position, index in enumerate(combination) if candidates[index][3]]
+    if len(hollow) == 1:
+        inner = np.roll(inner, -hollow[0], axis=0)
+
+    return inner.astype("float32")
+
+
+def _resolve_geometry(geometry, num_questions, num_options):
+    """Return the sheet geometry to sample, defaulting to the current printed layout."""
+    if geometry is None:
+        return sheet_geometry(num_questions, num_options)
 
-def detect_answers(img, num_questions=20, num_options=5, darkness_threshold=0.6):
+    if (geometry['num_questions'], geometry['num_options']) != (num_questions, num_options):
+        raise ValueError(
+            f"Sheet geometry describes {geometry['num_questions']}x{geometry['num_options']} bubbles, "
+            f"expected {num_questions}x{num_options}"
+        )
+    return geometry
+
+
+@functools.lru_cache(maxsize=BUBBLE_SAMPLER_CACHE_SIZE)
+def _bubble_sampler(version, num_questions, num_options, box, radius, centres, shape):
     """
-    Detect marked answers on OMR sheet.
-    Supports both single and multiple answer detection.
+    Build the flat pixel indices covered by every bubble mask on a warped sheet.
+
+    Cached per layout version, grid size and sheet shape; the remaining
+    arguments are fully determined by those for a given layout version.
+
+    Returns:
+        Tuple of (indices, offsets, sizes): concatenated flat pixel indices of all
+        masks in row-major bubble order, the start of each mask in indices, and
+        the pixel count of each mask
+    """
+    height, width = shape
+
+    # warp_sheet maps the box corners onto the outermost pixel centres
+    scale_x = (width - 1) / box[0]
+    scale_y = (height - 1) / box[1]
+
+    # The printed sheet is stretched to a fixed size, so circles become ellipses
+    radius_x = max(radius * BUBBLE_MASK_SCALE * scale_x, 1.0)
+    radius_y = max(radius * BUBBLE_MASK_SCALE * scale_y, 1.0)
+
+    masks = []
+    for centre_x, centre_y in centres:
+        x = centre_x * scale_x
+        y = centre_y * scale_y
+
+        x0 = min(max(int(np.floor(x - radius_x)), 0), width - 1)
+        x1 = max(min(int(np.ceil(x + radius_x)) + 1, width), x0 + 1)
+        y0 = min(max(int(np.floor(y - radius_y)), 0), height - 1)
+        y1 = max(min(int(np.ceil(y + radius_y)) + 1, height), y0 + 1)
+
+        ys, xs = np.mgrid[y0:y1, x0:x1]
+        inside = ((xs - x) / radius_x) ** 2 + ((ys - y) / radius_y) ** 2 <= 1.0
+        if not inside.any():
+            # Bubble centred off the sheet: fall back to the nearest pixel
+            inside[min(max(round(y) - y0, 0), y1 - y0 - 1), min(max(round(x) - x0, 0), x1 - x0 - 1)] = True
+
+        masks.append(ys[inside] * width + xs[inside])
+
+    sizes = np.array([mask.size for mask in masks])
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    indices = np.concatenate(masks).astype(np.intp)
+
+    for array in (indices, offsets, sizes):
+        array.flags.writeable = False
+    return indices, offsets, sizes
+
+
+def bubble_sampler(geometry, shape):
+    """
+    Return the cached bubble masks for a sheet geometry on a sheet of the given shape.
+
+    Args:
+        geometry: Sheet geometry descriptor (see pdf_generator.layout.sheet_geometry)
+        shape: (height, width) of the warped sheet
+
+    Returns:
+        Tuple of (indices, offsets, sizes) as built by _bubble_sampler
+    """
+    box = geometry['box']
+    centres = tuple(
+        (float(x), float(y))
+        for row in geometry['bubbles']
+        for x, y in row
+    )
+    return _bubble_sampler(
+        geometry['version'],
+        geometry['num_questions'],
+        geometry['num_options'],
+        (float(box['width']), float(box['height'])),
+        float(geometry['bubble_radius']),
+        centres,
+        tuple(shape),
+    )
+
+
+def compute_fill_ratios(img, num_questions=20, num_options=5, geometry=None):
+    """
+    Compute the fraction of non-zero pixels inside every bubble.
 
     Args:
         img: Preprocessed binary image
         num_questions: Number of questions
         num_options: Number of options per question
-        darkness_threshold: Fraction of bubble that must be filled (0.0-1.0)
+        geometry: Sheet geometry the sheet was printed with (default: current layout)
 
     Returns:
-        Array of detected answers - int for single, list for multiple, None for unanswered
+        (num_questions, num_options) float32 array of fill ratios (0.0-1.0)
+    """
+    return compute_fill_ratios_batch(img[np.newaxis], num_questions, num_options, geometry)[0]
+
+
+def compute_fill_ratios_batch(imgs, num_questions=20, num_options=5, geometry=None):
     """
-    height, width = img.shape
+    Compute fill ratios for a stack of warped binary sheets in one reduction.
 
-    target_height = (height // num_questions) * num_questions
-    target_width = (width // num_options) * num_options
+    Only the pixels under each bubble's circular mask are read.
 
-    if height != target_height or width != target_width:
-        img = cv2.resize(img, (target_width, target_height))
+    Args:
+        imgs: (N, H, W) array of preprocessed binary sheets of the same size
+        num_questions: Number of questions
+        num_options: Number of options per question
+        geometry: Sheet geometry the sheets were printed with (default: current layout)
 
-    # Adaptive threshold: fewer questions = taller cells = more empty space = need lower threshold
-    # For 1-10 questions: use 0.20 (matches the old working code with 20% threshold)
-    # For 11-19 questions: gradually increase from 0.20 to 0.6
-    # For 20+ questions: use 0.6 (original)
-    if num_questions <= 10:
-        adaptive_threshold = 0.20
-    elif num_questions < 20:
-        adaptive_threshold = 0.20 + (num_questions - 10) * (0.6 - 0.20) / (20 - 10)
-    else:
-        adaptive_threshold = 0.6
+    Returns:
+        (N, num_questions, num_options) float32 array of fill ratios
+    """
+    imgs = np.asarray(imgs)
+    if imgs.ndim != 3:
+        raise ValueError(f'Expected an (N, H, W) stack of sheets, got shape {imgs.shape}')
 
-    # Use the lower of provided threshold or adaptive threshold
-    darkness_threshold = min(darkness_threshold, adaptive_threshold)
+    geometry = _resolve_geometry(geometry, num_questions, num_options)
+    indices, offsets, sizes = bubble_sampler(geometry, imgs.shape[1:])
 
-    rows = np.vsplit(img, num_questions)
-    detected_answers = []
+    samples = imgs.reshape(len(imgs), -1)[:, indices] != 0
+    filled = np.add.reduceat(samples, offsets, axis=1, dtype=np.int32)
 
-    for row in rows:
-        cols = np.hsplit(row, num_options)
+    ratios = filled / sizes
+    return ratios.reshape(len(imgs), num_questions, num_options).astype(np.float32)
 
-        # Calculate total pixels in each bubble region
-        total_pixels = cols[0].size
-        threshold_pixels = total_pixels * darkness_threshold
 
-        # Find all bubbles above threshold
-        marked_options = []
+def pack_fill_ratios(fill_ratios):
+    """
+    Pack a (num_questions, num_options) fill ratio matrix into a compact blob.
+
+    Ratios are stored as float32, unrounded, after a small header holding the
+    matrix shape, so a 20x5 sheet takes 404 bytes. Keeping the exact values
+    means thresholding the unpacked matrix at the grading threshold marks the
+    same bubbles the OMR did, even for ratios just above the threshold.
+
+    Returns:
+        bytes
+    """
+    fill_ratios = np.asarray(fill_ratios, dtype=np.float32)
+    if fill_ratios.ndim != 2:
+        raise ValueError(f'Expected a (num_questions, num_options) matrix, got shape {fill_ratios.shape}')
+
+    header = np.array(fill_ratios.shape, dtype=FILL_RATIO_HEADER_DTYPE).tobytes()
+    return header + fill_ratios.astype(FILL_RATIO_DTYPE).tobytes()
+
+
+def unpack_fill_ratios(blob):
+    """
+    Unpack a blob written by pack_fill_ratios.
+
+    Returns:
+        (num_questions, num_options) float32 array of fill ratios
+    """
+    blob = bytes(blob)
+    header_size = 2 * np.dtype(FILL_RATIO_HEADER_DTYPE).itemsize
+    num_questions, num_options = (int(n) for n in np.frombuffer(blob[:header_size], dtype=FILL_RATIO_HEADER_DTYPE))
+
+    if len(blob) - header_size != num_questions * num_options * np.dtype(FILL_RATIO_DTYPE).itemsize:
+        raise ValueError('Fill ratio blob does not match its header')
 
-        for idx, col in enumerate(cols):
-            white_pixels = cv2.countNonZero(col)
+    ratios = np.frombuffer(blob, dtype=FILL_RATIO_DTYPE, offset=header_size)
+    return ratios.reshape(num_questions, num_options).astype(np.float32)
 
-            if white_pixels > threshold_pixels:
-                marked_options.append(idx)
+
+def answers_from_fill_ratios(fill_ratios, darkness_threshold=0.6):
+    """
+    Re-derive detected answers from stored fill ratios without touching any image.
+
+    Args:
+        fill_ratios: (N, num_questions, num_options) array of fill ratios
+        darkness_threshold: Fraction of bubble that must be filled (0.0-1.0)
+
+    Returns:
+        List of N answer lists, in the format returned by detect_answers
+    """
+    marks = np.asarray(fill_ratios) > darkness_threshold
+    return [marks_to_answers(sheet) for sheet in marks]
+
+
+def marks_to_answers(marks):
+    """
+    Convert a (num_questions, num_options) boolean mark matrix to answer values.
+
+    Returns:
+        List with int for single, sorted list for multiple, None for unanswered
+    """
+    detected_answers = []
+
+    for row in np.asarray(marks, dtype=bool):
+        marked_options = np.flatnonzero(row).tolist()
 
         # Return result based on number of marks detected
         if len(marked_options) == 0:
@@ -117,164 +490,261 @@ def detect_answers(img, num_questions=20, num_options=5, darkness_threshold=0.6)
             detected_answers.append(marked_options[0])
         else:
             # Multiple marks - return as sorted list
-            detected_answers.append(sorted(marked_options))
+            detected_answers.append(marked_options)
 
     return detected_answers
 
 
-def process_omr_image(image_path, num_questions=20, num_options=5, darkness_threshold=0.6):
+def detect_answers_batch(imgs, num_questions=20, num_options=5, darkness_threshold=0.6, geometry=None):
     """
-    Process an OMR image and return detected answers
+    Detect marked bubbles on a stack of warped sheets.
 
     Args:
-        image_path: Path to the OMR image
-        num_questions: Number of questions on the test
-        num_options: Number of options per question (default 5 for A-E)
-        darkness_threshold: Fraction of bubble that must be filled (default 0.6)
+        imgs: (N, H, W) array of preprocessed binary sheets of the same size
+        num_questions: Number of questions
+        num_options: Number of options per question
+        darkness_threshold: Fraction of bubble that must be filled (0.0-1.0)
+        geometry: Sheet geometry the sheets were printed with (default: current layout)
 
     Returns:
-        dict with 'success', 'answers', and 'error' keys
+        (N, num_questions, num_options) boolean array, True where a bubble is marked
     """
-    try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return {'success': False, 'error': 'Could not read image file'}
-
-        imgWidth = 550
-        imgHeight = 700
-        img = cv2.resize(img, (imgWidth, imgHeight))
-
-        img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        img_blur = cv2.GaussianBlur(img_gray, (5, 5), 1)
-
-        img_canny = cv2.Canny(img_blur, 10, 50)
+    ratios = compute_fill_ratios_batch(imgs, num_questions, num_options, geometry)
+    return ratios > darkness_threshold
 
-        contours, _ = cv2.findContours(img_canny, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
 
-        answer_sheet = find_answer_sheet(contours, img_gray)
-
-        _, img_threshold = cv2.threshold(answer_sheet, 150, 255, cv2.THRESH_BINARY_INV)
-
-        answers = detect_answers(img_threshold, num_questions, num_options, darkness_threshold)
+def detect_answers(img, num_questions=20, num_options=5, darkness_threshold=0.6, geometry=None):
+    """
+    Detect marked answers on OMR sheet.
+    Supports both single and multiple answer detection.
 
-        return {
-            'success': True,
-            'answers': answers,
-            'error': None
-        }
+    Args:
+        img: Preprocessed binary image
+        num_questions: Number of questions
+        num_options: Number of options per question
+        darkness_threshold: Fraction of bubble that must be filled (0.0-1.0)
+        geometry: Sheet geometry the sheet was printed with (default: current layout)
 
-    except Exception as e:
-        return {
-            'success': False,
-            'error': f'Error processing image: {str(e)}',
-            'answers': None
-        }
+    Returns:
+        Array of detected answers - int for single, list for multiple, None for unanswered
+    """
+    marks = detect_answers_batch(img[np.newaxis], num_questions, num_options, darkness_threshold, geometry)[0]
+    return marks_to_answers(marks)
 
 
-def _normalize_to_set(answer):
+def _jpeg_dimensions(stream):
     """
-    Normalize answer to set for comparison.
-    Handles backwards compatibility with integer format.
-
-    Args:
-        answer: Answer in int, list, tuple, or None format
+    Read (width, height) from the frame header of a JPEG stream.
 
     Returns:
-        Set of answer indices
+        Tuple of ints, or None when the stream is not a JPEG or has no frame header
     """
-    if answer is None:
-        return set()
-    elif isinstance(answer, (list, tuple)):
-        return set(answer)
-    elif isinstance(answer, int):
-        return {answer}
-    else:
-        return set()
-
+    if stream.read(2) != b'\xff\xd8':
+        return None
 
-def _calculate_points(detected_set, correct_set, grading_mode):
+    while True:
+        byte = stream.read(1)
+        while byte and byte != b'\xff':
+            byte = stream.read(1)
+        while byte == b'\xff':
+            byte = stream.read(1)
+        if not byte:
+            return None
+
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Standalone markers carry no length
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan reached without a frame header
+            return None
+
+        length = stream.read(2)
+        if len(length) < 2:
+            return None
+
+        if marker in _JPEG_SOF_MARKERS:
+            frame = stream.read(5)
+            if len(frame) < 5:
+                return None
+            height = int.from_bytes(frame[1:3], 'big')
+            width = int.from_bytes(frame[3:5], 'big')
+            return width, height
+
+        stream.seek(int.from_bytes(length, 'big') - 2, io.SEEK_CUR)
+
+
+def _decode_flag(stream, width=SHEET_WIDTH, height=SHEET_HEIGHT):
+    """Pick the cheapest grayscale imread flag that still yields at least width x height pixels."""
+    dimensions = _jpeg_dimensions(stream)
+    if dimensions is None:
+        return cv2.IMREAD_GRAYSCALE
+
+    # EXIF rotation may swap the axes, so compare short side to short side
+    short_side, long_side = sorted(dimensions)
+    target_short, target_long = sorted((width, height))
+
+    for factor, flag in _REDUCED_GRAYSCALE_FLAGS:
+        if short_side // factor >= target_short and long_side // factor >= target_long:
+            return flag
+    return cv2.IMREAD_GRAYSCALE
+
+
+def decode_sheet(image, width=SHEET_WIDTH, height=SHEET_HEIGHT, trace=NULL_TRACE):
     """
-    Calculate points earned for a question.
+    Decode an image straight to a width x height grayscale sheet.
+
+    Large JPEGs are decoded at 1/2, 1/4 or 1/8 resolution (chosen from the
+    frame header) so the full-size colour image is never materialized.
 
     Args:
-        detected_set: Set of detected answer indices
-        correct_set: Set of correct answer indices
-        grading_mode: "all_or_nothing" or "partial_credit"
+        image: Path to the image, its encoded bytes, or an already decoded BGR/grayscale ndarray
+        trace: Trace recording the decode, resize and cvtcolor stages (default: not recorded)
 
     Returns:
-        Float between 0.0 and 1.0
+        Grayscale ndarray of shape (height, width), or None if the image cannot be decoded
     """
-    # Handle unanswered questions
-    if len(detected_set) == 0:
-        return 0.0
+    with trace.stage('decode'):
+        if isinstance(image, np.ndarray):
+            img = image
+        elif isinstance(image, (bytes, bytearray, memoryview)):
+            trace.note('encoded_bytes', len(image))
+            flag = _decode_flag(io.BytesIO(image), width, height)
+            img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), flag)
+        else:
+            with open(image, 'rb') as stream:
+                flag = _decode_flag(stream, width, height)
+            img = cv2.imread(str(image), flag)
 
-    # Handle empty correct answer set (shouldn't happen)
-    if len(correct_set) == 0:
-        return 0.0
+    if img is None:
+        return None
+    trace.note('decoded_width', img.shape[1])
+    trace.note('decoded_height', img.shape[0])
 
-    if grading_mode == "all_or_nothing":
-        # Must match exactly - all correct, no incorrect
-        return 1.0 if detected_set == correct_set else 0.0
+    with trace.stage('resize'):
+        img = cv2.resize(img, (width, height))
+    if img.ndim == 3:
+        with trace.stage('cvtcolor'):
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    return img
 
-    elif grading_mode == "partial_credit":
-        # Proportional scoring with penalty for incorrect marks
-        correct_marks = len(detected_set & correct_set)  # Intersection
-        incorrect_marks = len(detected_set - correct_set)  # Detected but wrong
-        total_correct = len(correct_set)
 
-        # Formula: (correct_marks - incorrect_marks) / total_correct
-        # Clamped to [0, 1]
-        points = (correct_marks - incorrect_marks) / total_correct
-        return max(0.0, min(1.0, points))
+def encode_derivatives(img_gray, answer_sheet):
+    """
+    JPEG-encode the review images of a graded sheet from arrays the pipeline already holds.
 
-    else:
-        # Unknown mode - default to all_or_nothing
-        return 1.0 if detected_set == correct_set else 0.0
+    Args:
+        img_gray: The decoded, resized grayscale photo
+        answer_sheet: The warped answer box the bubbles were read from
+
+    Returns:
+        dict with 'warped' and 'thumbnail' JPEG bytes
+    """
+    params = [cv2.IMWRITE_JPEG_QUALITY, DERIVATIVE_JPEG_QUALITY]
+    thumbnail_height = round(THUMBNAIL_WIDTH * img_gray.shape[0] / img_gray.shape[1])
+    thumbnail = cv2.resize(img_gray, (THUMBNAIL_WIDTH, thumbnail_height), interpolation=cv2.INTER_AREA)
+    return {
+        'warped': cv2.imencode('.jpg', answer_sheet, params)[1].tobytes(),
+        'thumbnail': cv2.imencode('.jpg', thumbnail, params)[1].tobytes(),
+    }
 
 
-def grade_submission(detected_answers, correct_answers, grading_modes=None):
+def process_omr_image(image_path, num_questions=20, num_options=5, darkness_threshold=0.6, localization='auto',
+                      geometry=None, trace=False, derivatives=False):
     """
-    Grade a submission supporting multiple correct answers.
+    Process an OMR image and return detected answers
 
     Args:
-        detected_answers: List of detected answers (int, list, or None)
-        correct_answers: List of correct answers (int or list for compatibility)
-        grading_modes: List of grading modes per question (optional)
+        image_path: Path to the OMR image, its encoded bytes, or an already decoded BGR/grayscale ndarray
+        num_questions: Number of questions on the test
+        num_options: Number of options per question (default 5 for A-E)
+        darkness_threshold: Fraction of bubble that must be filled (default 0.6)
+        localization: 'markers' to use the printed corner fiducials, 'contour' for the
+            largest-quadrilateral search, or 'auto' to try markers first (default)
+        geometry: Sheet geometry the sheet was printed with (default: current layout)
+        trace: Time every stage and attach the trace to the result (see grade_processor.instrumentation)
+        derivatives: Also return JPEG review images of a successfully read sheet (see encode_derivatives)
 
     Returns:
-        dict with score, total, percentage, and per-question details
+        dict with 'success', 'answers', 'fill_ratios' and 'error' keys; fill_ratios is the
+        (num_questions, num_options) float32 matrix the answers were thresholded from.
+        With trace, a 'trace' dict holds per-stage seconds, image details and the failed stage.
+        With derivatives, a 'derivatives' dict holds the warped answer box and a thumbnail
     """
-    if grading_modes is None:
-        grading_modes = ["all_or_nothing"] * len(correct_answers)
-
-    score = 0.0
-    total = len(correct_answers)
-    details = []
+    if localization not in LOCALIZATION_MODES:
+        raise ValueError(f'Unknown localization mode: {localization}')
 
-    for i, (detected, correct, mode) in enumerate(zip(detected_answers, correct_answers, grading_modes)):
-        # Normalize to sets for comparison
-        detected_set = _normalize_to_set(detected)
-        correct_set = _normalize_to_set(correct)
+    tracer = Trace() if trace else NULL_TRACE
+    result = _process_omr_image(image_path, num_questions, num_options, darkness_threshold, localization, geometry,
+                                tracer, derivatives)
+    if trace:
+        result['trace'] = tracer.as_dict()
+    return result
 
-        # Calculate points based on grading mode
-        points = _calculate_points(detected_set, correct_set, mode)
-        score += points
 
-        details.append({
-            'question': i + 1,
-            'detected': detected,
-            'correct': correct,
-            'is_correct': points == 1.0,
-            'points': points,
-            'grading_mode': mode
-        })
+def _process_omr_image(image_path, num_questions, num_options, darkness_threshold, localization, geometry, trace,
+                       derivatives=False):
+    """The body of process_omr_image, recording into trace."""
+    try:
+        img_gray = decode_sheet(image_path, trace=trace)
+        if img_gray is None:
+            trace.fail('decode')
+            return {'success': False, 'error': 'Could not read image file'}
 
-    percentage = (score / total * 100) if total > 0 else 0
+        with trace.stage('blur'):
+            img_blur = cv2.GaussianBlur(img_gray, (5, 5), 1)
+
+        answer_sheet = None
+        if localization in ('auto', 'markers'):
+            with trace.stage('markers'):
+                corners = find_fiducials(img_gray, img_blur)
+            if corners is not None:
+                trace.note('localization', 'markers')
+                with trace.stage('warp'):
+                    answer_sheet = warp_sheet(img_gray, corners)
+
+        if answer_sheet is None and localization in ('auto', 'contour'):
+            with trace.stage('canny'):
+                img_canny = cv2.Canny(img_blur, 10, 50)
+
+            with trace.stage('contours'):
+                contours, _ = cv2.findContours(img_canny, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+            trace.note('contours', len(contours))
+
+            # find_answer_sheet warps the quadrilateral it picks, so this includes the warp
+            with trace.stage('contour_select'):
+                answer_sheet = find_answer_sheet(contours, img_gray)
+            if answer_sheet is not None:
+                trace.note('localization', 'contour')
+
+        if answer_sheet is None:
+            trace.fail('localization')
+            return {'success': False, 'error': 'Could not locate the answer sheet in the image', 'answers': None,
+                    'fill_ratios': None}
+
+        with trace.stage('threshold'):
+            _, img_threshold = cv2.threshold(answer_sheet, 150, 255, cv2.THRESH_BINARY_INV)
+
+        with trace.stage('detect'):
+            fill_ratios = compute_fill_ratios(img_threshold, num_questions, num_options, geometry)
+            answers = marks_to_answers(fill_ratios > darkness_threshold)
+
+        result = {
+            'success': True,
+            'answers': answers,
+            'fill_ratios': fill_ratios,
+            'error': None
+        }
+        if derivatives:
+            with trace.stage('derivatives'):
+                result['derivatives'] = encode_derivatives(img_gray, answer_sheet)
+        return result
 
-    return {
-        'score': score,
-        'total': total,
-        'percentage': round(percentage, 2),
-        'details': details
-    }
+    except Exception as e:
+        trace.fail('unexpected')
+        return {
+            'success': False,
+            'error': f'Error processing image: {str(e)}',
+            'answers': None,
+            'fill_ratios': None
+        }
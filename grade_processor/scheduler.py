@@ -0,0 +1,198 @@
+"""
+Priority scheduling of sheets onto the shared OMR process pool.
+
+Sheets are queued in two classes: INTERACTIVE (a student waiting on their
+result page) and BULK (a teacher's uploaded batch). The scheduler keeps at
+most one sheet per pool worker in flight, so queued work waits here rather
+than in the pool's FIFO queue, and always starts interactive sheets first.
+Bulk sheets are taken round-robin across their owners (the teacher who
+uploaded them), so one large upload cannot hold back everyone else's, and at
+most max_bulk_in_flight of them run at once, which leaves the remaining
+workers free for interactive sheets the moment they arrive.
+
+Queue wait and service time are recorded per class in the
+omr_scheduler_queue_wait_seconds and omr_scheduler_service_seconds histograms.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from . import instrumentation
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)
+
+QUEUE_WAIT_SECONDS = instrumentation.histogram(
+    'omr_scheduler_queue_wait_seconds', 'Time sheets waited in the OMR scheduler before a worker picked them up.'
+)
+SERVICE_SECONDS = instrumentation.histogram(
+    'omr_scheduler_service_seconds', 'Time from handing a sheet to a pool worker until its result came back.'
+)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+class _Item:
+    __slots__ = ('source', 'options', 'priority', 'future', 'queued_at', 'started_at')
+
+    def __init__(self, source, options, priority):
+        self.source = source
+        self.options = options
+        self.priority = priority
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+        self.started_at = None
+
+
+def _bulk_bound(workers, max_bulk_in_flight):
+    if not max_bulk_in_flight:
+        max_bulk_in_flight = workers - 1
+    return max(1, min(workers, max_bulk_in_flight))
+
+
+class OMRScheduler:
+    """
+    Feeds queued sheets to a process pool by priority class and owner.
+
+    Args:
+        submit: Callable (source, options) -> concurrent.futures.Future that starts one sheet
+        workers: Sheets allowed in flight at once, normally the pool's worker count
+        max_bulk_in_flight: Bulk sheets allowed in flight at once (default: workers - 1, at least 1)
+    """
+
+    def __init__(self, submit, workers, max_bulk_in_flight=None):
+        self.workers = max(1, workers)
+        self.max_bulk_in_flight = _bulk_bound(self.workers, max_bulk_in_flight)
+
+        self._submit = submit
+        self._condition = threading.Condition()
+        self._interactive = deque()
+        # owner -> deque of bulk items; the owner served last moves to the end
+        self._bulk = OrderedDict()
+        self._in_flight = {INTERACTIVE: 0, BULK: 0}
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name='omr-scheduler', daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, source, options, priority=BULK, owner=None):
+        """Queue one sheet and return a Future for its process_omr_image result."""
+        if priority not in PRIORITIES:
+            raise ValueError(f'Unknown priority {priority!r}')
+
+        item = _Item(source, options, priority)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('OMR scheduler is shut down')
+            if priority == INTERACTIVE:
+                self._interactive.append(item)
+            else:
+                self._bulk.setdefault(owner, deque()).append(item)
+            self._condition.notify()
+        return item.future
+
+    def queued(self):
+        """Return the number of queued (not yet started) sheets per priority class."""
+        with self._condition:
+            return {
+                INTERACTIVE: len(self._interactive),
+                BULK: sum(len(items) for items in self._bulk.values()),
+            }
+
+    def in_flight(self):
+        """Return the number of running sheets per priority class."""
+        with self._condition:
+            return dict(self._in_flight)
+
+    def shutdown(self):
+        """Stop dispatching; sheets still queued fail with RuntimeError."""
+        with self._condition:
+            self._closed = True
+            pending = list(self._interactive) + [item for items in self._bulk.values() for item in items]
+            self._interactive.clear()
+            self._bulk.clear()
+            self._condition.notify()
+        for item in pending:
+            item.future.set_exception(RuntimeError('OMR scheduler is shut down'))
+        self._dispatcher.join()
+
+    def _next_item(self):
+        """Pop the next sheet allowed to start, or None. Call with the condition held."""
+        if sum(self._in_flight.values()) >= self.workers:
+            return None
+        if self._interactive:
+            return self._interactive.popleft()
+        if not self._bulk or self._in_flight[BULK] >= self.max_bulk_in_flight:
+            return None
+
+        owner, items = next(iter(self._bulk.items()))
+        item = items.popleft()
+        del self._bulk[owner]
+        if items:
+            self._bulk[owner] = items
+        return item
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                item = self._next_item()
+                while item is None and not self._closed:
+                    self._condition.wait()
+                    item = self._next_item()
+                if item is None:
+                    return
+                self._in_flight[item.priority] += 1
+
+            item.started_at = time.perf_counter()
+            QUEUE_WAIT_SECONDS.observe(item.started_at - item.queued_at, priority=item.priority)
+            try:
+                future = self._submit(item.source, item.options)
+            except Exception as exc:
+                self._finished(item, None, exc)
+                continue
+            future.add_done_callback(lambda future, item=item: self._finished(item, future))
+
+    def _finished(self, item, future, error=None):
+        SERVICE_SECONDS.observe(time.perf_counter() - item.started_at, priority=item.priority)
+        with self._condition:
+            self._in_flight[item.priority] -= 1
+            self._condition.notify()
+
+        if error is not None:
+            item.future.set_exception(error)
+            return
+        try:
+            item.future.set_result(future.result())
+        except BaseException as exc:
+            # Includes CancelledError when the pool is shut down under a running sheet
+            item.future.set_exception(exc)
+
+
+def get_scheduler(submit, workers, max_bulk_in_flight=None):
+    """
+    Return the process-wide scheduler, creating it on first use.
+
+    The scheduler is replaced if a different worker count or bulk bound is requested.
+    """
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is not None:
+            current = (_scheduler.workers, _scheduler.max_bulk_in_flight)
+            if current == (workers, _bulk_bound(workers, max_bulk_in_flight)):
+                return _scheduler
+            _scheduler.shutdown()
+        _scheduler = OMRScheduler(submit, workers, max_bulk_in_flight)
+        return _scheduler
+
+
+def shutdown_scheduler():
+    """Stop the process-wide scheduler, if one is running."""
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.shutdown()
+        _scheduler = None
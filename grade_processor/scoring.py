@@ -0,0 +1,349 @@
+import collections
+
+import numpy as np
+
+# Widest detected-answer bitmask a lookup table is built for (2**16 entries per question)
+MAX_OPTION_BITS = 16
+
+# Bit width of the uint32 masks
+MASK_BITS = 32
+
+CompiledAnswerKey = collections.namedtuple(
+    'CompiledAnswerKey',
+    ['correct_answers', 'grading_modes', 'total', 'width', 'points_table'],
+)
+CompiledAnswerKey.__doc__ = """
+Answer key compiled into a per-question scoring lookup table.
+
+    correct_answers: Correct answers the key was compiled from
+    grading_modes: Grading mode per scored question
+    total: Number of questions the score is out of (len(correct_answers))
+    width: Number of option bits covered by the table
+    points_table: (num_scored_questions, 2**width) float64 array, the points
+        earned for every possible detected-answer bitmask
+"""
+
+
+def _normalize_to_set(answer):
+    """
+    Normalize answer to set for comparison.
+    Handles backwards compatibility with integer format.
+
+    Args:
+        answer: Answer in int, list, tuple, or None format
+
+    Returns:
+        Set of answer indices
+    """
+    if answer is None:
+        return set()
+    elif isinstance(answer, (list, tuple)):
+        return set(answer)
+    elif isinstance(answer, int):
+        return {answer}
+    else:
+        return set()
+
+
+def _calculate_points(detected_set, correct_set, grading_mode):
+    """
+    Calculate points earned for a question.
+
+    Args:
+        detected_set: Set of detected answer indices
+        correct_set: Set of correct answer indices
+        grading_mode: "all_or_nothing" or "partial_credit"
+
+    Returns:
+        Float between 0.0 and 1.0
+    """
+    # Handle unanswered questions
+    if len(detected_set) == 0:
+        return 0.0
+
+    # Handle empty correct answer set (shouldn't happen)
+    if len(correct_set) == 0:
+        return 0.0
+
+    if grading_mode == "all_or_nothing":
+        # Must match exactly - all correct, no incorrect
+        return 1.0 if detected_set == correct_set else 0.0
+
+    elif grading_mode == "partial_credit":
+        # Proportional scoring with penalty for incorrect marks
+        correct_marks = len(detected_set & correct_set)  # Intersection
+        incorrect_marks = len(detected_set - correct_set)  # Detected but wrong
+        total_correct = len(correct_set)
+
+        # Formula: (correct_marks - incorrect_marks) / total_correct
+        # Clamped to [0, 1]
+        points = (correct_marks - incorrect_marks) / total_correct
+        return max(0.0, min(1.0, points))
+
+    else:
+        # Unknown mode - default to all_or_nothing
+        return 1.0 if detected_set == correct_set else 0.0
+
+
+def answer_to_mask(answer, bits=MASK_BITS):
+    """
+    Encode an answer (int, list, or None) as an option bitmask.
+
+    Returns:
+        int with bit i set when option i is selected, or None when the answer
+        holds something other than option indices in [0, bits)
+    """
+    mask = 0
+    for option in _normalize_to_set(answer):
+        if not isinstance(option, int) or not 0 <= option < bits:
+            return None
+        mask |= 1 << option
+    return mask
+
+
+def _mask_to_set(mask):
+    """Return the set of option indices whose bits are set in mask."""
+    return {bit for bit in range(int(mask).bit_length()) if mask >> bit & 1}
+
+
+def compile_answer_key(correct_answers, grading_modes=None, num_options=0):
+    """
+    Precompute the points earned for every detected-answer bitmask of every question.
+
+    The table gives exactly what _calculate_points would for the same answers,
+    so scoring a whole class becomes a single gather.
+
+    Args:
+        correct_answers: List of correct answers (int or list for compatibility)
+        grading_modes: List of grading modes per question (optional)
+        num_options: Number of options per question; the table covers at least this many bits
+
+    Returns:
+        CompiledAnswerKey
+    """
+    if grading_modes is None:
+        grading_modes = ["all_or_nothing"] * len(correct_answers)
+
+    num_questions = min(len(correct_answers), len(grading_modes))
+    correct_answers = list(correct_answers)
+    grading_modes = list(grading_modes[:num_questions])
+
+    correct_masks = [answer_to_mask(answer, MAX_OPTION_BITS) for answer in correct_answers[:num_questions]]
+    width = max([num_options or 0, 1] + [mask.bit_length() for mask in correct_masks if mask is not None])
+    if width > MAX_OPTION_BITS:
+        raise ValueError(f'Answer keys are limited to {MAX_OPTION_BITS} options, got {width}')
+
+    detected = np.arange(1 << width, dtype=np.uint32)
+    popcount = ((detected[:, np.newaxis] >> np.arange(width, dtype=np.uint32)) & 1).sum(axis=1, dtype=np.int64)
+
+    encodable = np.array([mask is not None for mask in correct_masks], dtype=bool)
+    correct = np.array([mask or 0 for mask in correct_masks], dtype=np.uint32)[:, np.newaxis]
+
+    hits = popcount[detected & correct]
+    incorrect = popcount[detected] - hits
+    total_correct = popcount[correct]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        partial = np.clip((hits - incorrect) / total_correct, 0.0, 1.0)
+    exact = (detected == correct).astype(np.float64)
+
+    is_partial = np.array([mode == "partial_credit" for mode in grading_modes], dtype=bool)[:, np.newaxis]
+    points_table = np.where(is_partial, partial, exact)
+    points_table[:, 0] = 0.0
+    points_table[total_correct[:, 0] == 0] = 0.0
+
+    # Correct answers that are not plain option indices keep the set semantics
+    for question in np.flatnonzero(~encodable):
+        correct_set = _normalize_to_set(correct_answers[question])
+        points_table[question] = [
+            _calculate_points(_mask_to_set(mask), correct_set, grading_modes[question])
+            for mask in range(1 << width)
+        ]
+
+    points_table.flags.writeable = False
+    return CompiledAnswerKey(correct_answers, grading_modes, len(correct_answers), width, points_table)
+
+
+def encode_answers(answers_list, num_questions):
+    """
+    Encode many submissions' detected answers as an (N, num_questions) uint32 mask matrix.
+
+    Submissions with fewer answers are padded with unanswered questions and
+    longer ones are truncated, mirroring how grade_submission zips them.
+
+    Returns:
+        Tuple of (masks, encodable) where encodable is an (N,) bool array that is
+        False for submissions holding answers that cannot be encoded
+    """
+    rows = []
+    encodable = np.ones(len(answers_list), dtype=bool)
+
+    for index, answers in enumerate(answers_list):
+        row = [0] * num_questions
+        for question, answer in enumerate(answers[:num_questions]):
+            # Plain ints and None are what the OMR produces; skip the generic path for them
+            if answer is None:
+                continue
+            if type(answer) is int and 0 <= answer < MASK_BITS:
+                row[question] = 1 << answer
+                continue
+
+            mask = answer_to_mask(answer)
+            if mask is None:
+                encodable[index] = False
+                break
+            row[question] = mask
+        rows.append(row)
+
+    masks = np.array(rows, dtype=np.uint32).reshape(len(answers_list), num_questions)
+    return masks, encodable
+
+
+def marks_to_masks(marks):
+    """
+    Convert an (..., num_options) boolean mark array straight to option bitmasks.
+
+    Returns:
+        uint32 array of shape marks.shape[:-1]
+    """
+    marks = np.asarray(marks, dtype=bool)
+    weights = np.left_shift(np.uint32(1), np.arange(marks.shape[-1], dtype=np.uint32))
+    return (marks * weights).sum(axis=-1, dtype=np.uint32)
+
+
+def score_masks(key, masks):
+    """
+    Score an (N, num_questions) detected-answer mask matrix against a compiled key.
+
+    Returns:
+        (N, num_questions) float64 array of points per question
+    """
+    masks = np.asarray(masks, dtype=np.uint32)
+    num_questions = key.points_table.shape[0]
+    if masks.ndim != 2 or masks.shape[1] != num_questions:
+        raise ValueError(f'Expected an (N, {num_questions}) mask matrix, got shape {masks.shape}')
+    if masks.size and int(masks.max()) >> key.width:
+        raise ValueError(f'Detected answers use more than the {key.width} options the key was compiled for')
+
+    return key.points_table[np.arange(num_questions), masks]
+
+
+def _points_with_sets(detected_answers, key):
+    """Score one submission question by question with the set-based rules."""
+    return [
+        _calculate_points(_normalize_to_set(detected), _normalize_to_set(correct), mode)
+        for detected, correct, mode in zip(detected_answers, key.correct_answers, key.grading_modes)
+    ]
+
+
+def _totals(key, points):
+    """Build the grade_masks/grade_answers result from an (N, num_questions) points matrix."""
+    count = points.shape[0]
+
+    # cumsum adds left to right, matching a per-question running total exactly
+    score = points.cumsum(axis=1)[:, -1] if points.shape[1] else np.zeros(count)
+    if key.total > 0:
+        # Python's round() is correctly rounded; np.round can differ in the last place
+        percentage = np.array([round(value, 2) for value in (score / key.total * 100).tolist()])
+    else:
+        percentage = np.zeros(count)
+
+    return {
+        'points': points,
+        'score': score,
+        'total': key.total,
+        'percentage': percentage,
+    }
+
+
+def grade_masks(key, masks):
+    """
+    Grade an (N, num_questions) matrix of detected-answer bitmasks against a compiled key.
+
+    This is the fast path for regrades from stored marks: no per-answer Python work.
+
+    Returns:
+        dict with 'points' ((N, num_questions) float64), 'score' and 'percentage'
+        ((N,) float64) and 'total'
+    """
+    masks = np.asarray(masks, dtype=np.uint32)
+
+    # Pad missing questions as unanswered and drop extra ones, like grade_answers
+    num_questions = key.points_table.shape[0]
+    if masks.shape[1] != num_questions:
+        fitted = np.zeros((masks.shape[0], num_questions), dtype=np.uint32)
+        fitted[:, :masks.shape[1]] = masks[:, :num_questions]
+        masks = fitted
+
+    width = int(masks.max()).bit_length() if masks.size else 0
+    if key.width < width <= MAX_OPTION_BITS:
+        key = compile_answer_key(key.correct_answers, key.grading_modes, width)
+
+    return _totals(key, score_masks(key, masks))
+
+
+def grade_answers(key, answers_list):
+    """
+    Grade many submissions against one compiled answer key.
+
+    Args:
+        key: CompiledAnswerKey
+        answers_list: List of N detected answer lists (int, list, or None per question)
+
+    Returns:
+        dict with 'points' ((N, num_questions) float64), 'score' and 'percentage'
+        ((N,) float64) and 'total'
+    """
+    num_questions = key.points_table.shape[0]
+    masks, encodable = encode_answers(answers_list, num_questions)
+
+    # Answers beyond the widest lookup table fall back to the set-based rules
+    encodable &= ~(masks >> MAX_OPTION_BITS).any(axis=1)
+    masks[~encodable] = 0
+
+    width = int(masks.max()).bit_length() if masks.size else 0
+    if width > key.width:
+        key = compile_answer_key(key.correct_answers, key.grading_modes, width)
+
+    points = score_masks(key, masks)
+    for row in np.flatnonzero(~encodable):
+        row_points = _points_with_sets(answers_list[row], key)
+        points[row] = 0.0
+        points[row, :len(row_points)] = row_points
+
+    return _totals(key, points)
+
+
+def grade_submission(detected_answers, correct_answers, grading_modes=None):
+    """
+    Grade a submission supporting multiple correct answers.
+
+    Args:
+        detected_answers: List of detected answers (int, list, or None)
+        correct_answers: List of correct answers (int or list for compatibility)
+        grading_modes: List of grading modes per question (optional)
+
+    Returns:
+        dict with score, total, percentage, and per-question details
+    """
+    key = compile_answer_key(correct_answers, grading_modes)
+    grading = grade_answers(key, [detected_answers])
+    points = grading['points'][0].tolist()
+
+    details = []
+    for i, (detected, correct, mode) in enumerate(zip(detected_answers, key.correct_answers, key.grading_modes)):
+        details.append({
+            'question': i + 1,
+            'detected': detected,
+            'correct': correct,
+            'is_correct': points[i] == 1.0,
+            'points': points[i],
+            'grading_mode': mode
+        })
+
+    return {
+        'score': float(grading['score'][0]),
+        'total': grading['total'],
+        'percentage': float(grading['percentage'][0]),
+        'details': details
+    }
@@ -0,0 +1,61 @@
+"""Answer box layout shared by the PDF generator and the OMR grader.
+
+All lengths are in centimetres. Bubble positions are measured from the top-left
+corner of the printed answer box, with y growing downwards like image rows, so
+the grader can map them straight onto a sheet warped to the box outline.
+
+Bump LAYOUT_VERSION whenever the printed positions change, so sheets printed
+with an older layout keep being read with the geometry they were printed with.
+"""
+
+LAYOUT_VERSION = 1
+
+ROW_HEIGHT = 1.0
+CIRCLE_SPACING = 1.2
+BUBBLE_RADIUS = 0.3
+
+# Distance from the box's left edge to the centre of the first bubble column
+BOX_LEFT_PADDING = 0.7
+# Distance from the box's top edge to the centre of the first bubble row
+BOX_TOP_PADDING = 0.5
+BOX_EXTRA_WIDTH = 0.2
+BOX_EXTRA_HEIGHT = 0.3
+
+
+def box_size(num_questions, num_answers):
+    """Return (width, height) of the answer box in cm."""
+    width = num_answers * CIRCLE_SPACING + BOX_EXTRA_WIDTH
+    height = num_questions * ROW_HEIGHT + BOX_EXTRA_HEIGHT
+    return width, height
+
+
+def bubble_centre(question_index, option_index):
+    """Return the (x, y) centre of a bubble in cm from the box's top-left corner."""
+    x = BOX_LEFT_PADDING + option_index * CIRCLE_SPACING
+    y = BOX_TOP_PADDING + question_index * ROW_HEIGHT
+    return x, y
+
+
+def sheet_geometry(num_questions, num_answers):
+    """
+    Describe where every bubble of a num_questions x num_answers answer box is printed.
+
+    Returns:
+        JSON-serializable dict with the layout version, box size, bubble radius
+        and a num_questions x num_answers list of [x, y] bubble centres
+    """
+    width, height = box_size(num_questions, num_answers)
+    bubbles = [
+        [[round(coord, 4) for coord in bubble_centre(q, o)] for o in range(num_answers)]
+        for q in range(num_questions)
+    ]
+
+    return {
+        "version": LAYOUT_VERSION,
+        "units": "cm",
+        "num_questions": num_questions,
+        "num_options": num_answers,
+        "box": {"width": round(width, 4), "height": round(height, 4)},
+        "bubble_radius": BUBBLE_RADIUS,
+        "bubbles": bubbles,
+    }
@@ -9,6 +9,8 @@ from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 
+from .layout import BOX_LEFT_PADDING, BUBBLE_RADIUS, box_size, bubble_centre
+
 
 def _font_paths():
     base_dir = Path(__file__).resolve().parent.parent
@@ -69,6 +71,37 @@ def draw_question_with_options(c, question, y_position, margin, width, font_regu
     return y_position
 
 
+FIDUCIAL_SIZE = 0.7 * cm
+FIDUCIAL_HOLE = 0.3 * cm
+
+
+def draw_fiducials(c, x, y, box_width, box_height):
+    """Draw the four corner markers the grader uses to locate the bubble box.
+
+    Each marker is a solid square placed diagonally outside one corner of the
+    box, touching it at that corner. The top-left marker has a white centre so
+    the grader can tell which way up the sheet was photographed.
+    """
+    size = FIDUCIAL_SIZE
+    corners = [
+        (x - size, y + box_height),  # top-left
+        (x + box_width, y + box_height),  # top-right
+        (x + box_width, y - size),  # bottom-right
+        (x - size, y - size),  # bottom-left
+    ]
+
+    c.saveState()
+    c.setFillColorRGB(0, 0, 0)
+    for corner_x, corner_y in corners:
+        c.rect(corner_x, corner_y, size, size, stroke=0, fill=1)
+
+    hole_x = corners[0][0] + (size - FIDUCIAL_HOLE) / 2
+    hole_y = corners[0][1] + (size - FIDUCIAL_HOLE) / 2
+    c.setFillColorRGB(1, 1, 1)
+    c.rect(hole_x, hole_y, FIDUCIAL_HOLE, FIDUCIAL_HOLE, stroke=0, fill=1)
+    c.restoreState()
+
+
 def _register_fonts():
     regular_path, bold_path = _font_paths()
     pdfmetrics.registerFont(TTFont("Arial", str(regular_path)))
@@ -110,36 +143,34 @@ def generate_test_pdf(json_file, output_pdf):
     c.drawString(margin, y_position, "Prenume: _____________________________")
     y_position -= 2 * cm
 
-    row_height = 1 * cm
-    box_height = (data.get("num_questions", 0) * row_height + 0.3 * cm)
-
-    x_start = margin + 2 * cm
-    circle_spacing = 1.2 * cm
+    # Bubble positions come from the shared layout so the grader knows exactly where to look
+    box_width, box_height = box_size(data.get("num_questions", 0), num_answers)
+    rect_width = box_width * cm
+    box_height = box_height * cm
 
-    rect_width = (num_answers * circle_spacing) + 0.2 * cm
+    box_left = margin + 2 * cm - BOX_LEFT_PADDING * cm
+    box_top = y_position - 0.3 * cm
 
-    c.rect(x_start - 0.7 * cm, y_position - box_height - 0.3 * cm, rect_width, box_height)
+    c.rect(box_left, box_top - box_height, rect_width, box_height)
+    draw_fiducials(c, box_left, box_top - box_height, rect_width, box_height)
 
     c.setFont(font_bold, 10)
     for i in range(num_answers):
         letter = chr(65 + i)
-        x_pos = x_start + (i * circle_spacing)
+        x_pos = box_left + bubble_centre(0, i)[0] * cm
         text_width = c.stringWidth(letter, font_bold, 10)
         c.drawString(x_pos - text_width / 2, y_position + 0.1 * cm, letter)
 
-    y_position -= 0.8 * cm
-
-    for question in data.get("questions", []):
+    for row, question in enumerate(data.get("questions", [])):
         q_id = question.get("id")
+        y_position = box_top - bubble_centre(row, 0)[1] * cm
 
         c.setFont(font_regular, 10)
         c.drawString(margin + 0.5 * cm, y_position - 0.1 * cm, f"{q_id}.")
 
         for i in range(num_answers):
-            x_pos = x_start + (i * circle_spacing)
-            c.circle(x_pos, y_position, 0.3 * cm, stroke=1, fill=0)
-
-        y_position -= row_height
+            x_pos = box_left + bubble_centre(row, i)[0] * cm
+            c.circle(x_pos, y_position, BUBBLE_RADIUS * cm, stroke=1, fill=0)
 
     c.showPage()
 
@@ -133,3 +133,68 @@ STATICFILES_DIRS = [
 # Media (uploaded files)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Generated test PDFs and the JSON they are rendered from (which holds the correct answers);
+# kept out of STATICFILES_DIRS so they are only reachable through the access-checked view
+GENERATED_TESTS_ROOT = MEDIA_ROOT / 'generated_tests'
+
+# Quality of the grayscale JPEGs submission images are stored as (0 = store uploads unchanged)
+SUBMISSION_IMAGE_JPEG_QUALITY = config('SUBMISSION_IMAGE_JPEG_QUALITY', default=80, cast=int)
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    # Submission sheet images, stored once per distinct image under media/sheets/
+    'submissions': {
+        'BACKEND': 'test_grader.storage.ContentAddressedImageStorage',
+        'OPTIONS': {'jpeg_quality': SUBMISSION_IMAGE_JPEG_QUALITY},
+    },
+}
+
+# Submission images and test PDFs are only served through views that check who is asking.
+# Who then sends the file: '' streams it from Django, 'x-accel-redirect' hands it to nginx,
+# 'x-sendfile' to Apache (mod_xsendfile) or lighttpd
+PROTECTED_MEDIA_SERVER = config('PROTECTED_MEDIA_SERVER', default='')
+# Internal nginx location for 'x-accel-redirect'; <prefix>media/ must map to MEDIA_ROOT and
+# <prefix>pdf/ to GENERATED_TESTS_ROOT
+PROTECTED_MEDIA_ACCEL_PREFIX = config('PROTECTED_MEDIA_ACCEL_PREFIX', default='/protected/')
+
+# OMR grading
+# Worker processes used to grade uploaded batches (0 = one per CPU core)
+OMR_WORKERS = config('OMR_WORKERS', default=0, cast=int)
+# Largest image accepted from a zip upload, checked against each member's header and while reading it
+OMR_ZIP_MEMBER_MAX_BYTES = config('OMR_ZIP_MEMBER_MAX_BYTES', default=20 * 1024 * 1024, cast=int)
+# Bulk-upload sheets allowed in a web process's worker pool at once; with OMR_JOB_RUNNER='thread' the
+# other workers stay free for students waiting on their result (0 = all workers but one). Each
+# omr_worker grades uploads only, on a pool of its own (`--processes`, default OMR_WORKERS - 1)
+OMR_BULK_IN_FLIGHT = config('OMR_BULK_IN_FLIGHT', default=0, cast=int)
+# Uploaded sheets up to this size are graded and stored straight from memory
+OMR_UPLOAD_MEMORY_MAX_BYTES = config('OMR_UPLOAD_MEMORY_MAX_BYTES', default=32 * 1024 * 1024, cast=int)
+# Where larger uploads get their per-request scratch directory, e.g. a tmpfs mount like /dev/shm
+# (empty = the system temp directory); Django spools large uploads there too
+OMR_SCRATCH_DIR = config('OMR_SCRATCH_DIR', default='')
+FILE_UPLOAD_TEMP_DIR = OMR_SCRATCH_DIR or None
+# Total size of cached OMR results for re-uploaded images (0 disables the cache)
+OMR_RESULT_CACHE_MAX_BYTES = config('OMR_RESULT_CACHE_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+# Return the existing submission instead of creating a new one when a teacher re-uploads the same image
+OMR_DEDUPE_SUBMISSIONS = config('OMR_DEDUPE_SUBMISSIONS', default=False, cast=bool)
+# Time every OMR stage, attach a trace to each upload result and serve Prometheus metrics at /metrics/
+OMR_INSTRUMENTATION = config('OMR_INSTRUMENTATION', default=False, cast=bool)
+# Bearer token a Prometheus scraper sends to read /metrics/; without it only staff users can
+# (empty = staff only)
+OMR_METRICS_TOKEN = config('OMR_METRICS_TOKEN', default='')
+# Who grades uploaded batches: 'thread' runs jobs on a background thread of the web process,
+# 'worker' leaves them for `manage.py omr_worker`
+OMR_JOB_RUNNER = config('OMR_JOB_RUNNER', default='thread')
+# Background threads per web process running grading jobs when OMR_JOB_RUNNER is 'thread'
+OMR_JOB_THREADS = config('OMR_JOB_THREADS', default=1, cast=int)
+# Sheets per queued grading task, the unit a worker claims at a time
+OMR_TASK_SHEETS = config('OMR_TASK_SHEETS', default=16, cast=int)
+# Seconds a claimed task stays leased without a heartbeat before another worker may take it over
+OMR_TASK_LEASE_SECONDS = config('OMR_TASK_LEASE_SECONDS', default=120, cast=int)
+# Times a task is tried before its sheets are reported as failed
+OMR_TASK_MAX_ATTEMPTS = config('OMR_TASK_MAX_ATTEMPTS', default=3, cast=int)
@@ -24,7 +24,7 @@ function displayTests(tests) {
         if (item.submission_count > 0) {
             let latestHtml = '';
             if (item.latest_submission) {
-                latestHtml = '<div class="stat-secondary">Latest: ' + escapeHtml(item.latest_submission) + ' (' + item.latest_percentage + '%)</div>';
+                latestHtml = '<div class="stat-secondary">Latest: ' + escapeHtml(item.latest_submission.student) + ' (' + item.latest_percentage + '%)</div>';
             }
             statsHtml = `
                 <div class="stats-row">
@@ -99,9 +99,12 @@ document.addEventListener('DOMContentLoaded', function() {
     const sortSelect = document.getElementById('sort-tests');
     const dataScript = document.getElementById('tests-data');
 
+    let nextCursor = null;
     if (dataScript && dataScript.textContent) {
         try {
-            window.allTests = JSON.parse(dataScript.textContent);
+            const page = JSON.parse(dataScript.textContent);
+            window.allTests = page.tests || [];
+            nextCursor = page.next_cursor;
         } catch (err) {
             console.error('Failed to parse tests data:', err);
             window.allTests = [];
@@ -123,8 +126,27 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     gridClickHandler();
+    loadRemainingTests(nextCursor);
 });
 
+// The page ships with the newest tests; the rest are fetched page by page and merged in
+function loadRemainingTests(cursor) {
+    if (!cursor) return;
+
+    fetch(`/api/tests/?cursor=${encodeURIComponent(cursor)}`, { credentials: 'same-origin' })
+        .then((res) => res.json().then((data) => ({ ok: res.ok, data })))
+        .then(({ ok, data }) => {
+            if (!ok || data.error) {
+                console.error(data.error || 'Failed to load tests.');
+                return;
+            }
+            window.allTests = (window.allTests || []).concat(data.tests);
+            filterAndSortTests();
+            loadRemainingTests(data.next_cursor);
+        })
+        .catch((err) => console.error('Failed to load tests:', err));
+}
+
 function gridClickHandler() {
     const grid = document.getElementById('test-grid');
     if (!grid) return;
@@ -2,6 +2,7 @@ from django.urls import path
 from .views import (
     generator_page,
     test_list_page,
+    test_list_api,
     test_detail_page,
     create_test,
     delete_test,
@@ -12,6 +13,7 @@ from .views import (
 urlpatterns = [
     path("test-generator/", generator_page, name="test-generator"),
     path("tests/", test_list_page, name="tests"),
+    path("api/tests/", test_list_api, name="test-list-api"),
     path("tests/<int:test_id>/", test_detail_page, name="test-detail"),
     path("tests/<int:test_id>/pdf/", pdf_test, name="test-pdf"),
     path("accounts/api-create-test/", create_test, name="api-create-test"),
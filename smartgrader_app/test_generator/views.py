@@ -5,16 +5,24 @@ from random import sample
 import sys
 
 from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.http import JsonResponse
 from django.shortcuts import render
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
 PROJECT_ROOT = Path(__file__).resolve().parents[2]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.append(str(PROJECT_ROOT))
 
+from pdf_generator.layout import sheet_geometry
 from pdf_generator.pdf_generator import generate_test_pdf
-from test_grader.models import Test as GraderTest
+from test_grader.answer_keys import get_answer_key, option_label
+from test_grader.models import Submission, Test as GraderTest, TestStats
+from test_grader.pagination import InvalidCursor, keyset_page, parse_limit
+from test_grader.stats import get_test_stats
+from test_grader.submission_feed import submissions_page
 from .models import TestEntry
 
 
@@ -31,84 +39,133 @@ def generator_page(request):
     return render(request, "test_generator/test_generator.html")
 
 
-def _serialize_test(entry):
-    """Convert a TestEntry into a JSON-friendly dict with summary stats."""
-    payload = entry.payload or {}
-    questions = payload.get("questions", [])
-    try:
-        grader_test = _ensure_grader_test(entry)
-        subs = grader_test.submissions.filter(processed=True)
-        submission_count = subs.count()
-        avg_pct = round(sum(s.percentage for s in subs) / submission_count, 2) if submission_count else 0
-    except Exception:
-        grader_test = None
-        submission_count = payload.get("submission_count", 0)
-        avg_pct = payload.get("average_percentage", 0)
-
-    latest_submission = None
-    if grader_test:
-        latest = grader_test.submissions.order_by("-submitted_at").first()
-        if latest:
-            latest_submission = {
+# Tests per page of the test list and its JSON API
+TEST_LIST_PAGE_SIZE = 24
+TEST_LIST_MAX_PAGE_SIZE = 100
+
+
+def _listed_tests(owner):
+    """
+    A teacher's tests annotated with their submission stats, in one query.
+
+    The stats come from each test's TestStats row and the question count from
+    the grader's Test row, which exists once the test has been opened or
+    graded. The payload is deferred.
+    """
+    stats = TestStats.objects.filter(test_id=OuterRef("pk"))
+    return (
+        TestEntry.objects.filter(owner=owner)
+        .defer("payload")
+        .annotate(
+            submission_count=Coalesce(Subquery(stats.values("submission_count")), 0),
+            percentage_sum=Subquery(stats.values("percentage_sum")),
+            latest_submission_id=Subquery(stats.values("latest_submission_id")),
+            grader_num_questions=Subquery(GraderTest.objects.filter(id=OuterRef("pk")).values("num_questions")[:1]),
+        )
+    )
+
+
+def _serialize_listed_tests(entries, owner):
+    """Convert a page of _listed_tests() rows into JSON-friendly dicts with summary stats."""
+    latest_ids = [entry.latest_submission_id for entry in entries if entry.latest_submission_id]
+    latest_by_id = (
+        Submission.objects.select_related("student_user")
+        .only(
+            "percentage", "score", "submitted_at", "first_name", "last_name",
+            "student_user__first_name", "student_user__last_name", "student_user__email",
+        )
+        .in_bulk(latest_ids)
+    )
+    # Tests the grader hasn't seen yet: count their questions from the payload
+    missing = [entry.id for entry in entries if entry.grader_num_questions is None]
+    question_counts = {
+        entry_id: len(questions or [])
+        for entry_id, questions in TestEntry.objects.filter(id__in=missing).values_list("id", "payload__questions")
+    } if missing else {}
+
+    data = []
+    for entry in entries:
+        latest = latest_by_id.get(entry.latest_submission_id)
+        latest_submission = (
+            {
                 "student": latest.full_name,
                 "percentage": latest.percentage,
                 "score": latest.score,
                 "submitted_at": latest.submitted_at.strftime("%Y-%m-%d %H:%M"),
             }
-    if not latest_submission:
-        latest_submission = payload.get("latest_submission")
+            if latest
+            else None
+        )
+        num_questions = entry.grader_num_questions
+        if num_questions is None:
+            num_questions = question_counts.get(entry.id, 0)
+
+        data.append(
+            {
+                "id": entry.id,
+                "title": entry.title,
+                "description": entry.description or "",
+                "submission_count": entry.submission_count,
+                "average_percentage": (
+                    round(entry.percentage_sum / entry.submission_count, 2) if entry.submission_count else 0
+                ),
+                "latest_submission": latest_submission,
+                "latest_percentage": latest.percentage if latest else 0,
+                "num_questions": num_questions,
+                "created_at": entry.created_at.strftime("%Y-%m-%d %H:%M"),
+                "created_timestamp": int(entry.created_at.timestamp()),
+                "owner_email": owner.email,
+            }
+        )
+    return data
 
-    return {
-        "id": entry.id,
-        "title": entry.title,
-        "description": entry.description or "",
-        "submission_count": submission_count,
-        "average_percentage": avg_pct,
-        "latest_submission": latest_submission,
-        "latest_percentage": latest_submission["percentage"] if isinstance(latest_submission, dict) else 0,
-        "num_questions": len(questions),
-        "created_at": entry.created_at.strftime("%Y-%m-%d %H:%M"),
-        "created_timestamp": int(entry.created_at.timestamp()),
-        "owner_email": entry.owner.email if getattr(entry, "owner_id", None) else "",
-    }
+
+def _test_list_page_data(owner, cursor=None, limit=TEST_LIST_PAGE_SIZE):
+    """Return (tests, next_cursor) for one page of a teacher's tests, newest first."""
+    entries, next_cursor = keyset_page(_listed_tests(owner), "created_at", limit, cursor=cursor)
+    return _serialize_listed_tests(entries, owner), next_cursor
 
 
 def test_list_page(request):
-    """Serve the test list using DB-backed entries."""
+    """Serve the first page of the test list; the rest is loaded from test_list_api."""
     if not _ensure_teacher(request.user):
         return JsonResponse({"error": "Only professors can view tests."}, status=403)
 
-    tests = TestEntry.objects.filter(owner=request.user).order_by("-created_at")
-    data = [_serialize_test(t) for t in tests]
+    data, next_cursor = _test_list_page_data(request.user)
 
     return render(
         request,
         "test_generator/test_list.html",
-        {"tests_json": json.dumps(data)},
+        {"tests_json": json.dumps({"tests": data, "next_cursor": next_cursor})},
     )
 
 
-def _build_questions(payload):
-    """Normalize raw question payload into the shape expected by templates."""
+def test_list_api(request):
+    """Return a page of the teacher's tests, newest first; pass next_cursor back as ?cursor= for the next one."""
+    if not _ensure_teacher(request.user):
+        return JsonResponse({"error": "Only professors can view tests."}, status=403)
+
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET allowed"}, status=405)
+
+    try:
+        limit = parse_limit(request.GET.get("limit"), TEST_LIST_PAGE_SIZE, TEST_LIST_MAX_PAGE_SIZE)
+        data, next_cursor = _test_list_page_data(request.user, request.GET.get("cursor"), limit)
+    except (InvalidCursor, ValueError):
+        return JsonResponse({"error": "Invalid cursor or limit"}, status=400)
+
+    return JsonResponse({"tests": data, "next_cursor": next_cursor})
+
+
+def _build_questions(payload, answer_key):
+    """Normalize raw question payload into the shape expected by templates, marking the key's correct options."""
     questions = []
-    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
     for idx_q, q in enumerate(payload.get("questions", []), start=1):
-        # Handle correct_answer as either a single value or a list
-        correct_answer_raw = q.get("correct_answer", 0)
-        if isinstance(correct_answer_raw, list):
-            correct_indices = set(correct_answer_raw)
-        elif isinstance(correct_answer_raw, int):
-            correct_indices = {correct_answer_raw}
-        else:
-            try:
-                correct_indices = {int(correct_answer_raw)}
-            except (TypeError, ValueError):
-                correct_indices = {0}
-
         opts = []
         for idx, text in enumerate(q.get("options", [])):
-            label = letters[idx] if idx < len(letters) else str(idx + 1)
-            opts.append({"label": label, "text": text, "is_correct": idx in correct_indices})
+            opts.append(
+                {"label": option_label(idx), "text": text, "is_correct": answer_key.is_correct_option(idx_q - 1, idx)}
+            )
         questions.append(
             {
                 "id": q.get("id") or q.get("question_id") or q.get("uuid") or idx_q,
@@ -122,7 +179,11 @@ def _build_questions(payload):
 
 
 def _ensure_grader_test(entry):
-    """Create or update a TestGrader.Test row for this generated test."""
+    """Return the TestGrader.Test row for this generated test, creating it if missing."""
+    existing = GraderTest.objects.filter(id=entry.id).first()
+    if existing is not None:
+        return existing
+
     payload = entry.payload or {}
     questions_payload = payload.get("questions", [])
     normalized = []
@@ -132,22 +193,22 @@ def _ensure_grader_test(entry):
         options = q.get("options") or []
         max_options = max(max_options, len(options))
 
-        # Handle correct_answer which can be int, list, or string
+        # correct_answer can be an int, a list of option indices or a numeric string; every index is kept
         raw_answer = q.get("correct_answer", 0)
         try:
             if isinstance(raw_answer, list):
-                # If it's a list, take the first element
-                correct_answer = int(raw_answer[0]) if raw_answer else 0
+                correct_answer = sorted({int(option) for option in raw_answer}) or [0]
             else:
-                correct_answer = int(raw_answer)
-        except (TypeError, ValueError, IndexError):
-            correct_answer = 0
+                correct_answer = [int(raw_answer)]
+        except (TypeError, ValueError):
+            correct_answer = [0]
 
         normalized.append(
             {
                 "question": q.get("text") or q.get("question") or "",
                 "options": options,
                 "correct_answer": correct_answer,
+                "grading_mode": q.get("grading_mode", "all_or_nothing"),
             }
         )
 
@@ -156,8 +217,8 @@ def _ensure_grader_test(entry):
     except (TypeError, ValueError):
         num_options = max_options or 5
 
-    # Update existing or create new
-    grader_test, created = GraderTest.objects.update_or_create(
+    # Created once; later answer key edits are made on the grader's Test and must not be overwritten
+    grader_test, created = GraderTest.objects.get_or_create(
         id=entry.id,
         defaults={
             'title': entry.title,
@@ -166,6 +227,7 @@ def _ensure_grader_test(entry):
             'created_by': entry.owner,
             'num_questions': len(normalized),
             'num_options': num_options,
+            'sheet_geometry': payload.get("sheet_geometry"),
         }
     )
     return grader_test
@@ -183,11 +245,12 @@ def test_detail_page(request, test_id: int):
 
     payload = entry.payload or {}
     grader_test = _ensure_grader_test(entry)
-    submissions_qs = grader_test.submissions.filter(processed=True).order_by("-submitted_at")
-    submission_count = submissions_qs.count()
-    avg_pct = round(sum(sub.percentage for sub in submissions_qs) / submission_count, 2) if submission_count else 0
+    answer_key = get_answer_key(grader_test)
+    stats = get_test_stats(grader_test)
+    submission_count = stats.submission_count
+    avg_pct = round(stats.average_percentage, 2)
 
-    latest_submission = submissions_qs.first()
+    latest_submission = stats.latest_submission
     latest_data = (
         {
             "student": latest_submission.full_name,
@@ -199,27 +262,7 @@ def test_detail_page(request, test_id: int):
         else None
     )
 
-    submissions_table = []
-    for sub in submissions_qs[:10]:
-        image_url = sub.image.url if sub.image else None
-        if image_url:
-            image_url = request.build_absolute_uri(image_url)
-
-        submissions_table.append(
-            {
-                "id": sub.id,
-                "student_name": sub.full_name,
-                "first_name": sub.first_name or "",
-                "last_name": sub.last_name or "",
-                "score": sub.score,
-                "total": sub.total_questions,
-                "percentage": sub.percentage,
-                "submitted_at": sub.submitted_at.strftime("%Y-%m-%d %H:%M"),
-                "image_url": image_url,
-                "answers": sub.answers,
-                "correct_answers": [q.get("correct_answer") for q in grader_test.questions],
-            }
-        )
+    submission_page = submissions_page(grader_test)
 
     test_detail = {
         "id": entry.id,
@@ -233,16 +276,15 @@ def test_detail_page(request, test_id: int):
         "latest_submission": latest_data,
     }
 
-    questions = _build_questions(payload)
+    questions = _build_questions(payload, answer_key)
 
     return render(
         request,
         "test_generator/test_detail.html",
         {
             "test": test_detail,
-            "submissions": submissions_table,
-            "submissions_json": json.dumps(submissions_table),
-            "correct_answers": [q.get("correct_answer") for q in grader_test.questions],
+            "submission_page_json": json.dumps(submission_page),
+            "correct_answers": answer_key.correct_answers,
             "questions": questions,
         },
     )
@@ -311,6 +353,7 @@ def create_test(request):
                 payload=variant_payload,
                 owner=request.user if request.user.is_authenticated else None,
             )
+            _ensure_grader_test(entry)
             created_ids.append(entry.id)
             created_entries.append(entry)
     except Exception as exc:
@@ -328,6 +371,7 @@ def create_test(request):
                 with open(json_path, "w", encoding="utf-8") as fh:
                     json.dump(pdf_payload, fh, ensure_ascii=False, indent=2)
                 generate_test_pdf(str(json_path), str(pdf_path))
+                _store_sheet_geometry(entry, pdf_payload)
                 pdf_urls.append(_pdf_url(request, entry.id))
         except Exception as exc:
             return JsonResponse({"error": f"Failed to generate PDF: {exc}"}, status=500)
@@ -417,9 +461,23 @@ def _build_pdf_payload(entry):
     return data, None
 
 
+def _store_sheet_geometry(entry, pdf_payload):
+    """Save the bubble geometry of a freshly generated PDF with the test, for the grader."""
+    geometry = sheet_geometry(pdf_payload["num_questions"], pdf_payload["num_answers"])
+
+    payload = entry.payload or {}
+    if payload.get("sheet_geometry") == geometry:
+        return
+
+    payload["sheet_geometry"] = geometry
+    entry.payload = payload
+    entry.save(update_fields=["payload"])
+    GraderTest.objects.filter(id=entry.id).update(sheet_geometry=geometry)
+
+
 def _pdf_storage_paths(test_id: int):
-    """Return paths for the intermediate JSON file and generated PDF."""
-    generated_dir = Path(settings.BASE_DIR) / "static" / "generated"
+    """Return paths for the intermediate JSON file and generated PDF, outside the public static files."""
+    generated_dir = Path(settings.GENERATED_TESTS_ROOT)
     generated_dir.mkdir(parents=True, exist_ok=True)
     json_path = generated_dir / f"test_{test_id}.json"
     pdf_path = generated_dir / f"test_{test_id}.pdf"
@@ -427,14 +485,8 @@ def _pdf_storage_paths(test_id: int):
 
 
 def _pdf_url(request, test_id: int):
-    """Build the absolute URL to the generated PDF for a test."""
-    static_url = settings.STATIC_URL or "/static/"
-    if not static_url.startswith(("http://", "https://", "/")):
-        static_url = f"/{static_url}"
-    if not static_url.endswith("/"):
-        static_url = f"{static_url}/"
-    relative_url = f"{static_url}generated/test_{test_id}.pdf"
-    return request.build_absolute_uri(relative_url)
+    """Build the absolute URL of the access-checked view serving a test's generated PDF."""
+    return request.build_absolute_uri(reverse("test-pdf-file", args=[test_id]))
 
 
 def pdf_test(request, test_id: int):
@@ -457,6 +509,7 @@ def pdf_test(request, test_id: int):
         with open(json_path, "w", encoding="utf-8") as fh:
             json.dump(data, fh, ensure_ascii=False, indent=2)
         generate_test_pdf(str(json_path), str(pdf_path))
+        _store_sheet_geometry(entry, data)
     except Exception as exc:
         return JsonResponse({"error": f"PDF generation failed: {exc}"}, status=500)
 
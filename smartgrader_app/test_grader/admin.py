@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Submission, Test
+from .models import GradingJob, GradingTask, Submission, Test, TestStats
 
 
 @admin.register(Test)
@@ -14,3 +14,24 @@ class SubmissionAdmin(admin.ModelAdmin):
     list_display = ('id', 'test', 'full_name', 'score', 'percentage', 'submitted_at', 'processed')
     list_filter = ('processed',)
     search_fields = ('first_name', 'last_name', 'student_user__email', 'test__title')
+
+
+@admin.register(TestStats)
+class TestStatsAdmin(admin.ModelAdmin):
+    list_display = ('test', 'submission_count', 'pass_count', 'min_percentage', 'max_percentage', 'updated_at')
+    search_fields = ('test__title',)
+    readonly_fields = ('grade_counts', 'latest_submission')
+
+
+@admin.register(GradingJob)
+class GradingJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'test', 'created_by', 'status', 'done', 'failed', 'total', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('errors', 'sources')
+
+
+@admin.register(GradingTask)
+class GradingTaskAdmin(admin.ModelAdmin):
+    list_display = ('id', 'job', 'sequence', 'status', 'attempts', 'worker', 'lease_expires_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('sheets', 'results', 'error')
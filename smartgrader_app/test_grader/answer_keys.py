@@ -0,0 +1,142 @@
+"""
+Compiled answer keys, cached per test version.
+
+An AnswerKey holds everything the grading, detail and export paths derive from
+a test's questions JSON: correct answers and their option bitmasks, grading
+modes, the option count and display labels, and the scoring lookup table. It
+is built once per (test id, updated_at) and kept in a small process-local LRU
+in front of the Django cache, so other processes reuse it too. Saving a test
+bumps updated_at, which retires the old version; the post_save handler in
+signals.py also drops the versions this process holds from both caches.
+"""
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from django.core.cache import cache
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.append(str(PROJECT_ROOT))
+
+from grade_processor.scoring import answer_to_mask, compile_answer_key, grade_answers  # noqa: E402
+
+# Compiled keys kept per process
+LOCAL_CACHE_SIZE = 256
+# Seconds a compiled key stays in the Django cache
+CACHE_TIMEOUT = 24 * 60 * 60
+# Bump when AnswerKey changes shape, so keys pickled by an older release aren't loaded
+CACHE_KEY_PREFIX = 'answer-key:v1'
+
+OPTION_LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+_local = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def option_label(index):
+    """Display label of an option: A, B, ... Z, then its 1-based number."""
+    return OPTION_LETTERS[index] if 0 <= index < len(OPTION_LETTERS) else str(index + 1)
+
+
+class AnswerKey:
+    """A test's answer key in the forms the grader, detail pages and exports use."""
+
+    def __init__(self, test):
+        questions = test.questions or []
+        self.test_id = test.id
+        self.version = _version(test)
+        self.num_options = test.num_options
+        self.correct_answers = [q.get('correct_answer') for q in questions]
+        self.grading_modes = [q.get('grading_mode', 'all_or_nothing') for q in questions]
+        # Option bitmask per question, None where the stored answer isn't plain option indices
+        self.correct_masks = [answer_to_mask(answer) for answer in self.correct_answers]
+        self.option_labels = [option_label(index) for index in range(self.num_options)]
+        self.correct_labels = [self.answer_label(answer) for answer in self.correct_answers]
+        # grade_processor.scoring.CompiledAnswerKey: the points for every detected answer of every question
+        self.scoring = compile_answer_key(self.correct_answers, self.grading_modes, self.num_options)
+
+    @property
+    def num_questions(self):
+        return len(self.correct_answers)
+
+    def grade(self, detected_answers):
+        """Score one submission's answers; returns the score, total and percentage like grade_submission."""
+        grading = grade_answers(self.scoring, [detected_answers])
+        return {
+            'score': float(grading['score'][0]),
+            'total': grading['total'],
+            'percentage': float(grading['percentage'][0]),
+        }
+
+    def grade_many(self, answers_list):
+        """Score many submissions at once; see grade_processor.scoring.grade_answers."""
+        return grade_answers(self.scoring, answers_list)
+
+    def is_correct(self, question, answer):
+        """True when answer selects exactly the correct options of question (0-based)."""
+        correct = self.correct_masks[question]
+        if correct is None:
+            return _as_set(answer) == _as_set(self.correct_answers[question])
+        return answer_to_mask(answer) == correct
+
+    def is_correct_option(self, question, option):
+        correct = self.correct_masks[question] if question < len(self.correct_masks) else None
+        return correct is not None and bool(correct >> option & 1)
+
+    def answer_label(self, answer, separator=', '):
+        """Letters of the options an answer selects, e.g. 'A, C'; None when nothing is selected."""
+        if answer is None:
+            return None
+        options = sorted(answer) if isinstance(answer, list) else [answer]
+        if not options:
+            return None
+        return separator.join(
+            option_label(option) if isinstance(option, int) else str(option) for option in options
+        )
+
+
+def _as_set(answer):
+    if isinstance(answer, list):
+        return set(answer)
+    return {answer} if isinstance(answer, int) else set()
+
+
+def _version(test):
+    return test.updated_at.isoformat() if test.updated_at else ''
+
+
+def _cache_key(test_id, version):
+    return f'{CACHE_KEY_PREFIX}:{test_id}:{version}'
+
+
+def get_answer_key(test):
+    """Return the AnswerKey of a test's current version, compiling it on a miss in both caches."""
+    version = (test.id, _version(test))
+    with _local_lock:
+        key = _local.get(version)
+        if key is not None:
+            _local.move_to_end(version)
+            return key
+
+    key = cache.get(_cache_key(*version))
+    if key is None:
+        key = AnswerKey(test)
+        cache.set(_cache_key(*version), key, CACHE_TIMEOUT)
+
+    with _local_lock:
+        _local[version] = key
+        _local.move_to_end(version)
+        while len(_local) > LOCAL_CACHE_SIZE:
+            _local.popitem(last=False)
+    return key
+
+
+def forget_answer_keys(test_id):
+    """Drop every cached version of a test's answer key."""
+    with _local_lock:
+        versions = [version for version in _local if version[0] == test_id]
+        for version in versions:
+            del _local[version]
+    cache.delete_many([_cache_key(*version) for version in versions])
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TestGraderConfig(AppConfig):
     name = 'test_grader'
+
+    def ready(self):
+        import test_grader.signals  # noqa: F401
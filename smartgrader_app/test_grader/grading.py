@@ -0,0 +1,251 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+from django.db import transaction
+
+from test_generator.models import TestEntry
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.append(str(PROJECT_ROOT))
+
+from grade_processor.omr_main import marks_to_answers, unpack_fill_ratios  # noqa: E402
+from grade_processor.scoring import grade_masks, marks_to_masks  # noqa: E402
+
+from .answer_keys import get_answer_key
+from .models import Submission, Test
+from .stats import next_change, rebuild_test_stats
+
+# Rows written per UPDATE statement when saving regraded submissions
+REGRADE_BATCH_SIZE = 500
+
+# Submissions loaded, scored and written per step of an answer key regrade
+REGRADE_CHUNK_SIZE = 1000
+
+GRADING_MODES = ('all_or_nothing', 'partial_credit')
+
+
+def regrade_test(test, darkness_threshold=0.6):
+    """
+    Re-derive answers and scores for every submission of a test from the stored fill ratios.
+
+    No image is decoded: the stored matrices are stacked, thresholded and scored
+    in one vectorized pass, then written back with bulk_update. Submissions without
+    fill ratios (graded before they were stored) or whose matrix no longer
+    matches the test's size are left untouched. The test's TestStats are
+    rebuilt in the same transaction.
+
+    Args:
+        test: test_grader Test instance
+        darkness_threshold: Fraction of bubble that must be filled (0.0-1.0)
+
+    Returns:
+        dict with 'regraded' and 'skipped' counts
+    """
+    expected_shape = (test.num_questions, test.num_options)
+
+    ids = []
+    matrices = []
+    skipped = 0
+    rows = Submission.objects.filter(test=test, fill_ratios__isnull=False).values_list('id', 'fill_ratios')
+    for submission_id, blob in rows.iterator():
+        fill_ratios = unpack_fill_ratios(blob)
+        if fill_ratios.shape != expected_shape:
+            skipped += 1
+            continue
+        ids.append(submission_id)
+        matrices.append(fill_ratios)
+
+    skipped += Submission.objects.filter(test=test, fill_ratios__isnull=True).count()
+    if not ids:
+        return {'regraded': 0, 'skipped': skipped}
+
+    marks = np.stack(matrices) > darkness_threshold
+    grading = grade_masks(get_answer_key(test).scoring, marks_to_masks(marks))
+
+    updates = [
+        Submission(
+            id=submission_id,
+            answers=marks_to_answers(sheet_marks),
+            score=score,
+            total_questions=grading['total'],
+            percentage=percentage,
+            answer_key_version=test.answer_key_version,
+        )
+        for submission_id, sheet_marks, score, percentage in zip(
+            ids, marks, grading['score'].tolist(), grading['percentage'].tolist()
+        )
+    ]
+
+    with transaction.atomic():
+        change_seq = next_change(test.id)
+        for submission in updates:
+            submission.change_seq = change_seq
+        Submission.objects.bulk_update(
+            updates,
+            ['answers', 'score', 'total_questions', 'percentage', 'answer_key_version', 'change_seq'],
+            batch_size=REGRADE_BATCH_SIZE,
+        )
+        rebuild_test_stats(test.id)
+    return {'regraded': len(updates), 'skipped': skipped}
+
+
+def _normalize_answer_key(test, correct_answers, grading_modes):
+    """Validate a submitted answer key against the test and return it as lists of option lists."""
+    if len(correct_answers) != len(test.questions):
+        raise ValueError(f'Expected {len(test.questions)} correct answers, got {len(correct_answers)}')
+    if grading_modes is None:
+        grading_modes = [q.get('grading_mode', 'all_or_nothing') for q in test.questions]
+    if len(grading_modes) != len(test.questions):
+        raise ValueError(f'Expected {len(test.questions)} grading modes, got {len(grading_modes)}')
+
+    normalized = []
+    for number, answer in enumerate(correct_answers, start=1):
+        options = answer if isinstance(answer, list) else [answer]
+        if not options or not all(
+            isinstance(option, int) and not isinstance(option, bool) and 0 <= option < test.num_options
+            for option in options
+        ):
+            raise ValueError(f'Question {number}: correct answer must be option indices 0-{test.num_options - 1}')
+        normalized.append(sorted(set(options)))
+
+    for number, mode in enumerate(grading_modes, start=1):
+        if mode not in GRADING_MODES:
+            raise ValueError(f'Question {number}: unknown grading mode {mode!r}')
+
+    return normalized, list(grading_modes)
+
+
+def _store_key_on_entry(test_id, correct_answers, grading_modes):
+    """Write an edited key back into the generator's TestEntry, so pages and PDFs built from it agree."""
+    entry = TestEntry.objects.select_for_update().filter(id=test_id).first()
+    if entry is None:
+        return
+    payload = entry.payload or {}
+    questions = payload.get('questions') or []
+    if len(questions) != len(correct_answers):
+        return
+
+    payload['questions'] = [
+        dict(question, correct_answer=answer, grading_mode=mode) if isinstance(question, dict) else question
+        for question, answer, mode in zip(questions, correct_answers, grading_modes)
+    ]
+    entry.payload = payload
+    entry.save(update_fields=['payload'])
+
+
+def save_answer_key(test, correct_answers, grading_modes=None, progress=None):
+    """
+    Store a new answer key on a test and regrade all its submissions against it.
+
+    The key change and the regrade happen in one transaction, so a failure
+    part way leaves both the old key and the old scores in place. The key is
+    also written into the generator's TestEntry payload the test was created from.
+
+    Args:
+        test: test_grader Test instance
+        correct_answers: One int or list of option indices per question
+        grading_modes: One grading mode per question (default: keep the current ones)
+        progress: Optional callable(done, total) invoked after every chunk
+
+    Returns:
+        dict with 'answer_key_version' and 'regraded' count
+
+    Raises:
+        ValueError: If the key does not fit the test
+    """
+    correct_answers, grading_modes = _normalize_answer_key(test, correct_answers, grading_modes)
+
+    with transaction.atomic():
+        # Lock the row so two concurrent edits cannot both claim the next version
+        locked = Test.objects.select_for_update().get(pk=test.pk)
+        questions = [
+            dict(question, correct_answer=answer, grading_mode=mode)
+            for question, answer, mode in zip(locked.questions, correct_answers, grading_modes)
+        ]
+        if questions == locked.questions:
+            test.refresh_from_db()
+            return {'answer_key_version': locked.answer_key_version, 'regraded': 0}
+
+        locked.questions = questions
+        locked.answer_key_version += 1
+        locked.save(update_fields=['questions', 'answer_key_version', 'updated_at'])
+        _store_key_on_entry(locked.id, correct_answers, grading_modes)
+
+        regraded = regrade_stale_submissions(locked, progress=progress)
+
+    test.refresh_from_db()
+    return {'answer_key_version': locked.answer_key_version, 'regraded': regraded}
+
+
+def regrade_stale_submissions(test, stale_only=True, chunk_size=REGRADE_CHUNK_SIZE, progress=None):
+    """
+    Rescore stored answers against the test's current answer key.
+
+    Submissions are walked in id order one chunk at a time, so memory stays
+    bounded however many there are. Each chunk is scored in one vectorized
+    pass and written back with bulk_update, all inside a single transaction,
+    which also rebuilds the test's TestStats.
+
+    Args:
+        test: test_grader Test instance
+        stale_only: Only rescore submissions graded with an older key version
+        chunk_size: Submissions loaded and written per step
+        progress: Optional callable(done, total) invoked after every chunk
+
+    Returns:
+        Number of submissions regraded
+    """
+    submissions = Submission.objects.filter(test=test)
+    if stale_only:
+        submissions = submissions.exclude(answer_key_version=test.answer_key_version)
+
+    total = submissions.count()
+    if not total:
+        return 0
+
+    key = get_answer_key(test)
+
+    done = 0
+    last_id = 0
+    with transaction.atomic():
+        # Every regraded row carries one change number; taking it up front also holds back new
+        # submissions of the test until the regrade commits, so none commits under an older number
+        change_seq = next_change(test.id)
+        while True:
+            chunk = list(
+                submissions.filter(id__gt=last_id).order_by('id').values_list('id', 'answers')[:chunk_size]
+            )
+            if not chunk:
+                break
+
+            ids = [submission_id for submission_id, _ in chunk]
+            grading = key.grade_many([answers or [] for _, answers in chunk])
+
+            Submission.objects.bulk_update(
+                [
+                    Submission(
+                        id=submission_id,
+                        score=score,
+                        total_questions=grading['total'],
+                        percentage=percentage,
+                        answer_key_version=test.answer_key_version,
+                        change_seq=change_seq,
+                    )
+                    for submission_id, score, percentage in zip(
+                        ids, grading['score'].tolist(), grading['percentage'].tolist()
+                    )
+                ],
+                ['score', 'total_questions', 'percentage', 'answer_key_version', 'change_seq'],
+                batch_size=REGRADE_BATCH_SIZE,
+            )
+
+            done += len(ids)
+            last_id = ids[-1]
+            if progress is not None:
+                progress(done, total)
+
+        rebuild_test_stats(test.id)
+
+    return done
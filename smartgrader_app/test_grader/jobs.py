@@ -0,0 +1,404 @@
+"""
+Background grading jobs: uploads are stored, split into tasks and graded outside the request.
+
+Each GradingTask holds a few sheets. A runner (a thread of the web process, or
+any number of `manage.py omr_worker` processes on hosts sharing the database
+and media storage) claims one task at a time under a lease that a heartbeat
+thread keeps renewing. Tasks whose lease runs out, because their runner died
+or hung, go back to the queue and are retried up to OMR_TASK_MAX_ATTEMPTS times.
+"""
+import os
+import socket
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import GradingJob, GradingTask
+from .processing import (
+    IMAGE_EXTENSIONS,
+    check_zip_member_size,
+    detect_answers,
+    insert_submissions,
+    prepare_submissions,
+    read_zip_member,
+    release_submission_images,
+)
+
+# Storage directory uploads are kept in until their job finishes
+JOB_STORAGE_DIR = 'grading_jobs'
+
+# Pending tasks tried per claim attempt on databases without SKIP LOCKED
+CLAIM_CANDIDATES = 10
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.OMR_JOB_THREADS),
+                thread_name_prefix='grading-job',
+            )
+        return _executor
+
+
+def worker_identity():
+    """Return a name for this runner that is unique across hosts and processes."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _zip_members(zip_ref):
+    """The image members of a zip; raises ZipMemberTooLarge if one declares more than the allowed size."""
+    members = [
+        info
+        for info in zip_ref.infolist()
+        if not info.is_dir() and Path(info.filename).name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    for info in members:
+        check_zip_member_size(info)
+    return members
+
+
+def _zip_sheets(zip_file, path):
+    with zipfile.ZipFile(zip_file) as zip_ref:
+        return [
+            {'path': path, 'name': Path(info.filename).name, 'member': info.filename}
+            for info in _zip_members(zip_ref)
+        ]
+
+
+def create_job(test, user, uploaded_files=(), zip_file=None, dedupe=False):
+    """
+    Store an upload and queue its sheets for grading, OMR_TASK_SHEETS per task.
+
+    Raises:
+        zipfile.BadZipFile: If zip_file is not a readable zip archive
+        ZipMemberTooLarge: If an image in zip_file declares more than OMR_ZIP_MEMBER_MAX_BYTES
+    """
+    if zip_file is not None:
+        # Fail on a broken archive or an oversized image before anything is stored
+        with zipfile.ZipFile(zip_file) as zip_ref:
+            _zip_members(zip_ref)
+        zip_file.seek(0)
+
+    job = GradingJob.objects.create(test=test, created_by=user, dedupe=dedupe)
+
+    sources = []
+    sheets = []
+    if zip_file is not None:
+        path = default_storage.save(f"{JOB_STORAGE_DIR}/{job.id}/{Path(zip_file.name).name}", zip_file)
+        sources.append(path)
+        with default_storage.open(path, 'rb') as stored:
+            sheets.extend(_zip_sheets(stored, path))
+    for index, uploaded_file in enumerate(uploaded_files):
+        name = Path(uploaded_file.name).name
+        path = default_storage.save(f"{JOB_STORAGE_DIR}/{job.id}/{index}_{name}", uploaded_file)
+        sources.append(path)
+        sheets.append({'path': path, 'name': name, 'member': None})
+
+    size = max(1, settings.OMR_TASK_SHEETS)
+    tasks = [
+        GradingTask(job=job, sequence=sequence, sheets=sheets[start:start + size])
+        for sequence, start in enumerate(range(0, len(sheets), size))
+    ]
+    GradingTask.objects.bulk_create(tasks)
+
+    job.sources = sources
+    job.total = len(sheets)
+    job.task_count = len(tasks)
+    update_fields = ['sources', 'total', 'task_count']
+    if not tasks:
+        # A zip without images: nothing to grade
+        job.status = GradingJob.STATUS_DONE
+        job.finished_at = timezone.now()
+        update_fields += ['status', 'finished_at']
+        transaction.on_commit(lambda: _delete_sources(sources))
+    job.save(update_fields=update_fields)
+
+    if tasks and settings.OMR_JOB_RUNNER == 'thread':
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread))
+    return job
+
+
+def _lease_expiry():
+    return timezone.now() + timedelta(seconds=settings.OMR_TASK_LEASE_SECONDS)
+
+
+def _lease_update(worker_id):
+    return {
+        'status': GradingTask.STATUS_RUNNING,
+        'worker': worker_id,
+        'lease_expires_at': _lease_expiry(),
+        'attempts': F('attempts') + 1,
+    }
+
+
+def claim_task(worker_id):
+    """
+    Lease the oldest pending task to worker_id and return it, or None when the queue is empty.
+
+    On PostgreSQL the task row is locked with SELECT ... FOR UPDATE SKIP LOCKED, so
+    concurrent workers each get a different task without waiting on one another.
+    SQLite has no row locks; there a conditional update claims the task, and only
+    one of several racing workers sees it succeed.
+    """
+    requeue_expired_tasks()
+
+    # Every upload's first task before any upload's second, so a large upload doesn't hold back the others
+    pending = GradingTask.objects.filter(status=GradingTask.STATUS_PENDING).order_by('sequence', 'id')
+    task_id = None
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            locked = list(pending.select_for_update(skip_locked=True).values_list('id', flat=True)[:1])
+            if locked:
+                task_id = locked[0]
+                GradingTask.objects.filter(id=task_id).update(**_lease_update(worker_id))
+    else:
+        for candidate in pending.values_list('id', flat=True)[:CLAIM_CANDIDATES]:
+            claimed = GradingTask.objects.filter(id=candidate, status=GradingTask.STATUS_PENDING).update(
+                **_lease_update(worker_id)
+            )
+            if claimed:
+                task_id = candidate
+                break
+
+    if task_id is None:
+        return None
+
+    task = GradingTask.objects.select_related('job__test').get(id=task_id)
+    GradingJob.objects.filter(id=task.job_id, status=GradingJob.STATUS_PENDING).update(
+        status=GradingJob.STATUS_RUNNING,
+        started_at=timezone.now(),
+    )
+    return task
+
+
+def requeue_expired_tasks():
+    """
+    Put running tasks whose lease has run out back in the queue.
+
+    Tasks that already used up OMR_TASK_MAX_ATTEMPTS are failed instead. On
+    PostgreSQL the expired rows are taken with SKIP LOCKED, so a task another
+    runner still holds locked while it saves its results is left alone instead
+    of stalling every claim behind that runner's commit. Returns the number of
+    tasks requeued.
+    """
+    expired = GradingTask.objects.filter(status=GradingTask.STATUS_RUNNING, lease_expires_at__lt=timezone.now())
+
+    with transaction.atomic():
+        candidates = expired
+        if connection.features.has_select_for_update_skip_locked:
+            candidates = expired.select_for_update(skip_locked=True)
+        retry = []
+        exhausted = []
+        for task_id, attempts in candidates.values_list('id', 'attempts'):
+            (exhausted if attempts >= settings.OMR_TASK_MAX_ATTEMPTS else retry).append(task_id)
+
+        # Filtering on `expired` again skips tasks that finished since, on databases without row locks
+        for task in expired.filter(id__in=exhausted):
+            _fail_task(task, 'Grading did not finish before its lease expired')
+        if not retry:
+            return 0
+        return expired.filter(id__in=retry).update(status=GradingTask.STATUS_PENDING, worker='', lease_expires_at=None)
+
+
+class _LeaseHeartbeat(threading.Thread):
+    """Extends a task's lease every third of OMR_TASK_LEASE_SECONDS until stopped."""
+
+    def __init__(self, task_id, worker_id):
+        super().__init__(name=f'grading-task-{task_id}-heartbeat', daemon=True)
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self._stopped = threading.Event()
+
+    def run(self):
+        interval = max(1.0, settings.OMR_TASK_LEASE_SECONDS / 3)
+        try:
+            while not self._stopped.wait(interval):
+                try:
+                    GradingTask.objects.filter(
+                        id=self.task_id, worker=self.worker_id, status=GradingTask.STATUS_RUNNING
+                    ).update(lease_expires_at=_lease_expiry())
+                except DatabaseError:
+                    # e.g. SQLite busy while the grading thread writes; the next beat catches up
+                    pass
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def _read_sheets(sheets):
+    """Return (image_bytes, filename) for each sheet, opening every stored zip once."""
+    images = []
+    with ExitStack() as stack:
+        archives = {}
+        for sheet in sheets:
+            if sheet['member'] is None:
+                with default_storage.open(sheet['path'], 'rb') as image_file:
+                    images.append((image_file.read(), sheet['name']))
+                continue
+
+            archive = archives.get(sheet['path'])
+            if archive is None:
+                stored = stack.enter_context(default_storage.open(sheet['path'], 'rb'))
+                archive = archives[sheet['path']] = stack.enter_context(zipfile.ZipFile(stored))
+            images.append((read_zip_member(archive, sheet['member']), sheet['name']))
+    return images
+
+
+def _locked_lease(task_id, worker_id):
+    """Lock and return the task if worker_id still holds its lease, else None."""
+    return (
+        GradingTask.objects
+        .select_for_update()
+        .filter(id=task_id, worker=worker_id, status=GradingTask.STATUS_RUNNING)
+        .first()
+    )
+
+
+def run_task(task, worker_id, max_workers=None):
+    """
+    Grade a task leased to worker_id and record its results on the task and its job.
+
+    The OMR runs outside any transaction; the submissions are only written if the
+    lease is still held, so a task taken over after an expired lease is never
+    stored twice. The sheet images are saved before that check and released
+    again if no row is kept, so a lost lease or a rollback never leaves image
+    files in storage that nothing refers to. max_workers gives the OMR a pool of
+    that size for uploads only (see processing.detect_answers). Returns the
+    task's results, or None if the lease was lost.
+    """
+    heartbeat = _LeaseHeartbeat(task.id, worker_id)
+    heartbeat.start()
+    try:
+        test = task.job.test
+        images = _read_sheets(task.sheets)
+        detected = detect_answers(test, images, max_workers=max_workers)
+        # Storage writes commit their image references here, outside the transaction below
+        prepared = prepare_submissions(test, images, detected, task.job.dedupe)
+
+        committed = False
+        try:
+            with transaction.atomic():
+                leased = _locked_lease(task.id, worker_id)
+                if leased is None:
+                    return None
+                results = insert_submissions(prepared)
+                _finish_task(leased, GradingTask.STATUS_DONE, results)
+            committed = True
+        finally:
+            if not committed:
+                release_submission_images(prepared)
+        return results
+    except Exception as exc:
+        _release_failed_task(task.id, worker_id, f"Error processing upload: {exc}")
+        return None
+    finally:
+        heartbeat.stop()
+
+
+def _release_failed_task(task_id, worker_id, error):
+    """Requeue a task whose run raised, or fail it once it has used up its attempts."""
+    with transaction.atomic():
+        task = _locked_lease(task_id, worker_id)
+        if task is None:
+            return
+        if task.attempts >= settings.OMR_TASK_MAX_ATTEMPTS:
+            _fail_task(task, error)
+        else:
+            task.status = GradingTask.STATUS_PENDING
+            task.worker = ''
+            task.lease_expires_at = None
+            task.error = error
+            task.save(update_fields=['status', 'worker', 'lease_expires_at', 'error'])
+
+
+def _fail_task(task, error):
+    results = [{'filename': sheet['name'], 'success': False, 'error': error} for sheet in task.sheets]
+    _finish_task(task, GradingTask.STATUS_FAILED, results, error)
+
+
+def _finish_task(task, status, results, error=''):
+    """Store a task's outcome and add it to its job, finishing the job with its last task. Call inside atomic()."""
+    job = GradingJob.objects.select_for_update().get(id=task.job_id)
+    succeeded = sum(1 for result in results if result.get('success'))
+    job.done += succeeded
+    job.failed += len(results) - succeeded
+    job.finished_tasks += 1
+    update_fields = ['done', 'failed', 'finished_tasks']
+    if error:
+        job.errors.append(error)
+        update_fields.append('errors')
+
+    if job.finished_tasks >= job.task_count:
+        # Failed only when tasks errored out and nothing at all was graded
+        job.status = GradingJob.STATUS_FAILED if job.errors and not job.done else GradingJob.STATUS_DONE
+        job.finished_at = timezone.now()
+        update_fields += ['status', 'finished_at']
+        sources = list(job.sources)
+        transaction.on_commit(lambda: _delete_sources(sources))
+    job.save(update_fields=update_fields)
+
+    task.status = status
+    task.results = results
+    task.error = error
+    task.completion_order = job.finished_tasks
+    task.results_end = job.done + job.failed
+    task.lease_expires_at = None
+    task.finished_at = timezone.now()
+    task.save(update_fields=[
+        'status', 'results', 'error', 'completion_order', 'results_end', 'lease_expires_at', 'finished_at'
+    ])
+
+
+def job_results(job, offset=0):
+    """
+    Return a job's results from index `offset` on, in the order its tasks finished.
+
+    Only the tasks holding results past `offset` are read, so a progress poll
+    costs the same however many sheets the job already reported.
+    """
+    finished = (
+        job.tasks
+        .filter(completion_order__isnull=False, results_end__gt=offset)
+        .order_by('completion_order')
+        .values_list('results_end', 'results')
+    )
+    results = []
+    for results_end, task_results in finished:
+        start = results_end - len(task_results)
+        results.extend(task_results[max(0, offset - start):])
+    return results
+
+
+def _delete_sources(paths):
+    for path in paths:
+        default_storage.delete(path)
+
+
+def _run_in_thread():
+    """Drain the task queue from an executor thread of the web process."""
+    worker_id = worker_identity()
+    try:
+        while (task := claim_task(worker_id)) is not None:
+            run_task(task, worker_id)
+    finally:
+        # Each executor thread gets its own connection; don't leave it open between jobs
+        connection.close()
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from test_grader.models import ImageBlob, Submission
+from test_grader.storage import BLOB_DIR, submission_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Move submission images saved before the content-addressed image storage into it, so identical "
+        "images are kept once and re-encoded at SUBMISSION_IMAGE_JPEG_QUALITY."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Submissions loaded per query (default: 200)",
+        )
+
+    def handle(self, *args, **options):
+        storage = submission_storage()
+        legacy = (
+            Submission.objects
+            .exclude(image="")
+            .exclude(image__startswith=f"{BLOB_DIR}/")
+            .only("id", "image")
+            .order_by("id")
+        )
+
+        started = time.perf_counter()
+        moved = missing = 0
+        legacy_bytes = 0
+        for submission in legacy.iterator(chunk_size=options["batch_size"]):
+            old_name = submission.image.name
+            if not storage.exists(old_name):
+                missing += 1
+                continue
+
+            legacy_bytes += storage.size(old_name)
+            with storage.open(old_name, "rb") as image_file:
+                new_name = storage.save(old_name, image_file)
+            Submission.objects.filter(id=submission.id).update(image=new_name)
+            storage.delete(old_name)
+            moved += 1
+
+        elapsed = time.perf_counter() - started
+        stored = ImageBlob.objects.aggregate(total=Sum("size_bytes"))["total"] or 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {moved} image(s) ({legacy_bytes / 1e6:.1f} MB) in {elapsed:.1f} s, {missing} missing; "
+            f"the image store now holds {stored / 1e6:.1f} MB"
+        ))
@@ -0,0 +1,39 @@
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Where generated test PDFs and their JSON were written before GENERATED_TESTS_ROOT, inside STATICFILES_DIRS
+LEGACY_DIR = Path(settings.BASE_DIR) / "static" / "generated"
+
+
+class Command(BaseCommand):
+    help = (
+        "Move test PDFs and answer JSON generated into static/generated/, where staticfiles and "
+        "collectstatic publish them, to GENERATED_TESTS_ROOT behind the access-checked view."
+    )
+
+    def handle(self, *args, **options):
+        if not LEGACY_DIR.is_dir():
+            self.stdout.write("Nothing to move: static/generated/ does not exist")
+            return
+
+        target = Path(settings.GENERATED_TESTS_ROOT)
+        target.mkdir(parents=True, exist_ok=True)
+        moved = 0
+        for path in sorted(LEGACY_DIR.glob("test_*")):
+            if path.suffix not in (".pdf", ".json"):
+                continue
+            destination = target / path.name
+            if destination.exists():
+                # Regenerated since the move to GENERATED_TESTS_ROOT; the old copy only leaks answers
+                path.unlink()
+            else:
+                shutil.move(str(path), str(destination))
+                moved += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} generated test file(s) to {target}"))
+        self.stdout.write(
+            "Run collectstatic --clear if static/generated/ was collected before, to remove the published copies."
+        )
@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from test_grader.jobs import claim_task, run_task, worker_identity
+from test_grader.processing import worker_pool_size
+
+
+class Command(BaseCommand):
+    help = (
+        "Grade queued upload tasks. Run any number of these, on any host that shares the database and media "
+        "storage, with OMR_JOB_RUNNER=worker; each task is leased to one worker at a time, and tasks of a worker "
+        "that stops heartbeating are requeued."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--poll",
+            type=float,
+            default=2.0,
+            help="Seconds to wait before checking again when the queue is empty (default: 2)",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=0,
+            help=(
+                "OMR processes this worker grades with (default: OMR_WORKERS - 1, so the web process on the "
+                "same host keeps a core for students' sheets)"
+            ),
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty instead of waiting for new tasks",
+        )
+
+    def handle(self, *args, **options):
+        worker_id = worker_identity()
+        processes = options["processes"] or worker_pool_size()
+        self.stdout.write(f"Worker {worker_id} started with {processes} OMR processes")
+
+        while True:
+            task = claim_task(worker_id)
+            if task is None:
+                if options["once"]:
+                    return
+                time.sleep(options["poll"])
+                continue
+
+            started = time.perf_counter()
+            results = run_task(task, worker_id, max_workers=processes)
+            elapsed = time.perf_counter() - started
+            if results is None:
+                self.stdout.write(f"Job {task.job_id} task {task.sequence}: not completed, released after {elapsed:.1f} s")
+                continue
+
+            graded = sum(1 for result in results if result.get("success"))
+            self.stdout.write(
+                f"Job {task.job_id} task {task.sequence}: {graded} graded, {len(results) - graded} failed "
+                f"in {elapsed:.1f} s"
+            )
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from test_grader.models import Test
+from test_grader.stats import rebuild_test_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the TestStats rollup of the given tests (default: every test) from their submissions. "
+        "Each test is rebuilt in its own transaction with its stats row locked, so grading can keep running."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("test_ids", nargs="*", type=int)
+
+    def handle(self, *args, **options):
+        test_ids = options["test_ids"]
+        if test_ids:
+            missing = set(test_ids) - set(Test.objects.filter(id__in=test_ids).values_list("id", flat=True))
+            if missing:
+                raise CommandError(f"Test(s) {', '.join(map(str, sorted(missing)))} do not exist")
+        else:
+            test_ids = list(Test.objects.order_by("id").values_list("id", flat=True))
+
+        started = time.perf_counter()
+        submissions = 0
+        for test_id in test_ids:
+            submissions += rebuild_test_stats(test_id).submission_count
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt stats for {len(test_ids)} test(s) covering {submissions} submission(s) in {elapsed * 1000:.0f} ms"
+        ))
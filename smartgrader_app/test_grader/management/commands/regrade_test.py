@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from test_grader.grading import regrade_stale_submissions, regrade_test
+from test_grader.models import Test
+
+
+class Command(BaseCommand):
+    help = (
+        "Regrade all submissions of a test from their stored fill ratios, without reprocessing images. "
+        "With --answers, rescore the stored answers against the current answer key instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("test_id", type=int)
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.6,
+            help="Fraction of a bubble that must be filled to count as marked (default: 0.6)",
+        )
+        parser.add_argument(
+            "--answers",
+            action="store_true",
+            help="Keep the detected answers and only recompute scores against the current answer key",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            test = Test.objects.get(id=options["test_id"])
+        except Test.DoesNotExist:
+            raise CommandError(f"Test {options['test_id']} does not exist")
+
+        started = time.perf_counter()
+        if options["answers"]:
+            regraded = regrade_stale_submissions(test, stale_only=False, progress=self._report_progress)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f"Rescored {regraded} submission(s) of '{test.title}' against answer key "
+                f"v{test.answer_key_version} in {elapsed * 1000:.0f} ms"
+            ))
+            return
+
+        result = regrade_test(test, darkness_threshold=options["threshold"])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Regraded {result['regraded']} submission(s) of '{test.title}' in {elapsed * 1000:.0f} ms "
+            f"({result['skipped']} skipped)"
+        ))
+
+    def _report_progress(self, done, total):
+        self.stdout.write(f"  {done}/{total} submissions")
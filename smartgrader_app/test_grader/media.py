@@ -0,0 +1,144 @@
+"""Delivery of access-checked files (submission images, test PDFs) after the view has authorized the request."""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+# Values of PROTECTED_MEDIA_SERVER
+SERVER_DJANGO = ''
+SERVER_NGINX = 'x-accel-redirect'
+SERVER_SENDFILE = 'x-sendfile'
+
+# How long browsers may reuse a file without asking again; submission images never change
+MAX_AGE_SECONDS = 24 * 60 * 60
+
+RANGE_CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _byte_range(header, size):
+    """
+    Return the (start, end) of a single-range Range header, end inclusive.
+
+    Returns None when the header should be ignored and the whole file sent
+    (missing, malformed or multiple ranges), and raises ValueError when the
+    range lies outside the file.
+    """
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('Empty suffix range')
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def _content_type(path):
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def _accelerated_response(server, path, location, name):
+    """Empty response telling the front-end server which file to send in its place."""
+    response = HttpResponse(content_type=_content_type(path))
+    if server == SERVER_NGINX:
+        prefix = settings.PROTECTED_MEDIA_ACCEL_PREFIX.rstrip('/')
+        response['X-Accel-Redirect'] = f"{prefix}/{location}/{quote(name)}"
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def send_protected_file(request, path, location, name, filename=None):
+    """
+    Answer an authorized request for a file under a protected location.
+
+    With PROTECTED_MEDIA_SERVER set, the transfer is handed to the front-end
+    server: nginx gets an X-Accel-Redirect to <PROTECTED_MEDIA_ACCEL_PREFIX>
+    <location>/<name>, Apache and lighttpd an X-Sendfile with the file's path,
+    and they handle Range and conditional requests themselves. Otherwise the
+    file is streamed from Django, honouring If-Modified-Since and single byte
+    ranges.
+
+    Args:
+        request: The request, already checked for access to the file
+        path: Absolute path of the file on disk
+        location: Name of the protected location, mapped to a directory by the front-end server ('media', 'pdf')
+        name: Path of the file relative to that location
+        filename: Name to offer the file as, if it should be downloadable under another name
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise Http404('File not found')
+
+    server = settings.PROTECTED_MEDIA_SERVER.lower()
+    if server in (SERVER_NGINX, SERVER_SENDFILE):
+        response = _accelerated_response(server, path, location, name)
+    else:
+        response = _file_response(request, path, stat)
+
+    if filename:
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+    # Private, since each file is only served to the users allowed to see it
+    response['Cache-Control'] = f'private, max-age={MAX_AGE_SECONDS}'
+    return response
+
+
+def _file_response(request, path, stat):
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    content_type = _content_type(path)
+    last_modified = http_date(stat.st_mtime)
+    range_header = request.META.get('HTTP_RANGE')
+    if request.META.get('HTTP_IF_RANGE', last_modified) != last_modified:
+        # The client's partial copy is of an older version of the file
+        range_header = None
+    try:
+        byte_range = _byte_range(range_header, stat.st_size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(_read_range(path, start, length), status=206, content_type=content_type)
+        response['Content-Length'] = str(length)
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = last_modified
+    return response
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_grader', '0004_test_allow_multiple_submissions_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='test',
+            name='sheet_geometry',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
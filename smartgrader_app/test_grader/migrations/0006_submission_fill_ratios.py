@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_grader', '0005_test_sheet_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='fill_ratios',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
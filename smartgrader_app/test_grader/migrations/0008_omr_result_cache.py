@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_grader', '0007_answer_key_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='image_sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.CreateModel(
+            name='OMRResultCache',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('image_sha256', models.CharField(db_index=True, max_length=64)),
+                ('answers', models.JSONField()),
+                ('fill_ratios', models.BinaryField()),
+                ('size_bytes', models.PositiveIntegerField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_grader', '0009_grading_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gradingtask',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='gradingtask',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gradingtask',
+            name='worker',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='gradingtask',
+            index=models.Index(fields=['status', 'id'], name='grading_task_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gradingtask',
+            index=models.Index(fields=['status', 'lease_expires_at'], name='grading_task_lease_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_grader', '0010_grading_task_leases'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='gradingtask',
+            name='grading_task_queue_idx',
+        ),
+        migrations.AddIndex(
+            model_name='gradingtask',
+            index=models.Index(fields=['status', 'sequence', 'id'], name='grading_task_queue_idx'),
+        ),
+    ]
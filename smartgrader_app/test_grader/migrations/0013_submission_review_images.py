@@ -0,0 +1,22 @@
+import test_grader.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_grader', '0012_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='thumbnail',
+            field=models.ImageField(blank=True, storage=test_grader.storage.submission_storage, upload_to='submissions/'),
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='warped_image',
+            field=models.ImageField(blank=True, storage=test_grader.storage.submission_storage, upload_to='submissions/'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Max, Min, Q, Sum
+
+GRADE_BOUNDARIES = (('A', 90), ('B', 80), ('C', 70), ('D', 60), ('F', None))
+
+
+def build_test_stats(apps, schema_editor):
+    """Roll up the submissions that already exist; test_grader.stats keeps the rows current from here on."""
+    Submission = apps.get_model('test_grader', 'Submission')
+    TestStats = apps.get_model('test_grader', 'TestStats')
+
+    grade_filters = {}
+    upper = None
+    for letter, bound in GRADE_BOUNDARIES:
+        condition = Q()
+        if bound is not None:
+            condition &= Q(percentage__gte=bound)
+        if upper is not None:
+            condition &= Q(percentage__lt=upper)
+        grade_filters[f'grade_{letter}'] = Count('id', filter=condition)
+        upper = bound
+
+    rows = (
+        Submission.objects.filter(processed=True)
+        .order_by()
+        .values('test_id')
+        .annotate(
+            submission_count=Count('id'),
+            score_sum=Sum('score'),
+            percentage_sum=Sum('percentage'),
+            percentage_sum_squares=Sum(F('percentage') * F('percentage')),
+            min_score=Min('score'),
+            max_score=Max('score'),
+            min_percentage=Min('percentage'),
+            max_percentage=Max('percentage'),
+            pass_count=Count('id', filter=Q(percentage__gte=60)),
+            **grade_filters,
+        )
+    )
+    for row in rows:
+        latest = (
+            Submission.objects.filter(test_id=row['test_id'], processed=True)
+            .order_by('-submitted_at', '-id')
+            .values_list('id', flat=True)
+            .first()
+        )
+        grade_counts = {letter: row.pop(f'grade_{letter}') for letter, _ in GRADE_BOUNDARIES}
+        TestStats.objects.create(grade_counts=grade_counts, latest_submission_id=latest, **row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_grader', '0013_submission_review_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestStats',
+            fields=[
+                ('test', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='test_grader.test')),
+                ('submission_count', models.PositiveIntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0)),
+                ('percentage_sum', models.FloatField(default=0)),
+                ('percentage_sum_squares', models.FloatField(default=0)),
+                ('min_score', models.FloatField(blank=True, null=True)),
+                ('max_score', models.FloatField(blank=True, null=True)),
+                ('min_percentage', models.FloatField(blank=True, null=True)),
+                ('max_percentage', models.FloatField(blank=True, null=True)),
+                ('pass_count', models.PositiveIntegerField(default=0)),
+                ('grade_counts', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('latest_submission', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='test_grader.submission')),
+            ],
+            options={
+                'verbose_name_plural': 'test stats',
+            },
+        ),
+        migrations.RunPython(build_test_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('test_grader', '0014_test_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedSubmission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submission_id', models.BigIntegerField()),
+                ('change_seq', models.PositiveBigIntegerField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='teststats',
+            name='change_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['test', 'submitted_at', 'id'], name='submission_test_submitted'),
+        ),
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['test', 'change_seq', 'id'], name='submission_test_change'),
+        ),
+        migrations.AddField(
+            model_name='deletedsubmission',
+            name='test',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deleted_submissions', to='test_grader.test'),
+        ),
+        migrations.AddIndex(
+            model_name='deletedsubmission',
+            index=models.Index(fields=['test', 'change_seq'], name='deleted_submission_test_change'),
+        ),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
 from django.conf import settings
+from django.urls import reverse
+
+from .storage import submission_storage
 
 class Test(models.Model):
     """Persisted graded test definition with correct answers and metadata."""
@@ -11,6 +14,10 @@ class Test(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     num_questions = models.IntegerField()
     num_options = models.IntegerField(default=5)
+    # Bubble positions of the printed sheet (pdf_generator.layout.sheet_geometry)
+    sheet_geometry = models.JSONField(blank=True, null=True)
+    # Bumped every time the correct answers or grading modes change
+    answer_key_version = models.PositiveIntegerField(default=1)
 
     # Student access fields
     share_code = models.CharField(max_length=12, unique=True, blank=True, null=True, db_index=True)
@@ -30,17 +37,31 @@ class Submission(models.Model):
     student_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, related_name='submissions', blank=True, null=True)
     first_name = models.CharField(max_length=255, blank=True, null=True)
     last_name = models.CharField(max_length=255, blank=True, null=True)
-    image = models.ImageField(upload_to='submissions/')
+    image = models.ImageField(upload_to='submissions/', storage=submission_storage)
+    # Review images kept from grading: the warped answer box and a small preview of the photo
+    warped_image = models.ImageField(upload_to='submissions/', storage=submission_storage, blank=True)
+    thumbnail = models.ImageField(upload_to='submissions/', storage=submission_storage, blank=True)
+    image_sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)
     answers = models.JSONField()
+    # Per-bubble fill ratios the answers were thresholded from (grade_processor.omr_main.pack_fill_ratios)
+    fill_ratios = models.BinaryField(blank=True, null=True)
     score = models.FloatField()
     total_questions = models.IntegerField()
     percentage = models.FloatField()
+    # Test.answer_key_version the score was computed against
+    answer_key_version = models.PositiveIntegerField(default=1)
     submitted_at = models.DateTimeField(auto_now_add=True)
+    # The test's TestStats.change_seq when this row was last written, from stats.next_change()
+    change_seq = models.PositiveBigIntegerField(default=0)
     processed = models.BooleanField(default=False)
     error_message = models.TextField(blank=True, null=True)
     
     class Meta:
         ordering = ['-submitted_at']
+        indexes = [
+            models.Index(fields=['test', 'submitted_at', 'id'], name='submission_test_submitted'),
+            models.Index(fields=['test', 'change_seq', 'id'], name='submission_test_change'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['test', 'student_user'],
@@ -75,6 +96,225 @@ class Submission(models.Model):
             return 'D'
         else:
             return 'F'
+
+    @property
+    def review_image(self):
+        """The warped answer box, or the original photo for submissions graded without one."""
+        return self.warped_image or self.image
+
+    @property
+    def preview_image(self):
+        """The thumbnail, or the original photo for submissions graded without one."""
+        return self.thumbnail or self.image
+
+    def image_for(self, kind):
+        """Return the 'original', 'review' or 'preview' image file, empty if the submission has none."""
+        return {'original': self.image, 'review': self.review_image, 'preview': self.preview_image}[kind]
+
+    def image_url(self, kind):
+        """URL of the access-checked view serving one of the submission's images, or None."""
+        if not self.image_for(kind):
+            return None
+        return reverse('submission-image', args=[self.id, kind])
+
+    @property
+    def original_image_url(self):
+        return self.image_url('original')
+
+    @property
+    def review_image_url(self):
+        return self.image_url('review')
+
+    @property
+    def preview_image_url(self):
+        return self.image_url('preview')
     
     def __str__(self):
         return f"{self.full_name} - {self.test.title} - {self.score}/{self.total_questions}"
+
+
+class TestStats(models.Model):
+    """
+    Running totals over a test's processed submissions, kept up to date by test_grader.stats.
+
+    Holds sums rather than averages so submissions can be added and removed
+    without reading the others; rebuild_test_stats recomputes it from scratch.
+    """
+    # Percentage a submission needs to pass
+    PASS_PERCENTAGE = 60
+    # Lowest percentage for each letter grade, as in Submission.grade
+    GRADE_BOUNDARIES = (('A', 90), ('B', 80), ('C', 70), ('D', 60), ('F', None))
+
+    test = models.OneToOneField(Test, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    submission_count = models.PositiveIntegerField(default=0)
+    score_sum = models.FloatField(default=0)
+    percentage_sum = models.FloatField(default=0)
+    percentage_sum_squares = models.FloatField(default=0)
+    min_score = models.FloatField(blank=True, null=True)
+    max_score = models.FloatField(blank=True, null=True)
+    min_percentage = models.FloatField(blank=True, null=True)
+    max_percentage = models.FloatField(blank=True, null=True)
+    pass_count = models.PositiveIntegerField(default=0)
+    # Submissions per letter grade, e.g. {'A': 3, 'B': 5, ...}
+    grade_counts = models.JSONField(default=dict)
+    latest_submission = models.ForeignKey(
+        Submission, on_delete=models.SET_NULL, related_name='+', blank=True, null=True
+    )
+    # Last change number handed out to the test's submissions; only raised under this row's lock
+    change_seq = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'test stats'
+
+    @classmethod
+    def grade_for(cls, percentage):
+        return next(letter for letter, bound in cls.GRADE_BOUNDARIES if bound is None or percentage >= bound)
+
+    @property
+    def average_score(self):
+        return self.score_sum / self.submission_count if self.submission_count else 0
+
+    @property
+    def average_percentage(self):
+        return self.percentage_sum / self.submission_count if self.submission_count else 0
+
+    @property
+    def stddev_percentage(self):
+        if not self.submission_count:
+            return 0
+        variance = self.percentage_sum_squares / self.submission_count - self.average_percentage ** 2
+        return max(0.0, variance) ** 0.5
+
+    @property
+    def pass_rate(self):
+        return self.pass_count / self.submission_count * 100 if self.submission_count else 0
+
+    @property
+    def grade_histogram(self):
+        return {letter: self.grade_counts.get(letter, 0) for letter, _ in self.GRADE_BOUNDARIES}
+
+    def __str__(self):
+        return f"Stats for test {self.test_id} ({self.submission_count} submissions)"
+
+
+class DeletedSubmission(models.Model):
+    """A tombstone for a deleted submission, so clients syncing a test's list can drop the row."""
+    test = models.ForeignKey(Test, on_delete=models.CASCADE, related_name='deleted_submissions')
+    submission_id = models.BigIntegerField()
+    # TestStats.change_seq of the deletion
+    change_seq = models.PositiveBigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['test', 'change_seq'], name='deleted_submission_test_change'),
+        ]
+
+    def __str__(self):
+        return f"Submission {self.submission_id} of test {self.test_id} (deleted)"
+
+
+class OMRResultCache(models.Model):
+    """OMR output for an image, keyed by the image's SHA-256 and the parameters it was read with."""
+    key = models.CharField(max_length=64, primary_key=True)
+    image_sha256 = models.CharField(max_length=64, db_index=True)
+    answers = models.JSONField()
+    fill_ratios = models.BinaryField()
+    size_bytes = models.PositiveIntegerField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.image_sha256[:12]} ({self.size_bytes} bytes)"
+
+
+class ImageBlob(models.Model):
+    """A sheet image kept once by ContentAddressedImageStorage, with the number of submissions using it."""
+    # SHA-256 of the uploaded bytes
+    key = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255, unique=True)
+    size_bytes = models.PositiveIntegerField()
+    refcount = models.PositiveIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount} references)"
+
+
+class GradingJob(models.Model):
+    """An uploaded batch of sheets graded in the background; polled for progress by the uploader."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    test = models.ForeignKey(Test, on_delete=models.CASCADE, related_name='grading_jobs')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='grading_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    dedupe = models.BooleanField(default=False)
+    # Storage paths of the uploaded files, deleted once every task has finished
+    sources = models.JSONField(default=list)
+    total = models.PositiveIntegerField(default=0)
+    done = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # The job is finished once all of its GradingTasks are
+    task_count = models.PositiveIntegerField(default=0)
+    finished_tasks = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    def __str__(self):
+        return f"Job {self.id} for {self.test.title} ({self.status}, {self.done + self.failed}/{self.total})"
+
+
+class GradingTask(models.Model):
+    """A few sheets of a GradingJob, claimed and graded by one worker under a renewable lease."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = GradingJob.STATUS_CHOICES
+
+    job = models.ForeignKey(GradingJob, on_delete=models.CASCADE, related_name='tasks')
+    # Position of the task's sheets within the upload
+    sequence = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # Sheets to grade: [{'path': storage path, 'name': filename, 'member': zip member name or None}]
+    sheets = models.JSONField()
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True, default='')
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    # Order the task finished in within its job; results are served in this order
+    completion_order = models.PositiveIntegerField(blank=True, null=True)
+    results = models.JSONField(default=list)
+    # Number of job results up to and including this task's, so progress polls only read new ones
+    results_end = models.PositiveIntegerField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['job', 'sequence']
+        indexes = [
+            models.Index(fields=['status', 'sequence', 'id'], name='grading_task_queue_idx'),
+            models.Index(fields=['status', 'lease_expires_at'], name='grading_task_lease_idx'),
+        ]
+
+    def __str__(self):
+        return f"Task {self.sequence} of job {self.job_id} ({self.status})"
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.append(str(PROJECT_ROOT))
+
+from grade_processor.omr_main import OMR_ENGINE_VERSION, pack_fill_ratios, unpack_fill_ratios  # noqa: E402
+
+from .models import OMRResultCache
+
+# Bytes accounted per cache row on top of its answers and fill ratios (keys, timestamps, row header)
+ROW_OVERHEAD_BYTES = 256
+
+# Fraction of OMR_RESULT_CACHE_MAX_BYTES kept after an eviction pass, so inserts don't evict every time
+EVICT_TO_FRACTION = 0.9
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def image_digest(image):
+    """Return the hex SHA-256 of an image given as bytes or a file path."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(image).hexdigest()
+
+    digest = hashlib.sha256()
+    with open(image, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def omr_params(num_questions, num_options, darkness_threshold, geometry):
+    """Return the OMR parameters that, with the image bytes, determine a result."""
+    return {
+        'num_questions': num_questions,
+        'num_options': num_options,
+        'darkness_threshold': darkness_threshold,
+        'engine': OMR_ENGINE_VERSION,
+        'geometry': hashlib.sha256(json.dumps(geometry, sort_keys=True).encode()).hexdigest(),
+    }
+
+
+def cache_key(digest, params):
+    """Combine an image digest and OMR parameters into a cache key."""
+    return hashlib.sha256(f"{digest}:{json.dumps(params, sort_keys=True)}".encode()).hexdigest()
+
+
+def enabled():
+    """Return True when OMR results should be cached."""
+    return settings.OMR_RESULT_CACHE_MAX_BYTES > 0
+
+
+def lookup(keys):
+    """
+    Fetch cached OMR results for many keys in one query.
+
+    Returns:
+        dict mapping each cached key to a process_omr_image style result dict
+    """
+    if not enabled() or not keys:
+        return {}
+
+    rows = OMRResultCache.objects.filter(key__in=set(keys)).values_list('key', 'answers', 'fill_ratios')
+    found = {
+        key: {
+            'success': True,
+            'answers': answers,
+            'fill_ratios': unpack_fill_ratios(fill_ratios),
+            'error': None,
+            'cached': True,
+        }
+        for key, answers, fill_ratios in rows
+    }
+
+    if found:
+        OMRResultCache.objects.filter(key__in=found).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    return found
+
+
+def store(entries):
+    """
+    Cache successful OMR results and evict the least recently used rows past the size limit.
+
+    Args:
+        entries: Iterable of (key, image digest, result dict) tuples
+    """
+    if not enabled():
+        return
+
+    now = timezone.now()
+    rows = []
+    for key, digest, result in entries:
+        if not result.get('success') or result.get('fill_ratios') is None:
+            continue
+
+        fill_ratios = pack_fill_ratios(result['fill_ratios'])
+        size = len(fill_ratios) + len(json.dumps(result['answers'])) + ROW_OVERHEAD_BYTES
+        rows.append(OMRResultCache(
+            key=key,
+            image_sha256=digest,
+            answers=result['answers'],
+            fill_ratios=fill_ratios,
+            size_bytes=size,
+            last_used_at=now,
+        ))
+
+    if rows:
+        OMRResultCache.objects.bulk_create(rows, ignore_conflicts=True)
+        evict()
+
+
+def evict(max_bytes=None):
+    """Delete least recently used cache rows until the cache fits within max_bytes."""
+    max_bytes = settings.OMR_RESULT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    total = OMRResultCache.objects.aggregate(total=Sum('size_bytes'))['total'] or 0
+    if total <= max_bytes:
+        return 0
+
+    to_free = total - int(max_bytes * EVICT_TO_FRACTION)
+    doomed = []
+    for key, size in OMRResultCache.objects.order_by('last_used_at').values_list('key', 'size_bytes').iterator():
+        doomed.append(key)
+        to_free -= size
+        if to_free <= 0:
+            break
+
+    deleted, _ = OMRResultCache.objects.filter(key__in=doomed).delete()
+    return deleted
@@ -0,0 +1,64 @@
+"""Keyset (cursor) pagination over a queryset ordered by a timestamp or counter and id."""
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk):
+    """Return an opaque cursor pointing just past the row with this (timestamp or counter, id)."""
+    raw = json.dumps([value.isoformat() if hasattr(value, 'isoformat') else value, pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (timestamp or counter, id) an encode_cursor() cursor points at; raises InvalidCursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        value = parse_datetime(value) if isinstance(value, str) else int(value)
+        pk = int(pk)
+    except (TypeError, ValueError):
+        raise InvalidCursor('Invalid cursor')
+    if value is None:
+        raise InvalidCursor('Invalid cursor')
+    return value, pk
+
+
+def after_cursor(field, value, pk, descending=True):
+    """Q selecting the rows that come after (value, pk) in (field, id) order."""
+    if descending:
+        return Q(**{f'{field}__lt': value}) | Q(**{field: value, 'id__lt': pk})
+    return Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk})
+
+
+def parse_limit(value, default, maximum):
+    """Page size from a query string value, clamped to 1..maximum; raises ValueError if it isn't a number."""
+    if value in (None, ''):
+        return default
+    return max(1, min(int(value), maximum))
+
+
+def keyset_page(queryset, field, limit, cursor=None, descending=True):
+    """
+    Return (rows, next_cursor) for one page of queryset ordered by (field, id).
+
+    next_cursor is None on the last page. Raises InvalidCursor for a cursor
+    that wasn't produced by this module.
+    """
+    if cursor:
+        queryset = queryset.filter(after_cursor(field, *decode_cursor(cursor), descending=descending))
+    prefix = '-' if descending else ''
+    rows = list(queryset.order_by(f'{prefix}{field}', f'{prefix}id')[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.id)
+    return rows, next_cursor
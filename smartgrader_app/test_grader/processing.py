@@ -0,0 +1,427 @@
+"""Run the OMR over uploaded sheets and store the graded submissions."""
+import sys
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile, File
+from django.db import transaction
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.append(str(PROJECT_ROOT))
+
+from grade_processor import instrumentation  # noqa: E402
+from grade_processor.omr_batch import default_worker_count, process_omr_images  # noqa: E402
+from grade_processor.omr_main import pack_fill_ratios  # noqa: E402
+from grade_processor.scheduler import BULK, INTERACTIVE  # noqa: E402
+from pdf_generator.layout import sheet_geometry  # noqa: E402
+
+from . import omr_cache
+from .answer_keys import get_answer_key
+from .models import Submission
+from .stats import next_change, record_submissions
+from .storage import submission_storage
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+# Submission rows inserted per bulk_create, each chunk in its own transaction
+SUBMISSION_INSERT_CHUNK = 200
+
+SUBMISSION_STAGE_SECONDS = instrumentation.histogram(
+    'smartgrader_submission_stage_seconds', 'Time spent around the OMR for uploaded sheets, by stage.'
+)
+OMR_CACHE_LOOKUPS = instrumentation.counter('smartgrader_omr_cache_lookups_total', 'OMR result cache hits and misses.')
+
+
+def _sheet_geometry(test):
+    """Return the bubble geometry the test's sheets were printed with.
+
+    Tests without a stored geometry, or whose questions changed since the PDF
+    was generated, fall back to the current layout for their size.
+    """
+    geometry = test.sheet_geometry
+    if geometry and (geometry.get('num_questions'), geometry.get('num_options')) == (test.num_questions, test.num_options):
+        return geometry
+    return sheet_geometry(test.num_questions, test.num_options)
+
+
+@contextmanager
+def uploaded_image(uploaded_file):
+    """Yield an uploaded sheet as bytes, read once, to hash, decode and store from memory.
+
+    Uploads larger than OMR_UPLOAD_MEMORY_MAX_BYTES are copied to a scratch file
+    instead, in a directory of their own under OMR_SCRATCH_DIR that is removed
+    afterwards, and its path is yielded.
+    """
+    if uploaded_file.size <= settings.OMR_UPLOAD_MEMORY_MAX_BYTES:
+        uploaded_file.seek(0)
+        yield uploaded_file.read()
+        return
+
+    with tempfile.TemporaryDirectory(prefix='upload-', dir=settings.OMR_SCRATCH_DIR or None) as scratch_dir:
+        path = Path(scratch_dir) / Path(uploaded_file.name).name
+        with open(path, 'wb') as destination:
+            for chunk in uploaded_file.chunks():
+                destination.write(chunk)
+        yield str(path)
+
+
+class ZipMemberTooLarge(ValueError):
+    pass
+
+
+def check_zip_member_size(info):
+    """Raise ZipMemberTooLarge if a zip member declares more than OMR_ZIP_MEMBER_MAX_BYTES."""
+    if info.file_size > settings.OMR_ZIP_MEMBER_MAX_BYTES:
+        raise ZipMemberTooLarge(
+            f'{Path(info.filename).name} is larger than {settings.OMR_ZIP_MEMBER_MAX_BYTES} bytes'
+        )
+
+
+def read_zip_member(zip_ref, member):
+    """Read one zip member, never more than OMR_ZIP_MEMBER_MAX_BYTES of it.
+
+    The declared size is checked first, then the read itself stops one byte
+    past the limit, so a member whose header understates its size is rejected
+    instead of being inflated whole into memory.
+
+    Raises:
+        ZipMemberTooLarge: If the member is, or turns out to be, over the limit
+    """
+    info = member if isinstance(member, zipfile.ZipInfo) else zip_ref.getinfo(member)
+    check_zip_member_size(info)
+    limit = settings.OMR_ZIP_MEMBER_MAX_BYTES
+    with zip_ref.open(info) as member_file:
+        data = member_file.read(limit + 1)
+    if len(data) > limit:
+        raise ZipMemberTooLarge(f'{Path(info.filename).name} is larger than {limit} bytes')
+    return data
+
+
+def worker_pool_size():
+    """OMR processes for an omr_worker: one fewer than OMR_WORKERS, leaving a core to the web process's pool."""
+    return max(1, (settings.OMR_WORKERS or default_worker_count()) - 1)
+
+
+def detect_answers(test, images, priority=BULK, max_workers=None):
+    """Read the answers on many (image, filename) pairs, reusing cached results for known images.
+
+    Sheets are scheduled at the given priority, with the test's teacher as their owner.
+    max_workers sizes a pool that grades nothing but these bulk sheets, as in
+    omr_worker; by default the process's OMR_WORKERS pool is shared with students.
+
+    Returns:
+        List of (image SHA-256, OMR result dict), in input order
+    """
+    geometry = _sheet_geometry(test)
+    params = omr_cache.omr_params(test.num_questions, test.num_options, 0.6, geometry)
+
+    digests = [omr_cache.image_digest(image) for image, _ in images]
+    keys = [omr_cache.cache_key(digest, params) for digest in digests]
+    started = time.perf_counter()
+    cached = omr_cache.lookup(keys)
+    if settings.OMR_INSTRUMENTATION:
+        SUBMISSION_STAGE_SECONDS.observe(time.perf_counter() - started, stage='cache_lookup')
+        OMR_CACHE_LOOKUPS.inc(len(cached), result='hit')
+        OMR_CACHE_LOOKUPS.inc(len(keys) - len(cached), result='miss')
+
+    # The same image can appear twice in one upload; read it once
+    pending = {}
+    for (image, _), key in zip(images, keys):
+        if key not in cached and key not in pending:
+            pending[key] = image
+
+    omr_results = process_omr_images(
+        [image if isinstance(image, bytes) else str(image) for image in pending.values()],
+        test.num_questions,
+        test.num_options,
+        darkness_threshold=0.6,
+        max_workers=max_workers or settings.OMR_WORKERS,
+        geometry=geometry,
+        trace=settings.OMR_INSTRUMENTATION,
+        derivatives=True,
+        priority=priority,
+        owner=test.created_by_id,
+        max_bulk_in_flight=max_workers or settings.OMR_BULK_IN_FLIGHT,
+    )
+    fresh = dict(zip(pending, omr_results))
+    omr_cache.store((key, digest, fresh[key]) for key, digest in zip(keys, digests) if key in fresh)
+
+    return [(digest, cached.get(key) or fresh[key]) for digest, key in zip(digests, keys)]
+
+
+def process_submission_batch(test, images, dedupe=False):
+    """Run the OMR over many (image, filename) pairs in parallel and save each submission.
+
+    Each image is either a file path or the encoded image bytes. With dedupe, an
+    image already uploaded for this test returns its existing submission.
+    """
+    return save_submissions(test, images, detect_answers(test, images), dedupe)
+
+
+def process_single_submission(test, image_path, filename, student=None):
+    """Process a single submission image someone is waiting on, ahead of queued bulk uploads.
+
+    With student, the submission is stored as theirs, under their name.
+    """
+    try:
+        detected = detect_answers(test, [(image_path, filename)], INTERACTIVE)
+    except Exception as exc:
+        return {
+            'filename': filename,
+            'success': False,
+            'error': str(exc),
+        }
+
+    return save_submissions(test, [(image_path, filename)], detected, student=student)[0]
+
+
+def save_submissions(test, images, detected, dedupe=False, student=None):
+    """Grade and store the detect_answers output for many (image, filename) pairs.
+
+    Sheets are scored against the test's cached AnswerKey (see answer_keys.py).
+    Sheet images are saved to storage together with the review images the OMR
+    encoded while reading them (the warped answer box and a thumbnail). Then the
+    Submission rows are inserted with bulk_create, SUBMISSION_INSERT_CHUNK rows
+    per transaction. If a chunk fails to insert, its sheets are reported as
+    failed and their images removed.
+
+    Returns:
+        List of per-sheet result dicts, in input order
+    """
+    return insert_submissions(prepare_submissions(test, images, detected, dedupe, student))
+
+
+class PreparedSubmissions:
+    """Sheets graded and stored by prepare_submissions, whose rows insert_submissions has yet to insert."""
+
+    def __init__(self, test, detected, traces):
+        self.test = test
+        self.detected = detected
+        self.traces = traces
+        self.results = [None] * len(detected)
+        # (index, Submission, result) for rows still to insert
+        self.pending = []
+        # (index, filename, Submission) for re-uploads, resolved once every row has an id
+        self.duplicates = []
+
+
+def prepare_submissions(test, images, detected, dedupe=False, student=None):
+    """Grade sheets and save their images to storage, the first half of save_submissions.
+
+    Each saved image already holds its storage reference, so a caller that
+    ends up inserting none of the rows, e.g. because its transaction rolled
+    back, must hand them to release_submission_images.
+    """
+    traces = [
+        instrumentation.Trace() if settings.OMR_INSTRUMENTATION else instrumentation.NULL_TRACE
+        for _ in images
+    ]
+    prepared = PreparedSubmissions(test, detected, traces)
+
+    answer_key = get_answer_key(test)
+
+    started = time.perf_counter()
+    existing = _existing_submissions(test, [digest for digest, _ in detected]) if dedupe else {}
+    # Cached OMR results come without review images; reuse the ones stored for an earlier upload of the image
+    reusable = _stored_derivatives(
+        {digest for digest, omr_result in detected if omr_result['success'] and 'derivatives' not in omr_result}
+    )
+    elapsed = (time.perf_counter() - started) / max(1, len(traces))
+    for trace in traces:
+        trace.add('database', elapsed)
+
+    for index, ((image, filename), (digest, omr_result)) in enumerate(zip(images, detected)):
+        trace = traces[index]
+        try:
+            if not omr_result['success']:
+                prepared.results[index] = _failure(filename, omr_result.get('error') or 'Unable to process image')
+                continue
+
+            if dedupe and digest in existing:
+                prepared.duplicates.append((index, filename, existing[digest]))
+                continue
+
+            detected_answers = omr_result['answers']
+            with trace.stage('grade'):
+                grading = answer_key.grade(detected_answers)
+
+            with trace.stage('storage'):
+                saved_path = _store_image(f"submissions/test_{test.id}_{filename}", image)
+                warped_path, thumbnail_path = _store_derivatives(
+                    f"submissions/test_{test.id}_{Path(filename).stem}", omr_result.get('derivatives'),
+                    reusable.get(digest, ('', '')),
+                )
+
+            submission = Submission(
+                test=test,
+                student_user=student,
+                first_name=student.first_name if student else '',
+                last_name=student.last_name if student else '',
+                image=saved_path,
+                warped_image=warped_path,
+                thumbnail=thumbnail_path,
+                image_sha256=digest,
+                answers=detected_answers,
+                fill_ratios=pack_fill_ratios(omr_result['fill_ratios']),
+                score=grading['score'],
+                total_questions=grading['total'],
+                percentage=grading['percentage'],
+                answer_key_version=test.answer_key_version,
+                processed=True,
+            )
+            if dedupe and digest:
+                # The same image later in this upload points at this row
+                existing[digest] = submission
+            prepared.pending.append((index, submission, {
+                'filename': filename,
+                'success': True,
+                'score': grading['score'],
+                'total': grading['total'],
+                'percentage': grading['percentage'],
+            }))
+
+        except Exception as exc:
+            prepared.results[index] = _failure(filename, str(exc))
+
+    return prepared
+
+
+def insert_submissions(prepared):
+    """Insert the rows of prepare_submissions in chunks and return the per-sheet results, in input order."""
+    test = prepared.test
+    traces = prepared.traces
+    results = prepared.results
+
+    for start in range(0, len(prepared.pending), SUBMISSION_INSERT_CHUNK):
+        chunk = prepared.pending[start:start + SUBMISSION_INSERT_CHUNK]
+        started = time.perf_counter()
+        try:
+            # A savepoint when called inside a transaction, so a failed chunk doesn't poison the caller's
+            with transaction.atomic():
+                change_seq = next_change(test.id)
+                for _, submission, _ in chunk:
+                    submission.change_seq = change_seq
+                Submission.objects.bulk_create([submission for _, submission, _ in chunk])
+                record_submissions(test.id, [submission for _, submission, _ in chunk])
+        except Exception as exc:
+            failed = [submission for _, submission, _ in chunk]
+            # Inside a caller's transaction the images are released once it commits; if it rolls back
+            # instead, the caller releases every prepared image itself
+            transaction.on_commit(lambda failed=failed: _release_images(failed))
+            for index, submission, result in chunk:
+                submission.pk = None
+                results[index] = _failure(result['filename'], str(exc))
+            continue
+        finally:
+            elapsed = (time.perf_counter() - started) / len(chunk)
+            for index, _, _ in chunk:
+                traces[index].add('database', elapsed)
+
+        for index, submission, result in chunk:
+            result['submission_id'] = submission.id
+            results[index] = result
+
+    for index, filename, submission in prepared.duplicates:
+        if submission.pk is None:
+            results[index] = _failure(filename, 'Unable to store the submission this image duplicates')
+        else:
+            results[index] = {
+                'filename': filename,
+                'success': True,
+                'duplicate': True,
+                'submission_id': submission.id,
+                'score': submission.score,
+                'total': submission.total_questions,
+                'percentage': submission.percentage,
+            }
+
+    if settings.OMR_INSTRUMENTATION:
+        for result, trace, (_, omr_result) in zip(results, traces, prepared.detected):
+            for stage, seconds in trace.stages.items():
+                SUBMISSION_STAGE_SECONDS.observe(seconds, stage=stage)
+            result['trace'] = {
+                'omr': omr_result.get('trace'),
+                'cached': bool(omr_result.get('cached')),
+                'save': trace.as_dict(),
+            }
+    return results
+
+
+def release_submission_images(prepared):
+    """Drop the storage references of every image prepare_submissions saved; none of its rows may exist."""
+    _release_images([submission for _, submission, _ in prepared.pending])
+
+
+def _release_images(submissions):
+    for submission in submissions:
+        for stored in (submission.image, submission.warped_image, submission.thumbnail):
+            if stored:
+                stored.storage.delete(stored.name)
+
+
+def _failure(filename, error):
+    return {
+        'filename': filename,
+        'success': False,
+        'error': error,
+    }
+
+
+def _existing_submissions(test, digests):
+    """Map image SHA-256 to the oldest teacher-uploaded submission of this test with that image."""
+    existing = {}
+    matches = (
+        Submission.objects
+        .filter(test=test, image_sha256__in={digest for digest in digests if digest}, student_user__isnull=True)
+        .order_by('id')
+    )
+    for submission in matches:
+        existing.setdefault(submission.image_sha256, submission)
+    return existing
+
+
+def _stored_derivatives(digests):
+    """Map image SHA-256 to the (warped, thumbnail) names stored for an earlier submission of that image."""
+    if not digests:
+        return {}
+    stored = (
+        Submission.objects
+        .filter(image_sha256__in=digests)
+        .exclude(warped_image='')
+        .exclude(thumbnail='')
+        .values_list('image_sha256', 'warped_image', 'thumbnail')
+    )
+    return {digest: (warped, thumbnail) for digest, warped, thumbnail in stored}
+
+
+def _store_derivatives(name, derivatives, stored):
+    """Save the OMR's review images, or take another reference to the stored ones.
+
+    Returns:
+        (warped name, thumbnail name), with '' for an image that isn't available
+    """
+    storage = submission_storage()
+    if derivatives:
+        return (
+            storage.save(f"{name}_warped.jpg", ContentFile(derivatives['warped'])),
+            storage.save(f"{name}_thumbnail.jpg", ContentFile(derivatives['thumbnail'])),
+        )
+
+    # Only a content-addressed store can share one file between submissions
+    add_reference = getattr(storage, 'add_reference', None)
+    if add_reference is None:
+        return '', ''
+    return tuple(stored_name if stored_name and add_reference(stored_name) else '' for stored_name in stored)
+
+
+def _store_image(name, image):
+    """Save a sheet image (path or bytes) to the submission image storage and return its stored name."""
+    if isinstance(image, bytes):
+        return submission_storage().save(name, ContentFile(image))
+    with open(image, 'rb') as image_file:
+        return submission_storage().save(name, File(image_file))
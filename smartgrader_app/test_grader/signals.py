@@ -0,0 +1,31 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .answer_keys import forget_answer_keys
+from .models import Submission, Test
+from .stats import forget_submission
+
+
+@receiver(post_delete, sender=Submission)
+def release_submission_image(sender, instance, **kwargs):
+    """Drop the deleted submission's references to its sheet images; each file goes with its last one."""
+    for image in (instance.image, instance.warped_image, instance.thumbnail):
+        if image:
+            storage, name = image.storage, image.name
+            transaction.on_commit(lambda storage=storage, name=name: storage.delete(name))
+
+
+@receiver(post_delete, sender=Submission)
+def update_test_stats(sender, instance, origin=None, **kwargs):
+    """Take the deleted submission out of its test's stats, unless the whole test is being deleted."""
+    if isinstance(origin, Test) or getattr(origin, 'model', None) is Test:
+        return
+    forget_submission(instance)
+
+
+@receiver(post_save, sender=Test)
+def forget_compiled_answer_key(sender, instance, created, **kwargs):
+    """Drop the cached answer keys of a test's earlier versions."""
+    if not created:
+        forget_answer_keys(instance.id)
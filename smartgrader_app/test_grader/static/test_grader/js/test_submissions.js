@@ -154,7 +154,12 @@ class SubmissionUploader {
                 }
             };
             const data = tryParse();
-            if (xhr.status === 200 && data) {
+            if (xhr.status === 202 && data && data.progress_url) {
+                this.isUploading = true;
+                this.disableUploadButtons();
+                this.showProgress(`Grading ${data.total} submission(s)...`);
+                this.pollJob(data.progress_url);
+            } else if (xhr.status === 200 && data) {
                 this.handleUploadSuccess(data);
             } else {
                 this.handleUploadError((data && data.error) || `Upload failed with status ${xhr.status}`);
@@ -179,6 +184,43 @@ class SubmissionUploader {
         xhr.send(formData);
     }
 
+    pollJob(progressUrl, collected = []) {
+        const finish = () => {
+            this.isUploading = false;
+            this.enableUploadButtons();
+            this.hideProgress();
+        };
+
+        fetch(`${progressUrl}?offset=${collected.length}`, { credentials: 'same-origin' })
+            .then((response) => response.json().then((data) => ({ ok: response.ok, data })))
+            .then(({ ok, data }) => {
+                if (!ok) {
+                    finish();
+                    this.handleUploadError(data.error || 'Could not read grading progress');
+                    return;
+                }
+                collected.push(...data.results);
+                const processed = data.done + data.failed;
+                const percent = data.total ? Math.round((processed / data.total) * 100) : 0;
+                this.updateProgress(percent, `Graded ${processed}/${data.total}`);
+                if (typeof window.loadSubmissions === 'function' && data.results.length) {
+                    window.loadSubmissions();
+                }
+
+                if (!data.finished) {
+                    setTimeout(() => this.pollJob(progressUrl, collected), 1000);
+                    return;
+                }
+                finish();
+                (data.errors || []).forEach((error) => this.showError(error));
+                this.handleUploadSuccess({ ...data, results: collected });
+            })
+            .catch(() => {
+                finish();
+                this.handleUploadError('Network error occurred');
+            });
+    }
+
     handleUploadSuccess(data) {
         if (data.error) {
             this.showError(data.error);
@@ -341,7 +383,12 @@ function renderSubmissions(submissions) {
                 .map((ans) => (ans === null || ans === undefined || ans < 0 ? '-' : letters[ans] || ans))
                 .join(', ');
             return `
-                <div class="submission-row" data-id="${sub.id}">
+                <div class="submission-row${sub.thumbnail_url ? ' has-thumbnail' : ''}" data-id="${sub.id}">
+                    ${
+                        sub.thumbnail_url
+                            ? `<img class="submission-thumbnail" src="${sub.thumbnail_url}" alt="" loading="lazy">`
+                            : ''
+                    }
                     <div>
                         <div class="student">${escapeHtml(sub.student_name || 'Unnamed student')}</div>
                         <div class="submission-meta">${sub.score}/${sub.total} (${sub.percentage}%) • ${sub.submitted_at}</div>
@@ -426,23 +473,106 @@ function bindNameSaves() {
     });
 }
 
-function loadSubmissions() {
+// Cursors from the last response: nextCursor fetches the next older page, syncCursor what changed since
+const submissionFeed = { nextCursor: null, syncCursor: null, loading: false };
+const SUBMISSION_POLL_INTERVAL_MS = 15000;
+
+function fetchSubmissionPage(params) {
     const testId = window.testId || document.body.dataset.testId;
-    if (!testId) return;
-    fetch(`/tests/${testId}/submissions/`, { credentials: 'same-origin' })
+    const query = new URLSearchParams(params).toString();
+    return fetch(`/tests/${testId}/submissions/${query ? `?${query}` : ''}`, { credentials: 'same-origin' })
         .then((res) => res.json().then((data) => ({ ok: res.ok, data })))
         .then(({ ok, data }) => {
             if (!ok || data.error) {
-                console.error(data.error || 'Failed to load submissions');
-                return;
+                throw new Error(data.error || 'Failed to load submissions');
             }
-            if (Array.isArray(data.correct_answers)) {
-                window.correctAnswers = data.correct_answers;
+            return data;
+        });
+}
+
+// mode: 'replace' for a first page, 'append' for an older page, 'merge' for the rows changed or deleted since the last sync
+function applySubmissionPage(data, mode) {
+    if (Array.isArray(data.correct_answers)) {
+        window.correctAnswers = data.correct_answers;
+    }
+
+    let submissions = data.submissions || [];
+    if (mode === 'append') {
+        const known = new Set(currentSubmissions.map((sub) => sub.id));
+        submissions = currentSubmissions.concat(submissions.filter((sub) => !known.has(sub.id)));
+    } else if (mode === 'merge') {
+        const deleted = new Set(data.deleted || []);
+        const merged = currentSubmissions.filter((sub) => !deleted.has(sub.id));
+        const oldestLoaded = merged.length ? Math.min(...merged.map((sub) => sub.id)) : 0;
+        submissions.forEach((sub) => {
+            const index = merged.findIndex((existing) => existing.id === sub.id);
+            if (index >= 0) {
+                merged[index] = sub;
+            } else if (!submissionFeed.nextCursor || sub.id > oldestLoaded) {
+                // Unseen rows are new uploads; older ones will arrive with their page
+                merged.unshift(sub);
+            }
+        });
+        submissions = merged;
+    }
+
+    if (mode !== 'merge') {
+        submissionFeed.nextCursor = data.next_cursor || null;
+    }
+    if (mode !== 'append' || !submissionFeed.syncCursor) {
+        submissionFeed.syncCursor = data.sync_cursor || null;
+    }
+
+    renderSubmissions(submissions);
+    updateMeta(data.count, data.average_percentage);
+
+    const loadMoreBtn = document.getElementById('load-more-submissions');
+    if (loadMoreBtn) loadMoreBtn.hidden = !submissionFeed.nextCursor;
+}
+
+function reloadSubmissions() {
+    submissionFeed.loading = true;
+    return fetchSubmissionPage({})
+        .then((data) => applySubmissionPage(data, 'replace'))
+        .catch((err) => console.error(err))
+        .finally(() => {
+            submissionFeed.loading = false;
+        });
+}
+
+function loadMoreSubmissions() {
+    if (!submissionFeed.nextCursor || submissionFeed.loading) return;
+    submissionFeed.loading = true;
+    fetchSubmissionPage({ cursor: submissionFeed.nextCursor })
+        .then((data) => applySubmissionPage(data, 'append'))
+        .catch((err) => console.error(err))
+        .finally(() => {
+            submissionFeed.loading = false;
+        });
+}
+
+// Fetches only the submissions created, changed or deleted since the last response
+function loadSubmissions() {
+    const testId = window.testId || document.body.dataset.testId;
+    if (!testId || submissionFeed.loading) return;
+    if (!submissionFeed.syncCursor) {
+        reloadSubmissions();
+        return;
+    }
+
+    submissionFeed.loading = true;
+    fetchSubmissionPage({ since: submissionFeed.syncCursor })
+        .then((data) => {
+            submissionFeed.loading = false;
+            applySubmissionPage(data, 'merge');
+            if (data.has_more) {
+                loadSubmissions();
             }
-            renderSubmissions(data.submissions || []);
-            updateMeta(data.count, data.average_percentage);
         })
-        .catch((err) => console.error(err));
+        .catch((err) => {
+            submissionFeed.loading = false;
+            console.error(err);
+        });
 }
 
 window.loadSubmissions = loadSubmissions;
@@ -455,26 +585,23 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const refreshBtn = document.getElementById('refresh-submissions');
     if (refreshBtn) {
-        refreshBtn.addEventListener('click', loadSubmissions);
+        refreshBtn.addEventListener('click', reloadSubmissions);
+    }
+
+    const loadMoreBtn = document.getElementById('load-more-submissions');
+    if (loadMoreBtn) {
+        loadMoreBtn.addEventListener('click', loadMoreSubmissions);
     }
 
-    if (Array.isArray(window.initialSubmissions)) {
-        renderSubmissions(window.initialSubmissions);
-        const avg =
-            window.initialSubmissions.length > 0
-                ? Math.round(
-                      (window.initialSubmissions.reduce(
-                          (total, sub) => total + Number(sub.percentage || 0),
-                          0,
-                      ) /
-                          window.initialSubmissions.length) *
-                          100,
-                  ) / 100
-                : 0;
-        updateMeta(window.initialSubmissions.length, avg);
+    if (window.initialSubmissionPage) {
+        applySubmissionPage(window.initialSubmissionPage, 'replace');
     } else {
-        loadSubmissions();
+        reloadSubmissions();
     }
+
+    setInterval(() => {
+        if (!document.hidden) loadSubmissions();
+    }, SUBMISSION_POLL_INTERVAL_MS);
 });
 
 function bindImageViews() {
@@ -516,6 +643,11 @@ function bindStatsViews() {
                             ? `<img src="${sub.image_url}" alt="Submission image">`
                             : '<div class="empty-state">No image available.</div>'
                     }
+                    ${
+                        sub.original_url && sub.original_url !== sub.image_url
+                            ? `<a href="${sub.original_url}" target="_blank" rel="noopener">View original photo</a>`
+                            : ''
+                    }
                 </div>
                 <div class="preview-meta">
                     <div class="stat-line">Score: ${sub.score}/${sub.total}</div>
@@ -0,0 +1,177 @@
+"""
+Incremental maintenance of the per-test TestStats rollup.
+
+New submissions are added to the running totals and deleted ones subtracted,
+under a row lock on the test's TestStats row, so pages read a test's stats
+with one primary-key lookup. Minimum and maximum can't be subtracted: when a
+deleted submission held one of them, they are recomputed with one aggregate
+query. A regrade changes every score at once and rebuilds the row instead.
+
+The same row numbers a test's changes for clients syncing its submission
+list. Every write to a test's submissions first takes the next change number
+with next_change() and stamps it on the rows it writes or, for a deletion, on
+a DeletedSubmission tombstone. The row lock is held until the writer commits,
+so changes commit in the order of their numbers: once a reader sees
+TestStats.change_seq at N, every change up to N is visible.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+
+from .models import DeletedSubmission, Submission, TestStats
+
+
+def _locked_stats(test_id):
+    """Return the test's TestStats row locked for update, creating it if missing. Call inside a transaction."""
+    TestStats.objects.get_or_create(test_id=test_id)
+    return TestStats.objects.select_for_update().get(test_id=test_id)
+
+
+def next_change(test_id):
+    """
+    Take the test's next change number for the submissions about to be written.
+
+    Call inside the transaction that writes them: the TestStats row stays
+    locked until it commits.
+    """
+    stats = _locked_stats(test_id)
+    stats.change_seq += 1
+    stats.save(update_fields=['change_seq'])
+    return stats.change_seq
+
+
+def _bound(pick, value, current):
+    return value if current is None else pick(value, current)
+
+
+def _is_later(submission, other):
+    return other is None or (submission.submitted_at, submission.id) > (other.submitted_at, other.id)
+
+
+def record_submissions(test_id, submissions):
+    """Add newly created submissions of one test to its stats."""
+    submissions = [submission for submission in submissions if submission.processed]
+    if not submissions:
+        return
+
+    with transaction.atomic():
+        stats = _locked_stats(test_id)
+        latest = stats.latest_submission
+        grade_counts = dict(stats.grade_counts)
+        for submission in submissions:
+            stats.submission_count += 1
+            stats.score_sum += submission.score
+            stats.percentage_sum += submission.percentage
+            stats.percentage_sum_squares += submission.percentage ** 2
+            stats.min_score = _bound(min, submission.score, stats.min_score)
+            stats.max_score = _bound(max, submission.score, stats.max_score)
+            stats.min_percentage = _bound(min, submission.percentage, stats.min_percentage)
+            stats.max_percentage = _bound(max, submission.percentage, stats.max_percentage)
+            if submission.percentage >= TestStats.PASS_PERCENTAGE:
+                stats.pass_count += 1
+            grade = TestStats.grade_for(submission.percentage)
+            grade_counts[grade] = grade_counts.get(grade, 0) + 1
+            if _is_later(submission, latest):
+                latest = submission
+        stats.grade_counts = grade_counts
+        stats.latest_submission = latest
+        stats.save()
+
+
+def forget_submission(submission):
+    """Subtract a deleted submission from its test's stats and leave a tombstone for syncing clients."""
+    if not submission.processed:
+        return
+
+    with transaction.atomic():
+        if not TestStats.objects.filter(test_id=submission.test_id).exists():
+            return
+        DeletedSubmission.objects.create(
+            test_id=submission.test_id, submission_id=submission.id, change_seq=next_change(submission.test_id)
+        )
+        stats = _locked_stats(submission.test_id)
+        if stats.submission_count <= 1:
+            rebuild_test_stats(submission.test_id)
+            return
+
+        stats.submission_count -= 1
+        stats.score_sum -= submission.score
+        stats.percentage_sum -= submission.percentage
+        stats.percentage_sum_squares -= submission.percentage ** 2
+        if submission.percentage >= TestStats.PASS_PERCENTAGE:
+            stats.pass_count -= 1
+        grade = TestStats.grade_for(submission.percentage)
+        stats.grade_counts = dict(stats.grade_counts, **{grade: max(0, stats.grade_counts.get(grade, 0) - 1)})
+
+        extremes = (stats.min_score, stats.max_score, stats.min_percentage, stats.max_percentage)
+        if submission.score in extremes[:2] or submission.percentage in extremes[2:]:
+            stats.min_score, stats.max_score, stats.min_percentage, stats.max_percentage = _extremes(
+                submission.test_id
+            )
+        if stats.latest_submission_id in (None, submission.id):
+            stats.latest_submission = _latest(submission.test_id)
+        stats.save()
+
+
+def rebuild_test_stats(test_id):
+    """Recompute a test's stats from its submissions; returns the TestStats row."""
+    processed = Submission.objects.filter(test_id=test_id, processed=True)
+    grade_filters = {}
+    upper = None
+    for letter, bound in TestStats.GRADE_BOUNDARIES:
+        condition = Q()
+        if bound is not None:
+            condition &= Q(percentage__gte=bound)
+        if upper is not None:
+            condition &= Q(percentage__lt=upper)
+        grade_filters[f'grade_{letter}'] = Count('id', filter=condition)
+        upper = bound
+
+    with transaction.atomic():
+        stats = _locked_stats(test_id)
+        totals = processed.aggregate(
+            submission_count=Count('id'),
+            score_sum=Sum('score'),
+            percentage_sum=Sum('percentage'),
+            percentage_sum_squares=Sum(F('percentage') * F('percentage')),
+            min_score=Min('score'),
+            max_score=Max('score'),
+            min_percentage=Min('percentage'),
+            max_percentage=Max('percentage'),
+            pass_count=Count('id', filter=Q(percentage__gte=TestStats.PASS_PERCENTAGE)),
+            **grade_filters,
+        )
+        stats.grade_counts = {
+            letter: totals.pop(f'grade_{letter}') for letter, _ in TestStats.GRADE_BOUNDARIES
+        }
+        for field, value in totals.items():
+            if field in ('score_sum', 'percentage_sum', 'percentage_sum_squares'):
+                value = value or 0
+            setattr(stats, field, value)
+        stats.latest_submission = _latest(test_id)
+        stats.save()
+    return stats
+
+
+def get_test_stats(test):
+    """Return a test's TestStats; an empty, unsaved one for a test that has never had a submission."""
+    try:
+        return test.stats
+    except TestStats.DoesNotExist:
+        return TestStats(test=test)
+
+
+def _extremes(test_id):
+    """(min score, max score, min percentage, max percentage) over a test's processed submissions."""
+    values = Submission.objects.filter(test_id=test_id, processed=True).aggregate(
+        Min('score'), Max('score'), Min('percentage'), Max('percentage')
+    )
+    return values['score__min'], values['score__max'], values['percentage__min'], values['percentage__max']
+
+
+def _latest(test_id):
+    return (
+        Submission.objects.filter(test_id=test_id, processed=True)
+        .only('id', 'submitted_at')
+        .order_by('-submitted_at', '-id')
+        .first()
+    )
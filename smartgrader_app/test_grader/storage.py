@@ -0,0 +1,157 @@
+"""Content-addressed storage for submission sheet images."""
+import hashlib
+from pathlib import PurePosixPath
+
+import cv2
+import numpy as np
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+# Directory under the storage root that blobs are fanned out in
+BLOB_DIR = 'sheets'
+
+# Start-of-frame markers, whose segment holds the number of colour components
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _is_grayscale_jpeg(data):
+    """Return True for a JPEG whose frame has a single component; nothing is decoded."""
+    if data[:2] != b'\xff\xd8':
+        return False
+
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return False
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            position += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            return False
+        if marker in _JPEG_SOF_MARKERS:
+            return position + 9 < len(data) and data[position + 9] == 1
+        position += 2 + int.from_bytes(data[position + 2:position + 4], 'big')
+    return False
+
+
+def submission_storage():
+    """Return the storage submission images are kept in (the 'submissions' alias of STORAGES)."""
+    return storages['submissions']
+
+
+class ContentAddressedImageStorage(FileSystemStorage):
+    """
+    File system storage that keeps each distinct sheet image once.
+
+    Saved images are named by the SHA-256 of the uploaded bytes and fanned out
+    two directory levels deep, as sheets/ab/cd/abcd....jpg, so no directory
+    holds more than a few hundred entries. They are re-encoded as grayscale
+    JPEGs at jpeg_quality (0 stores the uploaded bytes unchanged); images that
+    already are grayscale JPEGs, like the OMR's review images, are kept as they
+    are. Saving an
+    image that is already stored only adds a reference to it, and delete()
+    only removes the file when its last reference goes (see ImageBlob).
+
+    Names that aren't blob names, such as images stored before this backend
+    was introduced, are read and deleted as plain files.
+    """
+
+    def __init__(self, jpeg_quality=80, **kwargs):
+        super().__init__(**kwargs)
+        self.jpeg_quality = jpeg_quality
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        extension = PurePosixPath(name).suffix.lower() or '.jpg'
+
+        if self.jpeg_quality:
+            # Re-encoding needs the whole image decoded anyway
+            data = b''.join(content.chunks())
+            key = hashlib.sha256(data).hexdigest()
+        else:
+            digest = hashlib.sha256()
+            for chunk in content.chunks():
+                digest.update(chunk)
+            key = digest.hexdigest()
+
+        blob_name = self._add_reference(key)
+        if blob_name is not None:
+            return blob_name
+
+        if self.jpeg_quality:
+            data, extension = self._encode(data, extension)
+            content = ContentFile(data)
+        else:
+            content.seek(0)
+        blob_name = f"{BLOB_DIR}/{key[:2]}/{key[2:4]}/{key}{extension}"
+        if not self.exists(blob_name):
+            super()._save(blob_name, content)
+        return self._create_reference(key, blob_name, self.size(blob_name))
+
+    def add_reference(self, name):
+        """Count one more user of an already stored image; returns False if name isn't a stored blob."""
+        from .models import ImageBlob
+
+        return bool(ImageBlob.objects.filter(name=name).update(refcount=F('refcount') + 1))
+
+    def delete(self, name):
+        if not name:
+            raise ValueError('The name must be given to delete().')
+
+        from .models import ImageBlob
+
+        if not self._is_blob(name):
+            super().delete(name)
+            return
+
+        with transaction.atomic():
+            blob = ImageBlob.objects.select_for_update().filter(name=name).first()
+            if blob is not None and blob.refcount > 1:
+                ImageBlob.objects.filter(key=blob.key).update(refcount=F('refcount') - 1)
+                return
+            if blob is not None:
+                blob.delete()
+            super().delete(name)
+
+    def _is_blob(self, name):
+        return PurePosixPath(name).parts[:1] == (BLOB_DIR,)
+
+    def _encode(self, data, extension):
+        """Re-encode an image as a grayscale JPEG; undecodable data is stored as uploaded."""
+        if _is_grayscale_jpeg(data):
+            return data, '.jpg'
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            return data, extension
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            return data, extension
+        return encoded.tobytes(), '.jpg'
+
+    def _add_reference(self, key):
+        """Count one more reference to an existing blob and return its name, or None if it isn't stored."""
+        from .models import ImageBlob
+
+        with transaction.atomic():
+            updated = ImageBlob.objects.filter(key=key).update(refcount=F('refcount') + 1)
+            if not updated:
+                return None
+            return ImageBlob.objects.values_list('name', flat=True).get(key=key)
+
+    def _create_reference(self, key, blob_name, size):
+        from .models import ImageBlob
+
+        try:
+            with transaction.atomic():
+                ImageBlob.objects.create(key=key, name=blob_name, size_bytes=size)
+        except IntegrityError:
+            # Another upload of the same image stored it first
+            return self._add_reference(key) or blob_name
+        return blob_name
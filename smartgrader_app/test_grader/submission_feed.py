@@ -0,0 +1,124 @@
+"""
+Paged and incremental listings of a test's submissions for the detail page.
+
+A browse page walks the submissions newest first with a keyset cursor on
+(submitted_at, id). Every page also carries a sync cursor on
+(change_seq, id), the change numbers test_grader.stats hands out in commit
+order. Passed back as `since`, it returns only the submissions created or
+changed after it, oldest change first, and the ids of those deleted since,
+so a dashboard polling during an exam transfers the few rows that moved
+instead of the whole test. The answer key is sent once per response, not
+repeated on every row.
+"""
+from .answer_keys import get_answer_key
+from .models import DeletedSubmission, Submission
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .stats import get_test_stats
+
+SUBMISSIONS_PAGE_SIZE = 50
+SUBMISSIONS_MAX_PAGE_SIZE = 200
+
+# Fields the rows are built from; the stored fill ratios and hashes never leave the server
+SUBMISSION_FIELDS = (
+    'id',
+    'test_id',
+    'first_name',
+    'last_name',
+    'image',
+    'warped_image',
+    'thumbnail',
+    'answers',
+    'score',
+    'total_questions',
+    'percentage',
+    'submitted_at',
+    'change_seq',
+    'student_user__first_name',
+    'student_user__last_name',
+    'student_user__email',
+)
+
+
+def _submissions(test):
+    return (
+        Submission.objects.filter(test=test, processed=True)
+        .select_related('student_user')
+        .only(*SUBMISSION_FIELDS)
+    )
+
+
+def serialize_submission(sub):
+    """One submission as the detail page's list renders it; image URLs are relative."""
+    return {
+        'id': sub.id,
+        'student_name': sub.full_name,
+        'first_name': sub.first_name or '',
+        'last_name': sub.last_name or '',
+        'score': sub.score,
+        'total': sub.total_questions,
+        'percentage': sub.percentage,
+        'submitted_at': sub.submitted_at.strftime('%Y-%m-%d %H:%M'),
+        # The warped answer box and thumbnail are a fraction of the photo's size; the photo stays linked
+        'image_url': sub.review_image_url,
+        'thumbnail_url': sub.preview_image_url,
+        'original_url': sub.original_image_url,
+        'answers': sub.answers,
+    }
+
+
+def _synced_through(change_seq):
+    """Sync cursor past every change up to and including change_seq."""
+    return encode_cursor(change_seq + 1, 0)
+
+
+def submissions_page(test, limit=SUBMISSIONS_PAGE_SIZE, cursor=None, since=None):
+    """
+    Return one response's worth of a test's submissions.
+
+    Without `since`, returns a page of submissions, newest first, starting after
+    `cursor`, with the cursor of the next page. With `since`, a sync cursor
+    from an earlier response, returns the submissions created or changed after
+    it instead, and the ids of the submissions deleted since under `deleted`.
+    Either way the result carries the sync cursor to poll from next, plus
+    `has_more` when the rows were cut off at `limit`. count,
+    average_percentage and correct_answers describe the whole test.
+
+    Raises pagination.InvalidCursor for a cursor or since value that wasn't
+    produced here.
+    """
+    # Read before the rows: every change up to its change_seq has committed, later ones are sent next time
+    stats = get_test_stats(test)
+    synced = stats.change_seq
+
+    deleted = []
+    if since:
+        since_seq, _ = decode_cursor(since)
+        rows, more_cursor = keyset_page(
+            _submissions(test).filter(change_seq__lte=synced), 'change_seq', limit, cursor=since, descending=False
+        )
+        next_cursor = None
+        has_more = more_cursor is not None
+        # A deletion has a change number of its own, never shared with written rows
+        tombstones = DeletedSubmission.objects.filter(test=test, change_seq__gte=since_seq)
+        if has_more:
+            sync_cursor = more_cursor
+            tombstones = tombstones.filter(change_seq__lt=rows[-1].change_seq)
+        else:
+            sync_cursor = _synced_through(synced)
+            tombstones = tombstones.filter(change_seq__lte=synced)
+        deleted = list(tombstones.order_by('change_seq').values_list('submission_id', flat=True))
+    else:
+        sync_cursor = _synced_through(synced)
+        rows, next_cursor = keyset_page(_submissions(test), 'submitted_at', limit, cursor=cursor)
+        has_more = next_cursor is not None
+
+    return {
+        'submissions': [serialize_submission(sub) for sub in rows],
+        'deleted': deleted,
+        'next_cursor': next_cursor,
+        'sync_cursor': sync_cursor,
+        'has_more': has_more,
+        'count': stats.submission_count,
+        'average_percentage': round(stats.average_percentage, 2),
+        'correct_answers': get_answer_key(test).correct_answers,
+    }
@@ -0,0 +1,105 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from test_grader.jobs import claim_task, requeue_expired_tasks
+from test_grader.models import GradingJob, GradingTask, Test
+
+
+@override_settings(OMR_TASK_LEASE_SECONDS=120, OMR_TASK_MAX_ATTEMPTS=3)
+class TaskLeaseTests(TestCase):
+    def setUp(self):
+        teacher = get_user_model().objects.create_user(email='teacher@example.com', password='secret')
+        self.test = Test.objects.create(title='Quiz', questions=[], num_questions=0, created_by=teacher)
+        self.teacher = teacher
+
+    def make_job(self, tasks):
+        job = GradingJob.objects.create(test=self.test, created_by=self.teacher, total=tasks, task_count=tasks)
+        GradingTask.objects.bulk_create([
+            GradingTask(job=job, sequence=sequence, sheets=[{'path': 'p', 'name': f'{sequence}.png', 'member': None}])
+            for sequence in range(tasks)
+        ])
+        return job
+
+    def expire(self, task, attempts):
+        GradingTask.objects.filter(id=task.id).update(
+            attempts=attempts, lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_claim_leases_the_oldest_pending_task(self):
+        job = self.make_job(2)
+
+        before = timezone.now()
+        task = claim_task('worker-a')
+
+        self.assertEqual((task.job_id, task.sequence), (job.id, 0))
+        self.assertEqual(task.status, GradingTask.STATUS_RUNNING)
+        self.assertEqual(task.worker, 'worker-a')
+        self.assertEqual(task.attempts, 1)
+        self.assertGreaterEqual(task.lease_expires_at, before + timedelta(seconds=120))
+        job.refresh_from_db()
+        self.assertEqual(job.status, GradingJob.STATUS_RUNNING)
+        self.assertIsNotNone(job.started_at)
+
+    def test_claims_go_round_robin_across_jobs(self):
+        first = self.make_job(2)
+        second = self.make_job(2)
+
+        claimed = [(task.job_id, task.sequence) for task in iter(lambda: claim_task('worker-a'), None)]
+
+        self.assertEqual(claimed, [(first.id, 0), (second.id, 0), (first.id, 1), (second.id, 1)])
+
+    def test_each_worker_gets_a_different_task(self):
+        self.make_job(2)
+
+        first = claim_task('worker-a')
+        second = claim_task('worker-b')
+
+        self.assertNotEqual(first.id, second.id)
+        self.assertEqual(
+            dict(GradingTask.objects.values_list('id', 'worker')),
+            {first.id: 'worker-a', second.id: 'worker-b'},
+        )
+        self.assertIsNone(claim_task('worker-c'))
+
+    def test_live_leases_are_not_requeued(self):
+        self.make_job(1)
+        task = claim_task('worker-a')
+
+        self.assertEqual(requeue_expired_tasks(), 0)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.worker), (GradingTask.STATUS_RUNNING, 'worker-a'))
+
+    def test_expired_lease_goes_back_to_the_queue(self):
+        self.make_job(1)
+        task = claim_task('worker-a')
+        self.expire(task, attempts=1)
+
+        self.assertEqual(requeue_expired_tasks(), 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, GradingTask.STATUS_PENDING)
+        self.assertEqual(task.worker, '')
+        self.assertIsNone(task.lease_expires_at)
+
+        retried = claim_task('worker-b')
+        self.assertEqual((retried.id, retried.worker, retried.attempts), (task.id, 'worker-b', 2))
+
+    def test_expired_lease_out_of_attempts_fails_the_task(self):
+        job = self.make_job(2)
+        task = claim_task('worker-a')
+        self.expire(task, attempts=3)
+
+        self.assertEqual(requeue_expired_tasks(), 0)
+        task.refresh_from_db()
+        self.assertEqual(task.status, GradingTask.STATUS_FAILED)
+        self.assertEqual(task.error, 'Grading did not finish before its lease expired')
+        self.assertEqual(task.results, [
+            {'filename': '0.png', 'success': False, 'error': 'Grading did not finish before its lease expired'}
+        ])
+        job.refresh_from_db()
+        self.assertEqual((job.failed, job.finished_tasks, job.status), (1, 1, GradingJob.STATUS_RUNNING))
+
+        # The job's other task is still there to claim
+        self.assertEqual(claim_task('worker-b').sequence, 1)
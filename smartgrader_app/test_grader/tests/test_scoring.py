@@ -0,0 +1,145 @@
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+from django.test import SimpleTestCase
+
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.append(str(PROJECT_ROOT))
+
+from grade_processor.scoring import (  # noqa: E402
+    compile_answer_key,
+    grade_answers,
+    grade_masks,
+    grade_submission,
+    marks_to_masks,
+)
+
+
+def set_based_grade(detected_answers, correct_answers, grading_modes=None):
+    """The set-based grading rules grade_submission was built on, kept as the reference."""
+    def as_set(answer):
+        if answer is None:
+            return set()
+        if isinstance(answer, (list, tuple)):
+            return set(answer)
+        if isinstance(answer, int):
+            return {answer}
+        return set()
+
+    def points_for(detected, correct, mode):
+        if not detected or not correct:
+            return 0.0
+        if mode == 'partial_credit':
+            points = (len(detected & correct) - len(detected - correct)) / len(correct)
+            return max(0.0, min(1.0, points))
+        return 1.0 if detected == correct else 0.0
+
+    if grading_modes is None:
+        grading_modes = ['all_or_nothing'] * len(correct_answers)
+
+    score = 0.0
+    total = len(correct_answers)
+    details = []
+    for i, (detected, correct, mode) in enumerate(zip(detected_answers, correct_answers, grading_modes)):
+        points = points_for(as_set(detected), as_set(correct), mode)
+        score += points
+        details.append({
+            'question': i + 1,
+            'detected': detected,
+            'correct': correct,
+            'is_correct': points == 1.0,
+            'points': points,
+            'grading_mode': mode
+        })
+
+    percentage = (score / total * 100) if total > 0 else 0
+    return {'score': score, 'total': total, 'percentage': round(percentage, 2), 'details': details}
+
+
+def random_answer(rng, num_options):
+    roll = rng.random()
+    if roll < 0.15:
+        return None
+    if roll < 0.5:
+        return rng.randrange(num_options)
+    if roll < 0.55:
+        # Malformed answers the set-based rules still had to cope with
+        return rng.choice(['a', 2.0, -1, 40, True, [1, 'x'], [20], []])
+    return sorted(rng.sample(range(num_options), rng.randint(1, num_options)))
+
+
+class GradeSubmissionTests(SimpleTestCase):
+    def assertSameGrade(self, detected, correct, modes=None):
+        self.assertEqual(grade_submission(detected, correct, modes), set_based_grade(detected, correct, modes))
+
+    def test_all_or_nothing_needs_the_exact_set(self):
+        self.assertSameGrade([[0, 2], [0], [0, 1], None], [[0, 2], [0, 2], [0], [1]])
+
+    def test_partial_credit_penalizes_wrong_marks(self):
+        self.assertSameGrade(
+            [[0], [0, 1], [0, 1, 2], [3], None],
+            [[0, 2], [0, 2], [0, 2], [0, 2], [0, 2]],
+            ['partial_credit'] * 5,
+        )
+
+    def test_integer_answers_and_unknown_modes(self):
+        self.assertSameGrade([1, 2, [3], 0], [1, [2], 3, 0], ['all_or_nothing', 'partial_credit', 'weird', 'weird'])
+
+    def test_malformed_and_wide_answers_fall_back_to_set_rules(self):
+        self.assertSameGrade(['a', [1, 'x'], -1, [20], [17, 2], 2.0], [[1], [1], [0], [20], [17, 2], [2]])
+
+    def test_mismatched_lengths(self):
+        self.assertSameGrade([[0], [1]], [[0], [1], [2]], ['partial_credit'])
+        self.assertSameGrade([[0], [1], [2], [3]], [[0], [1]], ['partial_credit', 'all_or_nothing', 'partial_credit'])
+        self.assertSameGrade([], [])
+
+    def test_randomized_keys_modes_and_answers(self):
+        rng = random.Random(8)
+        for _ in range(2000):
+            num_questions = rng.randint(0, 12)
+            num_options = rng.randint(2, 6)
+            correct = [random_answer(rng, num_options) for _ in range(num_questions)]
+            modes = None
+            if rng.random() >= 0.3:
+                modes = [
+                    rng.choice(['all_or_nothing', 'partial_credit', 'weird'])
+                    for _ in range(rng.randint(max(0, num_questions - 1), num_questions + 1))
+                ]
+            detected = [random_answer(rng, num_options) for _ in range(rng.randint(max(0, num_questions - 2), num_questions + 2))]
+            with self.subTest(detected=detected, correct=correct, modes=modes):
+                self.assertSameGrade(detected, correct, modes)
+
+
+class ClassScoringTests(SimpleTestCase):
+    def setUp(self):
+        rng = random.Random(80)
+        self.num_options = 5
+        self.correct = [sorted(rng.sample(range(5), rng.randint(1, 2))) for _ in range(30)]
+        self.modes = [rng.choice(['all_or_nothing', 'partial_credit']) for _ in self.correct]
+        self.marks = np.array([[[rng.random() < 0.3 for _ in range(5)] for _ in self.correct] for _ in range(40)])
+
+    def answers(self, marks):
+        return [[[int(option) for option in np.flatnonzero(row)] or None for row in sheet] for sheet in marks]
+
+    def test_grade_answers_matches_the_set_rules_per_sheet(self):
+        key = compile_answer_key(self.correct, self.modes, self.num_options)
+        answers = self.answers(self.marks)
+        grading = grade_answers(key, answers)
+
+        for index, detected in enumerate(answers):
+            expected = set_based_grade(detected, self.correct, self.modes)
+            self.assertEqual(grading['score'][index], expected['score'])
+            self.assertEqual(grading['percentage'][index], expected['percentage'])
+            self.assertEqual(grading['points'][index].tolist(), [d['points'] for d in expected['details']])
+
+    def test_grade_masks_matches_grade_answers(self):
+        key = compile_answer_key(self.correct, self.modes, self.num_options)
+        from_masks = grade_masks(key, marks_to_masks(self.marks))
+        from_answers = grade_answers(key, self.answers(self.marks))
+
+        np.testing.assert_array_equal(from_masks['points'], from_answers['points'])
+        np.testing.assert_array_equal(from_masks['score'], from_answers['score'])
+        np.testing.assert_array_equal(from_masks['percentage'], from_answers['percentage'])
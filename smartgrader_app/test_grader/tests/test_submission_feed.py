@@ -0,0 +1,141 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase
+
+from test_grader.models import DeletedSubmission, Submission
+from test_grader.models import Test as GradedTest
+from test_grader.pagination import InvalidCursor
+from test_grader.stats import next_change, record_submissions
+from test_grader.submission_feed import submissions_page
+
+
+class SubmissionsPageTests(TestCase):
+    def setUp(self):
+        teacher = get_user_model().objects.create_user(email='teacher@example.com', password='secret')
+        self.test = GradedTest.objects.create(
+            title='Quiz',
+            questions=[{'question': 'Q1', 'options': ['a', 'b'], 'correct_answer': [0]}],
+            num_questions=1,
+            num_options=2,
+            created_by=teacher,
+        )
+
+    def add(self, *names):
+        """Write submissions the way grading does: one change number per batch, then the stats."""
+        with transaction.atomic():
+            change_seq = next_change(self.test.id)
+            submissions = Submission.objects.bulk_create([
+                Submission(
+                    test=self.test,
+                    first_name=name,
+                    last_name='Student',
+                    image='sheets/sheet.jpg',
+                    answers=[[0]],
+                    score=1,
+                    total_questions=1,
+                    percentage=100,
+                    processed=True,
+                    change_seq=change_seq,
+                )
+                for name in names
+            ])
+            record_submissions(self.test.id, submissions)
+        return submissions
+
+    def rename(self, submission, first_name):
+        with transaction.atomic():
+            submission.first_name = first_name
+            submission.change_seq = next_change(self.test.id)
+            submission.save(update_fields=['first_name', 'change_seq'])
+
+    def page(self, **kwargs):
+        return submissions_page(GradedTest.objects.get(id=self.test.id), **kwargs)
+
+    def sync(self, since, limit):
+        """Follow a sync cursor until the test is caught up; returns (names, deleted ids, sync cursor)."""
+        names, deleted = [], []
+        while True:
+            page = self.page(since=since, limit=limit)
+            names += [row['first_name'] for row in page['submissions']]
+            deleted += page['deleted']
+            since = page['sync_cursor']
+            if not page['has_more']:
+                return names, deleted, since
+
+    def test_browse_pages_walk_newest_first(self):
+        for index in range(5):
+            self.add(f'S{index}')
+
+        names = []
+        cursor = None
+        while True:
+            page = self.page(limit=2, cursor=cursor)
+            names += [row['first_name'] for row in page['submissions']]
+            self.assertEqual(page['has_more'], page['next_cursor'] is not None)
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(names, ['S4', 'S3', 'S2', 'S1', 'S0'])
+        self.assertEqual(page['count'], 5)
+        self.assertEqual(page['correct_answers'], [[0]])
+
+    def test_sync_cursor_returns_only_later_changes(self):
+        self.add('A0', 'A1')
+        synced = self.page()['sync_cursor']
+
+        quiet = self.page(since=synced)
+        self.assertEqual((quiet['submissions'], quiet['deleted'], quiet['sync_cursor']), ([], [], synced))
+
+        self.add('B0')
+        names, deleted, _ = self.sync(synced, limit=50)
+        self.assertEqual((names, deleted), (['B0'], []))
+
+    def test_sync_pages_split_a_single_change(self):
+        self.add('A0')
+        synced = self.page()['sync_cursor']
+        self.add(*[f'B{index}' for index in range(7)])
+
+        names, _, synced = self.sync(synced, limit=3)
+
+        self.assertEqual(names, [f'B{index}' for index in range(7)])
+        self.assertEqual(self.page(since=synced)['submissions'], [])
+
+    def test_renamed_submission_is_sent_again(self):
+        first, _ = self.add('A0', 'A1')
+        synced = self.page()['sync_cursor']
+
+        self.rename(first, 'Renamed')
+
+        names, _, _ = self.sync(synced, limit=50)
+        self.assertEqual(names, ['Renamed'])
+
+    def test_deletions_come_back_as_tombstones(self):
+        _, victim = self.add('A0', 'A1')
+        synced = self.page()['sync_cursor']
+
+        victim_id = victim.id
+        victim.delete()
+
+        self.assertTrue(DeletedSubmission.objects.filter(submission_id=victim_id).exists())
+        page = self.page(since=synced)
+        self.assertEqual((page['submissions'], page['deleted'], page['count']), ([], [victim_id], 1))
+        self.assertEqual(self.page(since=page['sync_cursor'])['deleted'], [])
+
+    def test_tombstones_between_paged_changes_are_sent_once(self):
+        (old,) = self.add('A0')
+        synced = self.page()['sync_cursor']
+
+        self.add('C0', 'C1', 'C2')
+        old_id = old.id
+        old.delete()
+        self.add('D0', 'D1', 'D2')
+
+        names, deleted, _ = self.sync(synced, limit=2)
+
+        self.assertEqual(names, ['C0', 'C1', 'C2', 'D0', 'D1', 'D2'])
+        self.assertEqual(deleted, [old_id])
+
+    def test_rejects_a_cursor_it_did_not_produce(self):
+        with self.assertRaises(InvalidCursor):
+            self.page(since='not-a-cursor')
@@ -7,7 +7,12 @@ urlpatterns = [
     path('tests/<int:test_id>/submissions/', views.get_test_submissions, name='get-submissions'),
     path('tests/<int:test_id>/submissions/<int:submission_id>/', views.submission_detail_page, name='submission-detail'),
     path('tests/<int:test_id>/submissions/<int:submission_id>/update-name/', views.update_submission_name, name='update-submission-name'),
+    path('tests/<int:test_id>/pdf/file/', views.test_pdf_file, name='test-pdf-file'),
+    path('submissions/<int:submission_id>/image/<str:kind>/', views.submission_image, name='submission-image'),
     path('tests/<int:test_id>/export-csv/', views.export_results_csv, name='export-csv'),
+    path('tests/<int:test_id>/answer-key/', views.update_answer_key, name='update-answer-key'),
+    path('grading-jobs/<int:job_id>/', views.grading_job_status, name='grading-job'),
+    path('metrics/', views.omr_metrics, name='omr-metrics'),
 
     # Teacher share code management
     path('tests/<int:test_id>/generate-share-code/', views.generate_share_code_view, name='generate-share-code'),
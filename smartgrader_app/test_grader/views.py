@@ -1,17 +1,17 @@
 import csv
+import hmac
 import json
 import os
-import shutil
 import sys
 import zipfile
 from pathlib import Path
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
-from django.http import HttpResponse, JsonResponse
+from django.db import transaction
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
 
 from test_generator.models import TestEntry
@@ -20,9 +20,20 @@ PROJECT_ROOT = Path(__file__).resolve().parents[2]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.append(str(PROJECT_ROOT))
 
-from grade_processor.omr_main import grade_submission, process_omr_image  # noqa: E402
+from grade_processor import instrumentation  # noqa: E402
 
-from .models import Submission, Test
+from .answer_keys import get_answer_key
+from .grading import save_answer_key
+from .jobs import create_job, job_results
+from .media import send_protected_file
+from .models import GradingJob, Submission, Test, TestStats
+from .pagination import InvalidCursor, parse_limit
+from .processing import IMAGE_EXTENSIONS, ZipMemberTooLarge, process_single_submission, uploaded_image
+from .stats import get_test_stats, next_change
+from .submission_feed import SUBMISSIONS_MAX_PAGE_SIZE, SUBMISSIONS_PAGE_SIZE, submissions_page
+
+# Submissions fetched from the database per round trip while streaming a CSV export
+EXPORT_CHUNK_SIZE = 2000
 
 
 def _normalize_questions(raw_questions):
@@ -88,22 +99,21 @@ def _get_or_create_test(test_id, user):
             created_by=entry.owner,
             num_questions=len(questions),
             num_options=num_options or 5,
+            sheet_geometry=payload.get('sheet_geometry'),
         )
         test.save()
         return test
 
 
-def _temp_dir(test_id):
-    """Create and return the temporary directory for a test's uploads."""
-    temp_dir = Path(settings.MEDIA_ROOT) / 'temp' / f'test_{test_id}'
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    return temp_dir
+def _test_pdf_path(test_id):
+    """Path of the PDF generated for a test by test_generator."""
+    return Path(settings.GENERATED_TESTS_ROOT) / f"test_{test_id}.pdf"
 
 
 @csrf_exempt
 @login_required
 def upload_submissions(request, test_id):
-    """Upload and process student submissions (images or zip file)."""
+    """Queue uploaded student sheets (images or zip file) for grading and return the job to poll."""
     if request.method != "POST":
         return JsonResponse({"error": "Only POST allowed"}, status=405)
 
@@ -112,117 +122,95 @@ def upload_submissions(request, test_id):
     except (Test.DoesNotExist, TestEntry.DoesNotExist):
         return JsonResponse({"error": "Test not found"}, status=404)
 
-    # Extract correct answers and grading modes for all questions
-    correct_answers = [q['correct_answer'] for q in test.questions]
-    grading_modes = [q.get('grading_mode', 'all_or_nothing') for q in test.questions]
     uploaded_files = request.FILES.getlist('files')
     zip_file = request.FILES.get('zip_file')
 
-    results = []
-    errors = []
-    temp_dir = _temp_dir(test_id)
-
-    if zip_file:
-        zip_path = temp_dir / zip_file.name
-        extract_path = temp_dir / 'extracted'
-        try:
-            with open(zip_path, 'wb+') as destination:
-                for chunk in zip_file.chunks():
-                    destination.write(chunk)
-
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_path)
-
-            for root, _, files in os.walk(extract_path):
-                for filename in files:
-                    if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-                        image_path = Path(root) / filename
-                        result = process_single_submission(test, str(image_path), filename, correct_answers, grading_modes)
-                        results.append(result)
-        except Exception as exc:
-            errors.append(f"Error processing zip file: {exc}")
-        finally:
-            if zip_path.exists():
-                zip_path.unlink()
-            shutil.rmtree(extract_path, ignore_errors=True)
-
-    elif uploaded_files:
-        for uploaded_file in uploaded_files:
-            temp_path = temp_dir / uploaded_file.name
-            with open(temp_path, 'wb+') as destination:
-                for chunk in uploaded_file.chunks():
-                    destination.write(chunk)
+    # Re-uploading an image already graded for this test returns the existing submission
+    dedupe = settings.OMR_DEDUPE_SUBMISSIONS
+    if 'dedupe' in request.POST:
+        dedupe = request.POST['dedupe'].lower() in ('1', 'true', 'yes', 'on')
 
-            try:
-                result = process_single_submission(test, str(temp_path), uploaded_file.name, correct_answers, grading_modes)
-                results.append(result)
-            finally:
-                if temp_path.exists():
-                    temp_path.unlink()
-    else:
+    if not zip_file and not uploaded_files:
         return JsonResponse({"error": "No files uploaded"}, status=400)
 
+    try:
+        job = create_job(test, request.user, uploaded_files=uploaded_files, zip_file=zip_file, dedupe=dedupe)
+    except zipfile.BadZipFile:
+        return JsonResponse({"error": "Uploaded file is not a valid zip archive"}, status=400)
+    except ZipMemberTooLarge as exc:
+        return JsonResponse({"error": str(exc)}, status=400)
+
     return JsonResponse(
         {
-            "message": f"Processed {len(results)} submission(s)",
-            "results": results,
-            "errors": errors,
+            "message": f"Queued {job.total} submission(s) for grading",
+            "job_id": job.id,
+            "status": job.status,
+            "total": job.total,
+            "progress_url": reverse("grading-job", args=[job.id]),
         },
-        status=200,
+        status=202,
     )
 
 
-def process_single_submission(test, image_path, filename, correct_answers, grading_modes):
-    """Process a single submission image."""
+@login_required
+def grading_job_status(request, job_id):
+    """Report a grading job's progress; results from index `offset` on are included."""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET allowed'}, status=405)
+
     try:
-        omr_result = process_omr_image(image_path, test.num_questions, test.num_options, darkness_threshold=0.6)
-        if not omr_result['success']:
-            return {
-                'filename': filename,
-                'success': False,
-                'error': omr_result.get('error') or 'Unable to process image',
-            }
+        job = GradingJob.objects.get(id=job_id, created_by=request.user)
+    except GradingJob.DoesNotExist:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+
+    try:
+        offset = max(0, int(request.GET.get('offset', 0)))
+    except ValueError:
+        return JsonResponse({'error': 'offset must be an integer'}, status=400)
 
-        detected_answers = omr_result['answers']
-        grading = grade_submission(detected_answers, correct_answers, grading_modes)
+    return JsonResponse({
+        'job_id': job.id,
+        'test_id': job.test_id,
+        'status': job.status,
+        'finished': job.is_finished,
+        'total': job.total,
+        'done': job.done,
+        'failed': job.failed,
+        'offset': offset,
+        'results': job_results(job, offset),
+        'errors': job.errors,
+    })
 
-        submission_image_path = f"submissions/test_{test.id}_{filename}"
-        with open(image_path, 'rb') as image_file:
-            saved_path = default_storage.save(submission_image_path, ContentFile(image_file.read()))
 
-        submission = Submission.objects.create(
-            test=test,
-            student_user=None,
-            first_name='',
-            last_name='',
-            image=saved_path,
-            answers=detected_answers,
-            score=grading['score'],
-            total_questions=grading['total'],
-            percentage=grading['percentage'],
-            processed=True,
-        )
+def _may_read_metrics(request):
+    """Staff users, or a scraper sending `Authorization: Bearer <OMR_METRICS_TOKEN>`."""
+    token = settings.OMR_METRICS_TOKEN
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return request.user.is_authenticated and request.user.is_staff
 
-        return {
-            'filename': filename,
-            'success': True,
-            'submission_id': submission.id,
-            'score': grading['score'],
-            'total': grading['total'],
-            'percentage': grading['percentage'],
-        }
 
-    except Exception as exc:
-        return {
-            'filename': filename,
-            'success': False,
-            'error': str(exc),
-        }
+def omr_metrics(request):
+    """Serve this process's OMR timing histograms in the Prometheus text format."""
+    if not settings.OMR_INSTRUMENTATION:
+        return JsonResponse({'error': 'Metrics are disabled'}, status=404)
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET allowed'}, status=405)
+    if not _may_read_metrics(request):
+        return JsonResponse({'error': 'Not allowed to read metrics'}, status=403)
+
+    return HttpResponse(instrumentation.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @login_required
 def get_test_submissions(request, test_id):
-    """Get all submissions for a test."""
+    """
+    Return a page of a test's submissions, newest first.
+
+    Pass next_cursor back as ?cursor= for the following page, and sync_cursor
+    as ?since= to fetch only the submissions created or changed since this
+    response; see test_grader.submission_feed.
+    """
     if request.method != 'GET':
         return JsonResponse({'error': 'Only GET allowed'}, status=405)
 
@@ -231,45 +219,13 @@ def get_test_submissions(request, test_id):
     except (Test.DoesNotExist, TestEntry.DoesNotExist):
         return JsonResponse({"error": "Test not found"}, status=404)
 
-    correct_answers = [q.get('correct_answer') for q in test.questions]
-    submissions = test.submissions.all()
-    submissions_data = []
-    for sub in submissions:
-        image_url = sub.image.url if sub.image else None
-        if image_url:
-            image_url = request.build_absolute_uri(image_url)
-
-        submissions_data.append(
-            {
-                'id': sub.id,
-                'student_name': sub.full_name,
-                'first_name': sub.first_name or '',
-                'last_name': sub.last_name or '',
-                'score': sub.score,
-                'total': sub.total_questions,
-                'percentage': sub.percentage,
-                'submitted_at': sub.submitted_at.strftime('%Y-%m-%d %H:%M'),
-                'image_url': image_url,
-                'answers': sub.answers,
-                'correct_answers': correct_answers,
-            }
-        )
-
-    average_percentage = (
-        round(sum(sub['percentage'] for sub in submissions_data) / len(submissions_data), 2)
-        if submissions_data
-        else 0
-    )
+    try:
+        limit = parse_limit(request.GET.get('limit'), SUBMISSIONS_PAGE_SIZE, SUBMISSIONS_MAX_PAGE_SIZE)
+        data = submissions_page(test, limit, cursor=request.GET.get('cursor'), since=request.GET.get('since'))
+    except (InvalidCursor, ValueError):
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
 
-    return JsonResponse(
-        {
-            'submissions': submissions_data,
-            'count': len(submissions_data),
-            'average_percentage': average_percentage,
-            'correct_answers': correct_answers,
-        },
-        status=200,
-    )
+    return JsonResponse(data, status=200)
 
 
 @login_required
@@ -281,26 +237,10 @@ def submission_detail_page(request, test_id, submission_id):
     except (Test.DoesNotExist, Submission.DoesNotExist, TestEntry.DoesNotExist):
         return render(request, 'test_grader/test_not_found.html', status=404)
 
+    key = get_answer_key(test)
     answer_details = []
     for i, question in enumerate(test.questions):
         student_answer = submission.answers[i] if i < len(submission.answers) else None
-        correct_answer = question['correct_answer']
-        grading_mode = question.get('grading_mode', 'all_or_nothing')
-
-        # Normalize both to sets for comparison
-        student_set = set()
-        if isinstance(student_answer, list):
-            student_set = set(student_answer)
-        elif isinstance(student_answer, int):
-            student_set = {student_answer}
-
-        correct_set = set()
-        if isinstance(correct_answer, list):
-            correct_set = set(correct_answer)
-        elif isinstance(correct_answer, int):
-            correct_set = {correct_answer}
-
-        is_correct = student_set == correct_set
 
         answer_details.append(
             {
@@ -308,9 +248,9 @@ def submission_detail_page(request, test_id, submission_id):
                 'question_text': question['question'],
                 'options': question['options'],
                 'student_answer': student_answer,
-                'correct_answer': correct_answer,
-                'is_correct': is_correct,
-                'grading_mode': grading_mode,
+                'correct_answer': key.correct_answers[i],
+                'is_correct': key.is_correct(i, student_answer),
+                'grading_mode': key.grading_modes[i],
             }
         )
 
@@ -322,6 +262,53 @@ def submission_detail_page(request, test_id, submission_id):
     return render(request, 'test_grader/submission_detail.html', context)
 
 
+@login_required
+def submission_image(request, submission_id, kind):
+    """Serve a submission's original photo, review image or preview to its teacher or student."""
+    if kind not in ('original', 'review', 'preview'):
+        raise Http404('Unknown image')
+
+    submission = (
+        Submission.objects.select_related('test')
+        .only('image', 'warped_image', 'thumbnail', 'student_user_id', 'test__created_by_id')
+        .filter(id=submission_id)
+        .first()
+    )
+    # Anyone else gets the same 404 as for a submission that doesn't exist
+    if submission is None or request.user.id not in (submission.test.created_by_id, submission.student_user_id):
+        raise Http404('Submission not found')
+
+    image = submission.image_for(kind)
+    if not image:
+        raise Http404('Image not found')
+    return send_protected_file(request, image.path, 'media', image.name)
+
+
+def _accessed_test_ids(request):
+    return {t.get('id') for t in request.session.get('accessed_tests', [])}
+
+
+@login_required
+def test_pdf_file(request, test_id):
+    """Serve a test's printable PDF to its teacher and to the students it was shared with."""
+    test = Test.objects.filter(id=test_id).only('created_by_id', 'is_open_for_submissions').first()
+    allowed = (
+        TestEntry.objects.filter(id=test_id, owner=request.user).exists()
+        if test is None
+        else (
+            test.created_by_id == request.user.id
+            # Students who opened the test through its share code (see student_test_access)
+            or (test.is_open_for_submissions and test_id in _accessed_test_ids(request))
+            or test.submissions.filter(student_user=request.user).exists()
+        )
+    )
+    if not allowed:
+        raise Http404('Test not found')
+
+    pdf_path = _test_pdf_path(test_id)
+    return send_protected_file(request, str(pdf_path), 'pdf', pdf_path.name, filename=pdf_path.name)
+
+
 @csrf_exempt
 @login_required
 def update_submission_name(request, test_id, submission_id):
@@ -348,7 +335,9 @@ def update_submission_name(request, test_id, submission_id):
 
     submission.first_name = first_name
     submission.last_name = last_name
-    submission.save()
+    with transaction.atomic():
+        submission.change_seq = next_change(test.id)
+        submission.save(update_fields=['first_name', 'last_name', 'change_seq'])
 
     return JsonResponse(
         {
@@ -360,32 +349,61 @@ def update_submission_name(request, test_id, submission_id):
     )
 
 
-@login_required
-def export_results_csv(request, test_id):
-    """Export test results to CSV."""
-    try:
-        test = _get_or_create_test(test_id, request.user)
-    except (Test.DoesNotExist, TestEntry.DoesNotExist):
-        return HttpResponse("Test not found", status=404)
+class _Echo:
+    """File-like object whose write() hands back the line, so csv.writer can feed a streaming response."""
 
-    submissions = test.submissions.filter(processed=True).order_by('-percentage')
+    def write(self, value):
+        return value
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="test_{test_id}_results.csv"'
 
-    writer = csv.writer(response)
+def _answer_cells(key):
+    """
+    Return a function turning a detected answer into its CSV cell, e.g. 'A,C' or '-'.
+
+    Single options and blanks are looked up in a table built up front; other
+    combinations are labelled once and remembered, so a large export formats
+    each distinct answer only once.
+    """
+    cells = {(): '-'}
+    for option, label in enumerate(key.option_labels):
+        cells[(option,)] = label
+
+    def cell(answer):
+        if answer is None:
+            options = ()
+        elif isinstance(answer, list):
+            options = tuple(answer)
+        else:
+            options = (answer,)
+        try:
+            return cells[options]
+        except KeyError:
+            # Multiple answers are shown as "A,C,E"
+            cells[options] = key.answer_label(list(options), ',') or '-'
+            return cells[options]
+        except TypeError:
+            return key.answer_label(answer, ',') or '-'
+
+    return cell
+
+
+def _results_csv_rows(test, stats):
+    """Yield the export's rows one at a time, reading submissions in chunks of EXPORT_CHUNK_SIZE."""
+    num_questions = test.num_questions
     header = ['Rank', 'First Name', 'Last Name', 'Score', 'Total', 'Percentage', 'Grade', 'Submitted At']
-    for i in range(test.num_questions):
-        header.append(f'Q{i+1}')
-    writer.writerow(header)
-
-    option_letters = ['A', 'B', 'C', 'D', 'E']
-    for rank, submission in enumerate(submissions, start=1):
-        grade_letter = (
-            'A' if submission.percentage >= 90 else 'B' if submission.percentage >= 80 else 'C'
-            if submission.percentage >= 70 else 'D' if submission.percentage >= 60 else 'F'
+    header.extend(f'Q{i + 1}' for i in range(num_questions))
+    yield header
+
+    cell = _answer_cells(get_answer_key(test))
+    submissions = (
+        test.submissions.filter(processed=True)
+        .only(
+            'id', 'test_id', 'first_name', 'last_name', 'score', 'total_questions', 'percentage', 'submitted_at', 'answers'
         )
-
+        .order_by('-percentage', 'id')
+    )
+    for rank, submission in enumerate(submissions.iterator(chunk_size=EXPORT_CHUNK_SIZE), start=1):
+        answers = submission.answers or []
         row = [
             rank,
             submission.first_name or '',
@@ -393,45 +411,48 @@ def export_results_csv(request, test_id):
             submission.score,
             submission.total_questions,
             f'{submission.percentage}%',
-            grade_letter,
+            TestStats.grade_for(submission.percentage),
             submission.submitted_at.strftime('%Y-%m-%d %H:%M'),
         ]
+        row.extend(cell(answers[i] if i < len(answers) else None) for i in range(num_questions))
+        yield row
+
+    yield []
+    yield ['SUMMARY STATISTICS']
+    yield ['Total Submissions', stats.submission_count]
+
+    if stats.submission_count > 0:
+        yield ['Average Score', f'{stats.average_score:.2f}/{num_questions}']
+        yield ['Average Percentage', f'{stats.average_percentage:.2f}%']
+        yield ['Highest Score', stats.max_score]
+        yield ['Lowest Score', stats.min_score]
+        yield [
+            f'Pass Rate (>={TestStats.PASS_PERCENTAGE}%)',
+            f'{stats.pass_count}/{stats.submission_count} ({stats.pass_rate:.1f}%)',
+        ]
 
-        for i in range(test.num_questions):
-            if i < len(submission.answers):
-                answer = submission.answers[i]
-
-                if answer is None:
-                    row.append('-')
-                elif isinstance(answer, list):
-                    # Multiple answers - show as "A,C,E"
-                    answer_str = ','.join([option_letters[idx] if idx < len(option_letters) else str(idx)
-                                          for idx in sorted(answer)])
-                    row.append(answer_str)
-                else:
-                    # Single answer
-                    row.append(option_letters[answer] if answer < len(option_letters) else str(answer))
-            else:
-                row.append('-')
-
-        writer.writerow(row)
-
-    writer.writerow([])
-    writer.writerow(['SUMMARY STATISTICS'])
-    writer.writerow(['Total Submissions', submissions.count()])
-
-    if submissions.count() > 0:
-        avg_score = sum(s.score for s in submissions) / submissions.count()
-        avg_pct = sum(s.percentage for s in submissions) / submissions.count()
-        writer.writerow(['Average Score', f'{avg_score:.2f}/{test.num_questions}'])
-        writer.writerow(['Average Percentage', f'{avg_pct:.2f}%'])
-        writer.writerow(['Highest Score', max(s.score for s in submissions)])
-        writer.writerow(['Lowest Score', min(s.score for s in submissions)])
-        pass_count = len([s for s in submissions if s.percentage >= 60])
-        writer.writerow(
-            ['Pass Rate (>=60%)', f'{pass_count}/{submissions.count()} ({pass_count/submissions.count()*100:.1f}%)']
-        )
 
+@login_required
+def export_results_csv(request, test_id):
+    """
+    Export test results to CSV.
+
+    The file is streamed row by row as submissions are read, so the download
+    starts at once and memory stays flat however many submissions the test has.
+    """
+    try:
+        test = _get_or_create_test(test_id, request.user)
+    except (Test.DoesNotExist, TestEntry.DoesNotExist):
+        return HttpResponse("Test not found", status=404)
+
+    # Read before streaming starts, so a missing row can't fail halfway through the download
+    stats = get_test_stats(test)
+    writer = csv.writer(_Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in _results_csv_rows(test, stats)),
+        content_type='text/csv',
+    )
+    response['Content-Disposition'] = f'attachment; filename="test_{test_id}_results.csv"'
     return response
 
 
@@ -494,6 +515,38 @@ def toggle_submissions(request, test_id):
     })
 
 
+@login_required
+def update_answer_key(request, test_id):
+    """Replace a test's answer key and regrade every existing submission against it."""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST allowed'}, status=405)
+
+    try:
+        test = _get_or_create_test(test_id, request.user)
+    except (Test.DoesNotExist, TestEntry.DoesNotExist):
+        return JsonResponse({"error": "Test not found"}, status=404)
+
+    try:
+        data = json.loads(request.body or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    correct_answers = data.get('correct_answers')
+    if not isinstance(correct_answers, list):
+        return JsonResponse({'error': 'correct_answers must be a list'}, status=400)
+
+    try:
+        result = save_answer_key(test, correct_answers, data.get('grading_modes'))
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'answer_key_version': result['answer_key_version'],
+        'regraded': result['regraded'],
+    })
+
+
 @login_required
 def get_share_info(request, test_id):
     """Get share code and settings for a test."""
@@ -632,16 +685,10 @@ def student_test_access(request, share_code):
     request.session.modified = True
 
     # Check if PDF exists for this test
-    pdf_path = Path(settings.BASE_DIR) / "static" / "generated" / f"test_{test.id}.pdf"
     pdf_url = None
     # Use os.path.exists since Path.exists() might have issues with special characters
-    if os.path.exists(str(pdf_path)):
-        static_url = settings.STATIC_URL or "/static/"
-        if not static_url.startswith(("http://", "https://", "/")):
-            static_url = f"/{static_url}"
-        if not static_url.endswith("/"):
-            static_url = f"{static_url}/"
-        pdf_url = f"{static_url}generated/test_{test.id}.pdf"
+    if os.path.exists(str(_test_pdf_path(test.id))):
+        pdf_url = reverse('test-pdf-file', args=[test.id])
 
     context = {
         'test': test,
@@ -694,31 +741,13 @@ def student_submit_answers(request, share_code):
         return JsonResponse({'error': 'No file uploaded'}, status=400)
 
     # Validate file type
-    if not uploaded_file.name.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
+    if not uploaded_file.name.lower().endswith(IMAGE_EXTENSIONS):
         return JsonResponse({'error': 'Invalid file type. Please upload an image.'}, status=400)
 
-    # Process the submission
-    temp_dir = _temp_dir(test.id)
-    temp_path = temp_dir / f"student_{request.user.id}_{uploaded_file.name}"
-
     try:
-        # Save uploaded file temporarily
-        with open(temp_path, 'wb+') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
-
-        # Extract correct answers and grading modes
-        correct_answers = [q['correct_answer'] for q in test.questions]
-        grading_modes = [q.get('grading_mode', 'all_or_nothing') for q in test.questions]
-
-        # Process with OMR
-        result = process_single_submission(
-            test,
-            str(temp_path),
-            uploaded_file.name,
-            correct_answers,
-            grading_modes
-        )
+        # Process with OMR; the submission is stored as the student's in the same insert
+        with uploaded_image(uploaded_file) as image:
+            result = process_single_submission(test, image, uploaded_file.name, student=request.user)
 
         if not result.get('success'):
             return JsonResponse({
@@ -726,20 +755,13 @@ def student_submit_answers(request, share_code):
                 'error': result.get('error', 'Failed to process answer sheet')
             }, status=400)
 
-        # Update the submission with student user
-        submission = Submission.objects.get(id=result['submission_id'])
-        submission.student_user = request.user
-        submission.first_name = request.user.first_name
-        submission.last_name = request.user.last_name
-        submission.save()
-
         return JsonResponse({
             'success': True,
-            'submission_id': submission.id,
+            'submission_id': result['submission_id'],
             'score': result['score'],
             'total': result['total'],
             'percentage': result['percentage'],
-            'redirect_url': f'/student/test/{share_code}/result/{submission.id}/'
+            'redirect_url': f"/student/test/{share_code}/result/{result['submission_id']}/"
         })
 
     except Exception as exc:
@@ -747,10 +769,6 @@ def student_submit_answers(request, share_code):
             'success': False,
             'error': f'Error processing submission: {str(exc)}'
         }, status=500)
-    finally:
-        # Clean up temp file
-        if temp_path.exists():
-            temp_path.unlink()
 
 
 @login_required
@@ -780,56 +798,27 @@ def student_submission_result(request, share_code, submission_id):
         }, status=404)
 
     # Build answer details
+    key = get_answer_key(test)
     answer_details = []
     for i, question in enumerate(test.questions):
         student_answer = submission.answers[i] if i < len(submission.answers) else None
-        correct_answer = question['correct_answer']
-
-        # Normalize to sets for comparison
-        student_set = set()
-        if isinstance(student_answer, list):
-            student_set = set(student_answer)
-        elif isinstance(student_answer, int):
-            student_set = {student_answer}
-
-        correct_set = set()
-        if isinstance(correct_answer, list):
-            correct_set = set(correct_answer)
-        elif isinstance(correct_answer, int):
-            correct_set = {correct_answer}
-
-        is_correct = student_set == correct_set
-
-        # Convert answers to letter format (A, B, C, etc.)
-        def to_letter(ans):
-            if ans is None:
-                return None
-            if isinstance(ans, list):
-                return [chr(65 + a) for a in ans]
-            return chr(65 + ans)
 
         answer_details.append({
             'question_num': i + 1,
             'question_text': question['question'],
             'options': question['options'],
             'student_answer': student_answer,
-            'correct_answer': correct_answer,
-            'student_answer_letter': to_letter(student_answer),
-            'correct_answer_letter': to_letter(correct_answer),
-            'is_correct': is_correct,
+            'correct_answer': key.correct_answers[i],
+            'student_answer_letter': key.answer_label(student_answer),
+            'correct_answer_letter': key.correct_labels[i],
+            'is_correct': key.is_correct(i, student_answer),
             })
 
     # Check if PDF exists for this test
-    pdf_path = Path(settings.BASE_DIR) / "static" / "generated" / f"test_{test.id}.pdf"
     pdf_url = None
     # Use os.path.exists since Path.exists() might have issues with special characters
-    if os.path.exists(str(pdf_path)):
-        static_url = settings.STATIC_URL or "/static/"
-        if not static_url.startswith(("http://", "https://", "/")):
-            static_url = f"/{static_url}"
-        if not static_url.endswith("/"):
-            static_url = f"{static_url}/"
-        pdf_url = f"{static_url}generated/test_{test.id}.pdf"
+    if os.path.exists(str(_test_pdf_path(test.id))):
+        pdf_url = reverse('test-pdf-file', args=[test.id])
 
     context = {
         'test': test,